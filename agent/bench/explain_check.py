@@ -0,0 +1,153 @@
+"""
+Query plan check for the catalog tools
+Runs each catalog tool against a large synthetic catalog with a cursor that
+EXPLAINs every statement first, and fails if any plan sequentially scans
+`wines`. Catches tool queries that the migrations in src/migrations.py do not
+index.
+
+    uv run python bench/explain_check.py postgresql://localhost/dionysus_bench --seed --catalog-size 200000
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import psycopg2
+import psycopg2.extensions
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SRC_DIR)
+
+import db
+
+# Tool name and arguments for each query shape the tools can produce
+SCENARIOS = [
+    ("search_wines", {"region": "burgundy"}),
+    ("search_wines", {"region": "france", "max_price": 150}),
+    ("search_wines", {"wine_type": "red", "min_price": 50, "max_price": 200}),
+    ("search_wines", {"grape_variety": "pinot noir"}),
+    ("get_wine_details", {"wine_name": "montrose"}),
+    ("get_similar_wines", {"wine_id": 42}),
+    ("show_wine_regions", {}),
+    ("show_wine_types", {}),
+    ("get_investment_wines", {}),
+    ("get_investment_wines", {"region": "bordeaux", "min_score": 8}),
+    ("show_investment_chart", {"wine_id": 42}),
+    ("show_investment_chart", {"wine_name": "lafleur"}),
+    ("show_investment_chart", {"region": "tuscany"}),
+    ("show_investment_chart", {}),
+    ("calculate_wine_roi", {"wine_id": 42}),
+    ("calculate_wine_roi", {"wine_name": "latour"}),
+    ("build_portfolio", {"budget": 20000, "risk_level": "low"}),
+    ("build_portfolio", {"budget": 20000, "risk_level": "high"}),
+    ("show_wine_market", {}),
+]
+
+
+def seq_scans(plan: dict, table: str = "wines") -> list[dict]:
+    """Plan nodes that sequentially scan `table`."""
+    found = []
+    if "Seq Scan" in plan.get("Node Type", "") and plan.get("Relation Name") == table:
+        found.append(plan)
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child, table))
+    return found
+
+
+class ExplainingCursor(psycopg2.extensions.cursor):
+    """Runs EXPLAIN before each SELECT or EXECUTE and keeps the plans on the connection."""
+
+    def execute(self, query, vars=None):
+        keyword = query.lstrip().split(None, 1)[0].upper()
+        if keyword in ("SELECT", "EXECUTE"):
+            super().execute("EXPLAIN (FORMAT JSON) " + query, vars)
+            statement = self.mogrify(query, vars).decode()
+            if keyword == "EXECUTE":
+                name = statement.split(None, 2)[1]
+                statement = f"{statement} -- {db.QUERIES[name].sql}" if name in db.QUERIES else statement
+            self.connection.plans.append((statement, self.fetchone()[0][0]["Plan"]))
+        return super().execute(query, vars)
+
+
+class ExplainingConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.plans: list[tuple[str, dict]] = []
+
+
+async def check(database_url: str) -> list[str]:
+    """Run every scenario; returns one message per sequential scan found."""
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["ZEP_API_KEY"] = ""
+    os.environ["REPLAY_RECORD_DIR"] = ""
+    os.environ.setdefault("GROQ_API_KEY", "explain")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Every scenario has to reach Postgres to be EXPLAINed
+    os.environ["CATALOG_CACHE_MAX_ENTRIES"] = "0"
+    import agent as dionysus
+
+    connections: list[ExplainingConnection] = []
+
+    def explaining_connection(read_only: bool = False):
+        conn = psycopg2.connect(database_url, connection_factory=ExplainingConnection,
+                                cursor_factory=ExplainingCursor)
+        connections.append(conn)
+        return conn
+
+    dionysus.get_db_connection = explaining_connection
+    failures = []
+    for tool_name, kwargs in SCENARIOS:
+        connections.clear()
+        ctx = SimpleNamespace(deps=dionysus.session_states.new_deps("explain-check"))
+        result = await getattr(dionysus, tool_name)(ctx, **kwargs)
+        if isinstance(result, dict) and result.get("error"):
+            failures.append(f"{tool_name}({kwargs}) failed: {result['error']}")
+        for conn in connections:
+            for sql, plan in conn.plans:
+                for node in seq_scans(plan):
+                    statement = " ".join(sql.split())
+                    failures.append(f"{tool_name}({kwargs}) seq scan (filter: {node.get('Filter', '-')}): {statement}")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Fail if any catalog tool query sequentially scans wines")
+    parser.add_argument("database_url")
+    parser.add_argument("--seed", action="store_true", help="(re)create the synthetic catalog first")
+    parser.add_argument("--catalog-size", type=int, default=200000)
+    parser.add_argument("--json", help="also write the failures to this file")
+    args = parser.parse_args()
+
+    if args.seed:
+        from synthetic_catalog import seed
+        elapsed = seed(args.database_url, args.catalog_size, reset=True)
+        print(f"🍷 Seeded {args.catalog_size} wines in {elapsed:.2f}s")
+
+    from migrations import migrate, status
+    migrate(args.database_url)
+    pending = [f"{version} {name}" for version, name, done in status(args.database_url) if not done]
+    conn = psycopg2.connect(args.database_url)
+    conn.autocommit = True
+    # Index-only scans need an up-to-date visibility map
+    conn.cursor().execute("VACUUM ANALYZE wines")
+    conn.close()
+
+    failures = asyncio.run(check(args.database_url))
+    for migration in pending:
+        print(f"⏳ Migration pending: {migration}")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"pending": pending, "failures": failures}, f, indent=2)
+    if not failures:
+        print(f"✅ {len(SCENARIOS)} tool queries, no sequential scans on wines")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+Local stand-ins for Groq and Zep
+One FastAPI app that speaks enough of Groq's OpenAI-compatible chat API and
+Zep's v2 API for the agent to run its full tool loop offline.
+
+    uvicorn fake_services:app --port 8900
+    GROQ_BASE_URL=http://127.0.0.1:8900 ZEP_BASE_URL=http://127.0.0.1:8900 ZEP_API_KEY=bench ...
+
+Latency is configurable per process with FAKE_LLM_LATENCY (seconds before the
+first token), FAKE_LLM_TOKEN_DELAY (seconds between streamed tokens) and
+FAKE_ZEP_LATENCY.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.3"))
+FAKE_LLM_TOKEN_DELAY = float(os.getenv("FAKE_LLM_TOKEN_DELAY", "0.005"))
+FAKE_ZEP_LATENCY = float(os.getenv("FAKE_ZEP_LATENCY", "0.05"))
+
+REGIONS = ["burgundy", "bordeaux", "champagne", "tuscany", "rioja", "napa", "barolo", "chablis"]
+
+app = FastAPI(title="DIONYSUS bench fakes")
+stats = {"completions": 0, "tool_calls": 0, "zep": 0}
+
+
+def _last_user_text(messages: list) -> str:
+    for msg in reversed(messages):
+        if msg.get("role") == "user":
+            content = msg.get("content") or ""
+            return content if isinstance(content, str) else json.dumps(content)
+    return ""
+
+
+def choose_tool_call(messages: list, tools: list) -> dict | None:
+    """Scripted model: one tool call for a catalog question, then a text answer."""
+    if not tools or (messages and messages[-1].get("role") == "tool"):
+        return None
+    text = _last_user_text(messages).lower()
+    available = {t["function"]["name"] for t in tools}
+    region = next((r for r in REGIONS if r in text), None)
+    budget = re.search(r"£\s?([\d,]+)", text)
+
+    if "portfolio" in text and "build_portfolio" in available:
+        return {"name": "build_portfolio", "arguments": {"budget": float(budget.group(1).replace(",", "")) if budget else 10000}}
+    if "invest" in text and "get_investment_wines" in available:
+        return {"name": "get_investment_wines", "arguments": {"limit": 8, **({"region": region} if region else {})}}
+    if ("pair" in text or "goes with" in text) and "get_food_pairings" in available:
+        return {"name": "get_food_pairings", "arguments": {"wine_type": "red"}}
+    if "market" in text and "show_wine_market" in available:
+        return {"name": "show_wine_market", "arguments": {}}
+    if region and "search_wines" in available:
+        args = {"region": region, "limit": 8}
+        if budget:
+            args["max_price"] = float(budget.group(1).replace(",", ""))
+        return {"name": "search_wines", "arguments": args}
+    return None
+
+
+def _answer(messages: list) -> str:
+    if messages and messages[-1].get("role") == "tool":
+        return "Here are a few wines I think you'll love, each with a lovely balance of fruit and structure."
+    return "A lovely question. I'd suggest a classic Burgundy Pinot Noir, elegant and perfect for the occasion."
+
+
+def _chunk(completion_id: str, created: int, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "fake")
+    tool_call = choose_tool_call(messages, body.get("tools") or [])
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
+    created = int(time.time())
+    stats["completions"] += 1
+    if tool_call:
+        stats["tool_calls"] += 1
+
+    await asyncio.sleep(FAKE_LLM_LATENCY)
+
+    if not body.get("stream"):
+        message = {"role": "assistant", "content": None if tool_call else _answer(messages)}
+        if tool_call:
+            message["tool_calls"] = [{
+                "id": f"call_{uuid.uuid4().hex[:8]}",
+                "type": "function",
+                "function": {"name": tool_call["name"], "arguments": json.dumps(tool_call["arguments"])},
+            }]
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+        }
+
+    async def stream():
+        yield _chunk(completion_id, created, model, {"role": "assistant", "content": ""})
+        if tool_call:
+            yield _chunk(completion_id, created, model, {"tool_calls": [{
+                "index": 0,
+                "id": f"call_{uuid.uuid4().hex[:8]}",
+                "type": "function",
+                "function": {"name": tool_call["name"], "arguments": json.dumps(tool_call["arguments"])},
+            }]})
+            yield _chunk(completion_id, created, model, {}, "tool_calls")
+        else:
+            words = _answer(messages).split(" ")
+            for i, word in enumerate(words):
+                yield _chunk(completion_id, created, model, {"content": word + (" " if i < len(words) - 1 else "")})
+                await asyncio.sleep(FAKE_LLM_TOKEN_DELAY)
+            yield _chunk(completion_id, created, model, {}, "stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.post("/api/v2/graph/search")
+async def zep_graph_search(request: Request):
+    stats["zep"] += 1
+    await asyncio.sleep(FAKE_ZEP_LATENCY)
+    return {"edges": [
+        {"fact": "User prefers Burgundy Pinot Noir"},
+        {"fact": "User's budget is usually under £150"},
+        {"fact": "User enjoys wines with steak"},
+    ]}
+
+
+@app.post("/api/v2/users")
+async def zep_users(request: Request):
+    await asyncio.sleep(FAKE_ZEP_LATENCY)
+    return {"user_id": (await request.json()).get("user_id")}
+
+
+@app.post("/api/v2/threads/{thread_id}/messages")
+async def zep_thread_messages(thread_id: str):
+    await asyncio.sleep(FAKE_ZEP_LATENCY)
+    return {"added": True}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
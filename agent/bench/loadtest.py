@@ -0,0 +1,288 @@
+"""
+DIONYSUS load test
+Drives /agui and /chat/completions with concurrent simulated users against
+local stand-ins for Groq and Zep (and optionally a local Postgres seeded with
+a synthetic catalog), then reports throughput, p50/p95/p99 latency and
+time-to-first-token per endpoint.
+
+    # agent + fakes started for you, no database
+    uv run python bench/loadtest.py --users 20 --duration 30
+
+    # with a local Postgres seeded with 50k wines, failing if p95 regresses
+    uv run python bench/loadtest.py --database-url postgresql://localhost/bench \\
+        --seed --catalog-size 50000 --max-p95 agui=3.0 --max-p95 chat=1.5
+
+    # against an agent you started yourself
+    uv run python bench/loadtest.py --target http://127.0.0.1:8000
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+sys.path.insert(0, BENCH_DIR)
+
+UTTERANCES = [
+    "Show me some Burgundy wines under £150",
+    "What are the best investment wines from Bordeaux?",
+    "What goes with steak?",
+    "Build me a portfolio with £20,000",
+    "Tell me about Champagne",
+    "Give me a market overview",
+    "Any good Tuscany reds?",
+    "What's your cheapest Chablis?",
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_uvicorn(app: str, app_dir: str, port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app, "--app-dir", app_dir, "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        env={**os.environ, **env},
+    )
+
+
+async def _wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+def percentile(values: list[float], q: float):
+    """Nearest-rank percentile (None for no samples)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class Results:
+    def __init__(self):
+        self.latency: dict[str, list[float]] = {"agui": [], "chat": []}
+        self.ttft: dict[str, list[float]] = {"agui": [], "chat": []}
+        self.errors: dict[str, int] = {"agui": 0, "chat": 0}
+
+    def summary(self, elapsed: float) -> dict:
+        report = {"elapsed_s": round(elapsed, 2)}
+        for endpoint in ("agui", "chat"):
+            lat, ttft = self.latency[endpoint], self.ttft[endpoint]
+            report[endpoint] = {
+                "requests": len(lat),
+                "errors": self.errors[endpoint],
+                "throughput_rps": round(len(lat) / elapsed, 2) if elapsed else 0,
+                **{f"p{q}_s": _round(percentile(lat, q)) for q in (50, 95, 99)},
+                **{f"ttft_p{q}_s": _round(percentile(ttft, q)) for q in (50, 95, 99)},
+            }
+        return report
+
+
+def _round(value):
+    return round(value, 4) if value is not None else None
+
+
+async def agui_turn(client: httpx.AsyncClient, base: str, user: int, text: str, results: Results) -> None:
+    body = {
+        "threadId": f"bench-{user}",
+        "runId": uuid.uuid4().hex,
+        "state": {},
+        "messages": [{"id": uuid.uuid4().hex, "role": "user", "content": text}],
+        "tools": [],
+        "context": [],
+        "forwardedProps": {},
+    }
+    start = time.perf_counter()
+    first_token, failed = None, False
+    try:
+        async with client.stream("POST", f"{base}/agui/", json=body, headers={"Accept": "text/event-stream"}) as resp:
+            failed = resp.status_code != 200
+            async for line in resp.aiter_lines():
+                if first_token is None and '"TEXT_MESSAGE_CONTENT"' in line:
+                    first_token = time.perf_counter() - start
+                if '"RUN_ERROR"' in line:
+                    failed = True
+    except httpx.HTTPError:
+        failed = True
+    _record(results, "agui", start, first_token, failed)
+
+
+async def chat_turn(client: httpx.AsyncClient, base: str, user: int, text: str, results: Results) -> None:
+    body = {
+        "messages": [
+            {"role": "system", "content": f"Name: Bench User {user}"},
+            {"role": "user", "content": text},
+        ],
+        "stream": True,
+    }
+    start = time.perf_counter()
+    first_token, failed = None, False
+    try:
+        async with client.stream("POST", f"{base}/chat/completions", json=body) as resp:
+            failed = resp.status_code != 200
+            async for line in resp.aiter_lines():
+                if first_token is None and line.startswith("data:") and '"content"' in line:
+                    first_token = time.perf_counter() - start
+                if "I apologize, I encountered an issue" in line:
+                    failed = True
+    except httpx.HTTPError:
+        failed = True
+    _record(results, "chat", start, first_token, failed)
+
+
+def _record(results: Results, endpoint: str, start: float, first_token, failed: bool) -> None:
+    results.latency[endpoint].append(time.perf_counter() - start)
+    if first_token is not None:
+        results.ttft[endpoint].append(first_token)
+    if failed:
+        results.errors[endpoint] += 1
+
+
+async def simulated_user(client, base: str, user: int, deadline: float, voice_share: float,
+                         think_time: float, results: Results, rng: random.Random) -> None:
+    while time.monotonic() < deadline:
+        text = rng.choice(UTTERANCES)
+        if rng.random() < voice_share:
+            await chat_turn(client, base, user, text, results)
+        else:
+            await agui_turn(client, base, user, text, results)
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, think_time))
+
+
+async def run(args) -> dict:
+    processes = []
+    base = args.target
+    try:
+        if not base:
+            fakes_port, agent_port = _free_port(), _free_port()
+            processes.append(_start_uvicorn("fake_services:app", BENCH_DIR, fakes_port, {
+                "FAKE_LLM_LATENCY": str(args.llm_latency),
+                "FAKE_LLM_TOKEN_DELAY": str(args.token_delay),
+                "FAKE_ZEP_LATENCY": str(args.zep_latency),
+            }))
+            await _wait_ready(f"http://127.0.0.1:{fakes_port}/stats")
+
+            fakes = f"http://127.0.0.1:{fakes_port}"
+            agent_env = {
+                "GROQ_API_KEY": "bench",
+                "GROQ_BASE_URL": fakes,
+                "ZEP_API_KEY": "bench",
+                "ZEP_BASE_URL": fakes,
+                "DATABASE_URL": args.database_url or "",
+                "LOG_LEVEL": "WARNING",
+            }
+            processes.append(_start_uvicorn("agent:app", SRC_DIR, agent_port, agent_env))
+            base = f"http://127.0.0.1:{agent_port}"
+            await _wait_ready(f"{base}/health")
+
+        results = Results()
+        rng = random.Random(args.random_seed)
+        limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+        async with httpx.AsyncClient(timeout=args.request_timeout, limits=limits) as client:
+            if args.warmup:
+                await asyncio.gather(*(agui_turn(client, base, -1, UTTERANCES[0], Results()),
+                                       chat_turn(client, base, -1, UTTERANCES[0], Results())))
+            start = time.monotonic()
+            deadline = start + args.duration
+            await asyncio.gather(*(
+                simulated_user(client, base, user, deadline, args.voice_share, args.think_time, results,
+                               random.Random(rng.random()))
+                for user in range(args.users)
+            ))
+            elapsed = time.monotonic() - start
+        return results.summary(elapsed)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+
+def print_report(report: dict, args) -> None:
+    print(f"\n🍷 DIONYSUS load test: {args.users} users for {report['elapsed_s']}s\n")
+    header = f"{'endpoint':<8} {'reqs':>6} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'ttft50':>8} {'ttft95':>8} {'ttft99':>8}"
+    print(header)
+    print("-" * len(header))
+    for endpoint in ("agui", "chat"):
+        r = report[endpoint]
+        cells = [r[k] for k in ("p50_s", "p95_s", "p99_s", "ttft_p50_s", "ttft_p95_s", "ttft_p99_s")]
+        print(f"{endpoint:<8} {r['requests']:>6} {r['errors']:>5} {r['throughput_rps']:>8} "
+              + " ".join(f"{c:>8.3f}" if c is not None else f"{'-':>8}" for c in cells))
+
+
+def check_thresholds(report: dict, limits: list[str]) -> list[str]:
+    """Return a message for each `endpoint=seconds` p95 limit that was exceeded."""
+    failures = []
+    for limit in limits:
+        endpoint, _, seconds = limit.partition("=")
+        p95 = report.get(endpoint, {}).get("p95_s")
+        if p95 is not None and p95 > float(seconds):
+            failures.append(f"{endpoint} p95 {p95:.3f}s > {float(seconds):.3f}s")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load-test the DIONYSUS agent with local stand-ins")
+    parser.add_argument("--target", help="base URL of a running agent (default: start one)")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--voice-share", type=float, default=0.5, help="fraction of turns sent to /chat/completions")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max random pause between a user's turns")
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="fake Groq seconds before first token")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="fake Groq seconds between tokens")
+    parser.add_argument("--zep-latency", type=float, default=0.05, help="fake Zep response time")
+    parser.add_argument("--database-url", help="local Postgres for the catalog (omit to run without a DB)")
+    parser.add_argument("--seed", action="store_true", help="(re)create the synthetic catalog first")
+    parser.add_argument("--catalog-size", type=int, default=20000)
+    parser.add_argument("--request-timeout", type=float, default=60)
+    parser.add_argument("--random-seed", type=int, default=7)
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    parser.add_argument("--max-p95", action="append", default=[], metavar="ENDPOINT=SECONDS",
+                        help="fail if an endpoint's p95 exceeds this (repeatable)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    if args.seed:
+        if not args.database_url:
+            parser.error("--seed needs --database-url")
+        from synthetic_catalog import seed
+        elapsed = seed(args.database_url, args.catalog_size, reset=True)
+        print(f"🍷 Seeded {args.catalog_size} wines in {elapsed:.2f}s")
+
+    report = asyncio.run(run(args))
+    print_report(report, args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failures = check_thresholds(report, args.max_p95)
+    for failure in failures:
+        print(f"❌ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""
+Serialization and compression benchmark
+Encodes payloads shaped like the agent's large responses (search results,
+investment charts, catalog graph, a streamed completion) with the stdlib json
+module and with serialization.dumps, then compresses them with gzip and
+brotli at the settings CompressionMiddleware uses. Reports bytes and CPU
+microseconds per response for each.
+
+    uv run python bench/serialization_bench.py
+    uv run python bench/serialization_bench.py --repeat 2000 --json serialization.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from decimal import Decimal
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCH_DIR), "src")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, SRC_DIR)
+
+import serialization
+from catalog_graph import Graph
+from synthetic_catalog import generate_wines
+
+SEARCH_FIELDS = ("id", "name", "winery", "region", "country", "grape_variety", "vintage", "wine_type", "style",
+                 "color", "price_retail", "tasting_notes", "critic_scores", "image_url", "slug")
+
+
+def payloads(catalog_size: int) -> dict[str, object]:
+    wines = list(generate_wines(catalog_size))
+    search = [{**{f: w[f] for f in SEARCH_FIELDS}, "critic_scores": json.loads(w["critic_scores"]),
+               "price_retail": Decimal(str(w["price_retail"]))} for w in wines[:60]]
+    chart = {
+        "title": "Investment Performance",
+        "wines": [{"name": w["name"], "region": w["region"], "investment_score": w["investment_score"],
+                   "five_year_return": w["five_year_return"], "price_history": json.loads(w["price_history"])}
+                  for w in wines[:10]],
+    }
+    graph = Graph([(w["id"], w["name"], w["winery"], w["region"], w["country"], w["grape_variety"])
+                   for w in wines if w["is_active"]])
+    chosen, truncated = graph.neighbourhood("region:burgundy", 1, True)
+    words = ("A beautifully structured Burgundy with red cherry, forest floor and a long mineral finish. " * 10).split()
+    return {
+        "search_wines (10)": {"wines": search[:10], "title": "Burgundy Wines", "query": "burgundy"},
+        "search_wines (60)": {"wines": search, "title": "Burgundy Wines", "query": "burgundy"},
+        "investment chart": chart,
+        "graph (compact)": {**graph.payload(chosen, False), "truncated": truncated},
+        "graph (full)": {**graph.payload(chosen, True), "truncated": truncated},
+        "completion chunk": [{
+            "id": "chatcmpl-1234abcd", "object": "chat.completion.chunk", "created": 1700000000, "model": "dionysus-1",
+            "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+        } for word in words],
+    }
+
+
+def cpu_us(fn, repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        fn()
+    return (time.process_time() - start) / repeat * 1e6
+
+
+def measure(name: str, payload, repeat: int) -> dict:
+    # A streamed completion is one small document per word; report the whole stream
+    docs = payload if name == "completion chunk" else [payload]
+    stdlib = lambda: [json.dumps(d, default=str).encode() for d in docs]
+    fast = lambda: [serialization.dumps(d) for d in docs]
+    body = b"".join(fast())
+    result = {
+        "payload": name,
+        "json_bytes": sum(map(len, stdlib())),
+        "json_us": round(cpu_us(stdlib, repeat), 1),
+        "orjson_bytes": len(body),
+        "orjson_us": round(cpu_us(fast, repeat), 1),
+    }
+    if name != "completion chunk":
+        for coding in ("gzip", "br"):
+            result[f"{coding}_bytes"] = len(serialization.compress(body, coding))
+            result[f"{coding}_us"] = round(cpu_us(lambda: serialization.compress(body, coding), max(1, repeat // 10)), 1)
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Bytes and CPU per response for serialization and compression")
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("--catalog-size", type=int, default=20000)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = [measure(name, payload, args.repeat) for name, payload in payloads(args.catalog_size).items()]
+    header = f"{'payload':<20}{'json B':>10}{'json µs':>10}{'orjson B':>10}{'orjson µs':>11}" \
+             f"{'gzip B':>9}{'gzip µs':>9}{'br B':>9}{'br µs':>9}"
+    print(header)
+    for r in results:
+        print(f"{r['payload']:<20}{r['json_bytes']:>10}{r['json_us']:>10}{r['orjson_bytes']:>10}{r['orjson_us']:>11}"
+              f"{r.get('gzip_bytes', '-'):>9}{r.get('gzip_us', '-'):>9}{r.get('br_bytes', '-'):>9}{r.get('br_us', '-'):>9}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Synthetic wine catalog for benchmarks
+Creates the `wines` table the agent queries and fills it with N deterministic rows via COPY.
+
+    python bench/synthetic_catalog.py postgresql://localhost/dionysus_bench --size 20000 --reset
+"""
+import argparse
+import io
+import json
+import random
+import time
+
+import psycopg2
+
+REGIONS = [
+    ("Burgundy", "France"), ("Bordeaux", "France"), ("Champagne", "France"), ("Rhône", "France"),
+    ("Loire", "France"), ("Alsace", "France"), ("Tuscany", "Italy"), ("Piedmont", "Italy"),
+    ("Veneto", "Italy"), ("Rioja", "Spain"), ("Ribera del Duero", "Spain"), ("Douro", "Portugal"),
+    ("Mosel", "Germany"), ("Napa Valley", "USA"), ("Sonoma", "USA"), ("Barossa", "Australia"),
+    ("Marlborough", "New Zealand"), ("Mendoza", "Argentina"), ("Stellenbosch", "South Africa"),
+]
+GRAPES = {
+    "Red": ["Pinot Noir", "Cabernet Sauvignon", "Merlot", "Syrah", "Nebbiolo", "Sangiovese",
+            "Tempranillo", "Grenache", "Malbec"],
+    "White": ["Chardonnay", "Sauvignon Blanc", "Riesling", "Chenin Blanc", "Grüner Veltliner"],
+    "Rosé": ["Grenache", "Cinsault"],
+    "Sparkling": ["Chardonnay", "Pinot Noir", "Glera"],
+    "Dessert": ["Sémillon", "Riesling", "Touriga Nacional"],
+}
+WINE_TYPES = ["Red"] * 5 + ["White"] * 3 + ["Rosé", "Sparkling", "Dessert"]
+CLASSIFICATIONS = [None, None, None, "Grand Cru", "Premier Cru", "First Growth", "Super Tuscan", "DOCG"]
+PREFIXES = ["Château", "Domaine", "Tenuta", "Bodegas", "Weingut", "Clos", "Estate"]
+NAMES = ["Belair", "Montrose", "Lafleur", "Rousseau", "Leroy", "Gaja", "Vega", "Sassicaia", "Latour",
+         "Margaux", "Ornellaia", "Tignanello", "Krug", "Egon", "Opus", "Penfold", "Cloudy", "Catena"]
+
+COLUMNS = (
+    "id", "name", "winery", "region", "country", "grape_variety", "vintage", "wine_type", "style",
+    "color", "price_retail", "price_trade", "bottle_size", "tasting_notes", "critic_scores",
+    "drinking_window", "classification", "image_url", "stock_quantity", "case_size", "is_active",
+    "slug", "price_history", "investment_score", "is_investment_grade", "storage_type",
+    "five_year_return", "liv_ex_score",
+)
+
+CREATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS wines (
+        id SERIAL PRIMARY KEY,
+        name TEXT,
+        winery TEXT,
+        region TEXT,
+        country TEXT,
+        grape_variety TEXT,
+        vintage INTEGER,
+        wine_type TEXT,
+        style TEXT,
+        color TEXT,
+        price_retail NUMERIC(10,2),
+        price_trade NUMERIC(10,2),
+        bottle_size TEXT,
+        tasting_notes TEXT,
+        critic_scores JSONB,
+        drinking_window TEXT,
+        classification TEXT,
+        image_url TEXT,
+        stock_quantity INTEGER,
+        case_size INTEGER,
+        is_active BOOLEAN DEFAULT true,
+        slug TEXT,
+        created_at TIMESTAMPTZ DEFAULT NOW(),
+        updated_at TIMESTAMPTZ DEFAULT NOW(),
+        price_history JSONB DEFAULT '[]',
+        investment_score DECIMAL(3,1),
+        is_investment_grade BOOLEAN DEFAULT false,
+        storage_type VARCHAR(20),
+        five_year_return DECIMAL(5,1),
+        liv_ex_score INTEGER
+    )
+"""
+
+
+def generate_wines(size: int, seed: int = 42):
+    """Yield `size` wine dicts shaped like the production catalog."""
+    rng = random.Random(seed)
+    for wine_id in range(1, size + 1):
+        region, country = rng.choice(REGIONS)
+        wine_type = rng.choice(WINE_TYPES)
+        grape = rng.choice(GRAPES[wine_type])
+        vintage = rng.randint(1982, 2022)
+        classification = rng.choice(CLASSIFICATIONS)
+        price = round(rng.lognormvariate(4.2, 1.0), 2)
+        winery = f"{rng.choice(PREFIXES)} {rng.choice(NAMES)}"
+        name = f"{winery} {grape} {vintage}"
+        is_investment = price >= 500 or classification in ("Grand Cru", "First Growth") or (
+            price >= 100 and region in ("Bordeaux", "Burgundy", "Champagne", "Tuscany", "Piedmont")
+        )
+        growth = rng.uniform(0.08, 0.2) if is_investment else rng.uniform(0.02, 0.07)
+        history, p = [], price
+        for year in range(2018, 2025):
+            p *= 1 + growth + rng.uniform(-0.03, 0.03)
+            history.append({"year": str(year), "price": round(p), "trend": round(price * (1 + growth) ** (year - 2018)),
+                            "volume": rng.randint(100, 1100)})
+        five_year = round((history[-1]["price"] - history[-5]["price"]) / max(history[-5]["price"], 1) * 100, 1)
+        score = min(10.0, max(1.0, round(5 + (2 if five_year > 50 else 1 if five_year > 15 else 0)
+                                         + (1.5 if classification in ("Grand Cru", "First Growth") else 0)
+                                         + (1 if 2024 - vintage >= 10 else 0) + rng.uniform(-1, 1), 1)))
+        yield {
+            "id": wine_id,
+            "name": name,
+            "winery": winery,
+            "region": region,
+            "country": country,
+            "grape_variety": grape,
+            "vintage": vintage,
+            "wine_type": wine_type,
+            "style": rng.choice(["Full-bodied", "Medium-bodied", "Light", "Crisp", "Rich"]),
+            "color": wine_type.lower(),
+            "price_retail": price,
+            "price_trade": round(price * 0.8, 2),
+            "bottle_size": "75cl",
+            "tasting_notes": f"{grape} from {region} with notes of dark fruit, spice and oak.",
+            "critic_scores": json.dumps({"RP": rng.randint(85, 100)}),
+            "drinking_window": f"{vintage + 3}-{vintage + 20}",
+            "classification": classification,
+            "image_url": None,
+            "stock_quantity": rng.randint(0, 120),
+            "case_size": rng.choice([6, 12]),
+            "is_active": rng.random() > 0.05,
+            "slug": f"{name.lower().replace(' ', '-')}-{wine_id}",
+            "price_history": json.dumps(history),
+            "investment_score": score,
+            "is_investment_grade": is_investment,
+            "storage_type": "bonded" if is_investment else rng.choice(["retail", "private_cellar"]),
+            "five_year_return": five_year,
+            "liv_ex_score": rng.randint(70, 99) if is_investment else None,
+        }
+
+
+def _copy_value(value) -> str:
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+
+def seed(database_url: str, size: int, reset: bool = False, seed_value: int = 42) -> float:
+    """Create and fill the `wines` table, returning the seconds it took."""
+    start = time.perf_counter()
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        if reset:
+            cur.execute("DROP TABLE IF EXISTS wines CASCADE")
+            # Indexes went with the table, so the agent's migrations must run again
+            cur.execute("DROP TABLE IF EXISTS schema_migrations")
+        cur.execute(CREATE_TABLE)
+
+        buffer = io.StringIO()
+        for wine in generate_wines(size, seed_value):
+            buffer.write("\t".join(_copy_value(wine[c]) for c in COLUMNS) + "\n")
+        buffer.seek(0)
+        cur.copy_expert(f"COPY wines ({', '.join(COLUMNS)}) FROM STDIN", buffer)
+        cur.execute("SELECT setval(pg_get_serial_sequence('wines', 'id'), (SELECT MAX(id) FROM wines))")
+        cur.execute("ANALYZE wines")
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a local Postgres with a synthetic wine catalog")
+    parser.add_argument("database_url")
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="drop the wines table first")
+    args = parser.parse_args()
+
+    elapsed = seed(args.database_url, args.size, args.reset, args.seed)
+    print(f"🍷 Seeded {args.size} wines in {elapsed:.2f}s")
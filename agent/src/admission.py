@@ -0,0 +1,223 @@
+"""
+Admission control for DIONYSUS' model calls
+Every model request takes a slot from one AdmissionController first. Slots
+are limited by a global concurrency cap and by request and token buckets
+sized to the Groq quota; when none is free, callers wait in priority order
+(voice, then interactive, then batch). A caller whose class deadline would be
+missed is turned away at once with an estimate of when to retry.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import deadline
+import logs
+import metrics
+
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "32"))
+# Groq organisation limits; 0 turns a bucket off
+GROQ_REQUESTS_PER_MINUTE = float(os.getenv("GROQ_REQUESTS_PER_MINUTE", "1000"))
+GROQ_TOKENS_PER_MINUTE = float(os.getenv("GROQ_TOKENS_PER_MINUTE", "300000"))
+
+# Lower runs first; the deadline is the longest a call of that class may queue
+PRIORITIES = {"voice": 0, "interactive": 1, "batch": 2}
+QUEUE_DEADLINES = {
+    "voice": float(os.getenv("ADMISSION_VOICE_WAIT_SECONDS", "1")),
+    "interactive": float(os.getenv("ADMISSION_INTERACTIVE_WAIT_SECONDS", "5")),
+    "batch": float(os.getenv("ADMISSION_BATCH_WAIT_SECONDS", "30")),
+}
+
+# Seconds' worth of quota that can be spent at once after a quiet spell
+BUCKET_BURST_SECONDS = 10
+
+log = logs.get_logger("admission")
+
+
+class Overloaded(Exception):
+    """The call could not start within its class deadline; retry after `retry_after` seconds."""
+
+    def __init__(self, priority: str, retry_after: float, reason: str):
+        super().__init__(f"{priority} model call rejected ({reason}), retry after {retry_after:.1f}s")
+        self.priority = priority
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    """Refills at `per_minute` / 60 a second up to BUCKET_BURST_SECONDS' worth; may be overdrawn."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = self.rate * BUCKET_BURST_SECONDS
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 when it already is)."""
+        if not self.enabled:
+            return 0.0
+        self._refill()
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def spend(self, amount: float) -> None:
+        if self.enabled:
+            self._refill()
+            self.level -= amount
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = MODEL_MAX_CONCURRENCY,
+                 requests_per_minute: float = GROQ_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = GROQ_TOKENS_PER_MINUTE,
+                 deadlines: Optional[dict[str, float]] = None):
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.deadlines = deadlines or QUEUE_DEADLINES
+        self.active = 0
+        # Seconds a slot is usually held, for wait estimates
+        self.service_seconds = 2.0
+        self._waiting: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _blocked_for(self, ahead: int) -> float:
+        """Seconds until a call with `ahead` calls queued in front of it could start."""
+        slots = self.active + ahead + 1 - self.max_concurrency
+        slot_wait = 0.0 if slots <= 0 else self.service_seconds * slots / self.max_concurrency
+        # Tokens are spent after the response, so only an overdrawn bucket holds calls back
+        return max(slot_wait, self.requests.wait_time(ahead + 1), self.tokens.wait_time(0))
+
+    def _ahead_of(self, rank: int) -> int:
+        return sum(1 for r, _, future in self._waiting if r <= rank and not future.done())
+
+    def precheck(self, priority: str) -> Optional[float]:
+        """Seconds to wait if a `priority` call would miss its deadline right now (a rejection), else None."""
+        wait = self._blocked_for(self._ahead_of(PRIORITIES[priority]))
+        if wait <= self.deadlines[priority]:
+            return None
+        self._reject(priority, wait, "precheck")
+        return wait
+
+    def _reject(self, priority: str, retry_after: float, reason: str) -> Overloaded:
+        metrics.admission_rejected.inc(priority, reason)
+        log.warning("⚠️ Model call rejected", extra={
+            "priority": priority, "reason": reason, "retry_after": round(retry_after, 2),
+        })
+        return Overloaded(priority, retry_after, reason)
+
+    def _start(self) -> None:
+        self.active += 1
+        self.requests.spend(1)
+        metrics.admission_active.set(value=self.active)
+
+    def _wake(self) -> None:
+        self._timer = None
+        while self._waiting:
+            rank, seq, future = self._waiting[0]
+            if future.done():
+                heapq.heappop(self._waiting)
+                continue
+            blocked = self._blocked_for(0)
+            if blocked > 0:
+                # Slot-bound waits end in release(); bucket-bound ones need a timer
+                if self.active < self.max_concurrency and self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(blocked, self._wake)
+                return
+            heapq.heappop(self._waiting)
+            self._start()
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: str = "interactive"):
+        """Hold one model-call slot, queueing by priority; raises Overloaded instead of missing the deadline."""
+        rank = PRIORITIES[priority]
+        queued = time.perf_counter()
+        ahead = self._ahead_of(rank)
+        # The class deadline, or less when the caller's run ends sooner
+        max_wait = deadline.limit(self.deadlines[priority])
+        if ahead == 0 and self._blocked_for(0) == 0:
+            self._start()
+        else:
+            wait = self._blocked_for(ahead)
+            if wait > max_wait:
+                raise self._reject(priority, wait, "queue_full")
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiting, (rank, next(self._seq), future))
+            metrics.admission_queued.inc(priority)
+            self._wake()
+            try:
+                async with asyncio.timeout(max_wait):
+                    await future
+            except TimeoutError:
+                # Handed a slot in the same loop iteration the timeout fired: keep it
+                if not (future.done() and not future.cancelled()):
+                    future.cancel()
+                    raise self._reject(priority, self._blocked_for(self._ahead_of(rank)), "deadline")
+            except BaseException:
+                # Cancelled after being handed a slot: give it back
+                if future.done() and not future.cancelled():
+                    self._release(0.0)
+                raise
+            finally:
+                metrics.admission_queued.dec(priority)
+        metrics.admission_wait.observe(time.perf_counter() - queued, priority)
+
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self._release(time.perf_counter() - started)
+
+    def retry(self, priority: str) -> None:
+        """Charge a failover attempt, made under a slot the call already holds, to the request bucket.
+
+        Raises Overloaded instead when the bucket is empty.
+        """
+        wait = self.requests.wait_time(1)
+        if wait > 0:
+            raise self._reject(priority, wait, "failover")
+        self.requests.spend(1)
+
+    def start_hedge(self) -> bool:
+        """Take a second slot and request for a hedged backup; False unless both are free and nothing is queued."""
+        if self._ahead_of(max(PRIORITIES.values())) or self._blocked_for(0) > 0:
+            return False
+        self._start()
+        return True
+
+    def end_hedge(self) -> None:
+        self._release(0.0)
+
+    def _release(self, held: float) -> None:
+        self.active -= 1
+        metrics.admission_active.set(value=self.active)
+        if held:
+            self.service_seconds = 0.9 * self.service_seconds + 0.1 * held
+        self._wake()
+
+    def used_tokens(self, tokens: int) -> None:
+        """Charge a finished request's tokens to the token bucket."""
+        self.tokens.spend(tokens)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queued": self._ahead_of(max(PRIORITIES.values())),
+            "requests_available": round(self.requests.level, 1) if self.requests.enabled else None,
+            "tokens_available": round(self.tokens.level) if self.tokens.enabled else None,
+        }
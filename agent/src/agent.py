@@ -3,23 +3,74 @@ DIONYSUS - AI Wine Sommelier Agent for Aionysus
 Built with Pydantic AI + AG-UI protocol
 """
 from textwrap import dedent
-from typing import Optional
-from pydantic import BaseModel, Field
-from pydantic_ai import Agent, RunContext
+from typing import Callable, NamedTuple, Optional, Union
+from pydantic import BaseModel, Field, ValidationError
+from pydantic_ai import Agent, RunContext, capture_run_messages
 from pydantic_ai.ag_ui import StateDeps
-import psycopg2
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, ToolReturnPart, UserPromptPart
+from pydantic_ai.ui.ag_ui import AGUIAdapter
 import httpx
 import os
 import sys
 import re
 import json
 
+# Sibling modules are imported directly whether we're loaded as `agent` or `src.agent`
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from session_state import SessionStateStore
+from metrics import MeteredTransport, track_tool
+from tracing import TracedCursor
+from catalog_cache import CatalogCache, ChangeFeed
+from model_router import ModelRouter
+from admission import Overloaded
+import answer_cache
+import catalog_graph
+import coalesce
+import conversation as voice_conversation
+import db
+import deadline
+import intents
+import logs
+import metrics
+import migrations
+import neighbours
+import prefetch
+import ranking
+import recording
+import resilience
+import serialization
+import tracing
+
+log = logs.get_logger("agent")
+
 from dotenv import load_dotenv
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Comma-separated read replicas for the read-only catalog tools
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 ZEP_API_KEY = os.getenv("ZEP_API_KEY", "")
+ZEP_BASE_URL = os.getenv("ZEP_BASE_URL", "https://api.getzep.com")
+# Upper bound on a Zep call; the actual timeout follows Zep's recent latency
+ZEP_TIMEOUT_SECONDS = float(os.getenv("ZEP_TIMEOUT_SECONDS", "5"))
+ZEP_MAX_CONCURRENCY = int(os.getenv("ZEP_MAX_CONCURRENCY", "16"))
+# Consecutive failures before Zep is skipped, and how often it is probed meanwhile
+ZEP_BREAKER_FAILURES = int(os.getenv("ZEP_BREAKER_FAILURES", "5"))
+ZEP_PROBE_SECONDS = float(os.getenv("ZEP_PROBE_SECONDS", "10"))
+AGUI_SESSION_TTL_SECONDS = float(os.getenv("AGUI_SESSION_TTL_SECONDS", "1800"))
+AGUI_MAX_SESSIONS = int(os.getenv("AGUI_MAX_SESSIONS", "1000"))
+AGUI_SESSION_MAX_BYTES = int(os.getenv("AGUI_SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "true").lower() != "false"
+GROQ_MODEL_LARGE = os.getenv("GROQ_MODEL_LARGE", "llama-3.3-70b-versatile")
+GROQ_MODEL_FAST = os.getenv("GROQ_MODEL_FAST", "llama-3.1-8b-instant")
+# false sends every turn to the large model first (the other is still the failover)
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "true").lower() != "false"
+# Voice turns up to this many words go to the fast model unless they are about investment
+VOICE_FAST_MAX_WORDS = int(os.getenv("VOICE_FAST_MAX_WORDS", "25"))
+# Send a backup completion when a voice turn's model request runs long (see model_router)
+VOICE_HEDGING = os.getenv("VOICE_HEDGING", "false").lower() == "true"
 
 # =====
 # Wine Phonetic Corrections (for voice input)
@@ -101,7 +152,7 @@ def extract_user_from_instructions(instructions: str) -> dict:
     if result["user_id"]:
         global _cached_user_context
         _cached_user_context = result
-        print(f"🍷 Cached user: {result['name']} ({result['user_id'][:8]}...)", file=sys.stderr)
+        log.info("🍷 Cached user", extra={"user": result["name"], "user_id": result["user_id"][:8]})
 
     return result
 
@@ -116,24 +167,168 @@ def get_effective_user_name(state_user) -> Optional[str]:
     return _cached_user_context.get("name")
 
 
+# =====
+# Database
+# =====
+def db_router() -> db.Router:
+    return db.router(DATABASE_URL, DATABASE_REPLICA_URLS, cursor_factory=TracedCursor)
+
+
+def get_db_connection(read_only: bool = False):
+    """A pooled connection whose cursors report to /metrics and the current trace; close() returns it.
+
+    read_only connections may come from a replica.
+    """
+    return db_router().connection(read_only)
+
+
+def read_rows(q: db.Query, params: list = ()) -> list:
+    """All rows of a read-only query, from a replica when one is usable (the primary if it fails mid-query)."""
+    def run(conn) -> list:
+        cur = conn.cursor()
+        db.execute(cur, q, params)
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+
+    return db_router().read(run)
+
+
+# Catalog query results, dropped when the `wines` triggers report a change
+# that touches them. With replicas, nothing is cached again until the lag
+# limit has passed, so a replica behind the change cannot refill it.
+catalog_cache = CatalogCache(settle_seconds=db.DB_REPLICA_MAX_LAG_SECONDS if DATABASE_REPLICA_URLS else 0)
+catalog_feed = ChangeFeed(DATABASE_URL) if DATABASE_URL else None
+# Keeps the similar-wine lists current as wines change
+neighbour_refresher = neighbours.Refresher(DATABASE_URL) if DATABASE_URL else None
+
+
+def fetch_catalog(q: db.Query, params: list = (), ids: Optional[Union[list, Callable[[list], list]]] = None,
+                  terms: Optional[list] = None, prefetch: bool = False) -> list:
+    """Rows of a read-only catalog query, from the catalog cache when possible.
+
+    `ids` and `terms` scope the result to those wine ids or region/country
+    search terms, so changes elsewhere keep it; leave both unset when any
+    change to the catalog could alter it. `ids` may be a function of the
+    rows when they are only known after loading. `prefetch` marks a speculative
+    load, which is skipped when the rows are already cached.
+    """
+    key = (q.name, tuple(tuple(p) if isinstance(p, list) else p for p in params))
+    if prefetch:
+        if catalog_cache.contains(key):
+            metrics.catalog_prefetch.inc("cached")
+            return []
+    else:
+        rows = catalog_cache.get(key)
+        if rows is not None:
+            return rows
+    version = catalog_cache.version
+    rows = read_rows(q, params)
+    if callable(ids):
+        ids = ids(rows)
+    catalog_cache.put(key, rows, version, ids=ids, terms=terms, prefetched=prefetch)
+    if prefetch:
+        metrics.catalog_prefetch.inc("warmed")
+    return rows
+
+
+async def load_catalog(q: db.Query, params: list = (), ids: Optional[Union[list, Callable[[list], list]]] = None,
+                       terms: Optional[list] = None) -> list:
+    """fetch_catalog in a worker thread, so a slow query neither blocks the event loop nor outlives a tool's timeout."""
+    return await asyncio.to_thread(fetch_catalog, q, params, ids, terms)
+
+
+# Pending migrations run in the background: an index build or a wait for another
+# worker's migration can take minutes, and startup (and /health) must not wait for it
+migration_task: Optional["asyncio.Task"] = None
+
+
+async def apply_migrations() -> bool:
+    """Bring the catalog schema and indexes up to date; the agent keeps serving if this fails."""
+    try:
+        await asyncio.to_thread(migrations.migrate, DATABASE_URL)
+    except Exception as e:
+        log.error("❌ Catalog migrations failed", extra={"error": str(e)})
+        return False
+    return True
+
+
+async def start_migrations():
+    global migration_task
+    if DATABASE_URL and DB_AUTO_MIGRATE:
+        migration_task = asyncio.create_task(apply_migrations())
+
+
+async def stop_migrations():
+    if migration_task and not migration_task.done():
+        # The worker thread finishes its current statement on its own; only the wait is cancelled
+        migration_task.cancel()
+
+
+def migration_status() -> Optional[str]:
+    if migration_task is None:
+        return None
+    if not migration_task.done():
+        return "running"
+    return "done" if not migration_task.cancelled() and migration_task.result() else "failed"
+
+
+async def start_catalog_feed():
+    if catalog_feed:
+        await catalog_feed.start()
+    if neighbour_refresher:
+        await neighbour_refresher.start()
+
+
+async def stop_catalog_feed():
+    if catalog_feed:
+        await catalog_feed.stop()
+    if neighbour_refresher:
+        await neighbour_refresher.stop()
+
+
 # =====
 # Zep Memory Integration
 # =====
 _zep_client: Optional[httpx.AsyncClient] = None
 
+# Every Zep endpoint we call, as latency metric labels
+ZEP_ROUTES = (
+    "/api/v2/graph/search",
+    "/api/v2/users",
+    "/api/v2/users-ordered",
+    "/api/v2/threads/{thread_id}/messages",
+)
+
+# Zep context is optional, so a slow or failing Zep is skipped rather than waited on
+zep_guard = resilience.Guard(
+    "zep",
+    max_concurrency=ZEP_MAX_CONCURRENCY,
+    max_timeout=ZEP_TIMEOUT_SECONDS,
+    failure_threshold=ZEP_BREAKER_FAILURES,
+    probe_seconds=ZEP_PROBE_SECONDS,
+)
+
 def get_zep_client() -> Optional[httpx.AsyncClient]:
     global _zep_client
     if _zep_client is None and ZEP_API_KEY:
         _zep_client = httpx.AsyncClient(
-            base_url="https://api.getzep.com",
+            base_url=ZEP_BASE_URL,
             headers={
                 "Authorization": f"Api-Key {ZEP_API_KEY}",
                 "Content-Type": "application/json",
             },
-            timeout=5.0,
+            timeout=ZEP_TIMEOUT_SECONDS,
+            # Listing one user is the cheapest authenticated Zep call
+            transport=resilience.GuardedTransport(zep_guard, MeteredTransport("zep", routes=ZEP_ROUTES),
+                                                  probe_path="/api/v2/users-ordered?pageSize=1&pageNumber=1"),
         )
     return _zep_client
 
+# Search ordering compiled from the facts below, kept per user between fetches
+preference_profiles = ranking.ProfileCache()
+
+
 async def get_user_wine_preferences(user_id: Optional[str]) -> tuple[str, list[str]]:
     """Fetch user's wine preferences from Zep."""
     if not user_id or not ZEP_API_KEY:
@@ -144,33 +339,40 @@ async def get_user_wine_preferences(user_id: Optional[str]) -> tuple[str, list[s
         if not client:
             return ("", [])
 
-        response = await client.post(
-            "/api/v2/graph/search",
-            json={
-                "user_id": user_id,
-                "query": "wine preferences regions varietals taste red white sparkling",
-                "limit": 10,
-                "scope": "edges",
-            },
-        )
+        with tracing.span("zep wine preferences") as zep_span:
+            response = await client.post(
+                "/api/v2/graph/search",
+                json={
+                    "user_id": user_id,
+                    "query": "wine preferences regions varietals taste red white sparkling",
+                    "limit": 10,
+                    "scope": "edges",
+                },
+            )
+            zep_span.set_attribute("http.status_code", response.status_code)
 
-        if response.status_code != 200:
-            return ("", [])
+            if response.status_code != 200:
+                return ("", [])
 
-        data = response.json()
-        edges = data.get("edges", [])
+            data = response.json()
+            edges = data.get("edges", [])
+            zep_span.set_attribute("zep.edges", len(edges))
 
         if not edges:
+            preference_profiles.put(user_id, [])
             return ("", [])
 
         facts = [edge.get('fact', '') for edge in edges[:5] if edge.get("fact")]
+        preference_profiles.put(user_id, facts)
         if facts:
             context = "\n\n## Wine preferences I remember:\n" + "\n".join(f"- {f}" for f in facts)
             return (context, facts)
 
+        return ("", [])
+    except resilience.Unavailable:
         return ("", [])
     except Exception as e:
-        print(f"[Zep] Error: {e}", file=sys.stderr)
+        log.warning("[Zep] Error: %s", e)
         return ("", [])
 
 
@@ -206,16 +408,57 @@ class AppState(BaseModel):
     cart: Optional[Cart] = None
 
 
+# One private AppState per AG-UI thread, copied from this default on each run
+session_states = SessionStateStore(
+    AppState(),
+    ttl_seconds=AGUI_SESSION_TTL_SECONDS,
+    max_sessions=AGUI_MAX_SESSIONS,
+    max_bytes=AGUI_SESSION_MAX_BYTES,
+)
+
+
 # =====
 # Groq Model Setup
 # =====
 from pydantic_ai.models.groq import GroqModel
+from pydantic_ai.providers.groq import GroqProvider
 
-model = GroqModel(
-    model_name="llama-3.3-70b-versatile",
+# Shared by the AG-UI agent and every Hume turn; the transport feeds /metrics
+groq_provider = GroqProvider(
     # Uses GROQ_API_KEY env var automatically
+    http_client=httpx.AsyncClient(transport=MeteredTransport("groq", routes=("/openai/v1/chat/completions",)), timeout=600),
 )
 
+# Each turn prefers one of these and fails over to the other
+model_router = ModelRouter({
+    "large": GroqModel(model_name=GROQ_MODEL_LARGE, provider=groq_provider),
+    "fast": GroqModel(model_name=GROQ_MODEL_FAST, provider=groq_provider),
+})
+
+# Default for the AG-UI agent; run_ag_ui picks per turn
+model = model_router.model("large")
+
+# Questions that usually take several tool calls and careful numbers
+INVESTMENT_TOPICS = re.compile(
+    r"\b(?:invest\w*|portfolio|roi|returns?|appreciat\w*|liv-?ex|bonded|storage|charts?|price (?:history|trend)|"
+    r"market|compare|comparison|versus|vs)\b"
+)
+
+
+def model_tier(prompt: str, voice: bool = False) -> str:
+    """"large" for investment questions, "fast" for short voice turns and simple catalog intents."""
+    if not MODEL_ROUTING or INVESTMENT_TOPICS.search(prompt.lower()):
+        return "large"
+    if intents.classify(prompt) or (voice and len(prompt.split()) <= VOICE_FAST_MAX_WORDS):
+        return "fast"
+    return "large"
+
+
+def route_model(prompt: str, voice: bool = False):
+    return model_router.model(
+        model_tier(prompt, voice), hedge=voice and VOICE_HEDGING, priority="voice" if voice else "interactive",
+    )
+
 
 # =====
 # DIONYSUS Agent
@@ -266,6 +509,7 @@ You help users discover fine wines, understand investment potential, and find pe
 ### Discovery & Search:
 - search_wines: Find wines by region, type, price, grape
 - get_wine_details: Get full details for a specific wine
+- get_similar_wines: Find wines like one the user mentions or liked
 - show_wine_regions: Display wine distribution by region
 - show_wine_types: Show wine type distribution
 
@@ -336,7 +580,7 @@ async def get_dynamic_system_prompt(ctx: RunContext[StateDeps[AppState]]) -> str
         user_name = _cached_user_context.get("name")
 
     if user_name:
-        print(f"🍷 AG-UI request for: {user_name}", file=sys.stderr)
+        log.info("🍷 AG-UI request", extra={"user": user_name})
 
     return build_system_prompt(user_name, zep_context)
 
@@ -344,7 +588,77 @@ async def get_dynamic_system_prompt(ctx: RunContext[StateDeps[AppState]]) -> str
 # =====
 # Wine Tools
 # =====
+SEARCH_FILTERS = {
+    "region": "(LOWER(region) LIKE %s OR LOWER(country) LIKE %s)",
+    "wine_type": "LOWER(wine_type) LIKE %s",
+    "grape_variety": "LOWER(grape_variety) LIKE %s",
+    "min_price": "price_retail >= %s",
+    "max_price": "price_retail <= %s",
+}
+
+
+def search_query(filters: list[str]) -> db.Query:
+    """The search_wines statement for this set of filters, in SEARCH_FILTERS order."""
+    return db.query("search_wines" + "".join(f"_{f}" for f in filters), f"""
+        SELECT id, name, winery, region, country, grape_variety, vintage,
+               wine_type, style, color, price_retail, tasting_notes,
+               critic_scores, image_url, slug
+        FROM wines
+        WHERE {' AND '.join(["is_active = true"] + [SEARCH_FILTERS[f] for f in filters])}
+        ORDER BY price_retail DESC
+        LIMIT %s
+    """)
+
+
+def search_request(region: Optional[str] = None, wine_type: Optional[str] = None,
+                   grape_variety: Optional[str] = None, min_price: Optional[float] = None,
+                   max_price: Optional[float] = None, limit: int = 10) -> tuple[db.Query, list, Optional[list]]:
+    """The search_wines query, params and cache scope for these (phonetically corrected) arguments."""
+    # One prepared shape per combination of filters
+    filters = []
+    params = []
+
+    if region:
+        filters.append("region")
+        params.extend([f"%{region.lower()}%", f"%{region.lower()}%"])
+
+    if wine_type:
+        filters.append("wine_type")
+        params.append(f"%{wine_type.lower()}%")
+
+    if grape_variety:
+        filters.append("grape_variety")
+        params.append(f"%{grape_variety.lower()}%")
+
+    if min_price:
+        filters.append("min_price")
+        params.append(min_price)
+
+    if max_price:
+        filters.append("max_price")
+        params.append(max_price)
+
+    params.append(limit)
+
+    # Only wines in the region can change a region search
+    return search_query(filters), params, [region.lower()] if region else None
+
+
+async def preference_profile(state_user) -> Optional[ranking.Profile]:
+    """The user's cached preference profile, fetching their Zep facts if there is none."""
+    user_id = get_effective_user_id(state_user)
+    if not user_id or not ZEP_API_KEY:
+        return None
+    profile = preference_profiles.get(user_id)
+    if profile is None and not deadline.low():
+        _, facts = await get_user_wine_preferences(user_id)
+        if facts:
+            profile = preference_profiles.put(user_id, facts)
+    return profile
+
+
 @agent.tool
+@track_tool
 async def search_wines(
     ctx: RunContext[StateDeps[AppState]],
     region: Optional[str] = None,
@@ -368,51 +682,15 @@ async def search_wines(
         return {"wines": [], "error": "Database not configured", "title": "Search Error"}
 
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-
-        # Build dynamic query
-        conditions = ["is_active = true"]
-        params = []
-
         if region:
             region = apply_phonetic_corrections(region)
-            conditions.append("LOWER(region) LIKE %s OR LOWER(country) LIKE %s")
-            params.extend([f"%{region.lower()}%", f"%{region.lower()}%"])
-
-        if wine_type:
-            conditions.append("LOWER(wine_type) LIKE %s")
-            params.append(f"%{wine_type.lower()}%")
-
         if grape_variety:
             grape_variety = apply_phonetic_corrections(grape_variety)
-            conditions.append("LOWER(grape_variety) LIKE %s")
-            params.append(f"%{grape_variety.lower()}%")
-
-        if min_price:
-            conditions.append("price_retail >= %s")
-            params.append(min_price)
-
-        if max_price:
-            conditions.append("price_retail <= %s")
-            params.append(max_price)
-
-        params.append(limit)
-
-        query = f"""
-            SELECT id, name, winery, region, country, grape_variety, vintage,
-                   wine_type, style, color, price_retail, tasting_notes,
-                   critic_scores, image_url, slug
-            FROM wines
-            WHERE {' AND '.join(conditions)}
-            ORDER BY price_retail DESC
-            LIMIT %s
-        """
-
-        cur.execute(query, params)
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        # A signed-in user's results are picked from a wider set by their preferences
+        profile = await preference_profile(ctx.deps.state.user)
+        candidates = max(limit, ranking.RANKING_CANDIDATES) if profile and not profile.empty else limit
+        q, params, terms = search_request(region, wine_type, grape_variety, min_price, max_price, candidates)
+        rows = await load_catalog(q, params, terms=terms)
 
         wines = []
         for row in rows:
@@ -434,6 +712,8 @@ async def search_wines(
                 "slug": row[14],
             })
 
+        wines = ranking.rerank(profile, wines, limit)
+
         # Update state with results
         ctx.deps.state.wines = wines
         ctx.deps.state.search_query = f"{region or ''} {wine_type or ''} {grape_variety or ''}".strip()
@@ -450,15 +730,31 @@ async def search_wines(
         elif wine_type:
             title = f"{wine_type.title()} Wines"
 
-        print(f"🍷 Search: {len(wines)} wines found", file=sys.stderr)
+        log.info("🍷 Search", extra={"rows": len(wines)})
         return {"wines": wines, "title": title, "query": ctx.deps.state.search_query}
 
     except Exception as e:
-        print(f"🍷 Search error: {e}", file=sys.stderr)
+        log.error("🍷 Search error: %s", e)
         return {"wines": [], "error": str(e), "title": "Search Error"}
 
 
+WINE_DETAILS = db.query("wine_details", """
+    SELECT id, name, winery, region, country, grape_variety, vintage,
+           wine_type, style, color, price_retail, price_trade,
+           tasting_notes, critic_scores, drinking_window, classification,
+           image_url, stock_quantity, slug
+    FROM wines
+    WHERE LOWER(name) LIKE %s AND is_active = true
+    LIMIT 1
+""")
+
+
+def details_request(wine_name: str) -> tuple[db.Query, list, None]:
+    return WINE_DETAILS, [f"%{wine_name.lower()}%"], None
+
+
 @agent.tool
+@track_tool
 async def get_wine_details(
     ctx: RunContext[StateDeps[AppState]],
     wine_name: str,
@@ -469,22 +765,8 @@ async def get_wine_details(
 
     try:
         wine_name = apply_phonetic_corrections(wine_name)
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-
-        cur.execute("""
-            SELECT id, name, winery, region, country, grape_variety, vintage,
-                   wine_type, style, color, price_retail, price_trade,
-                   tasting_notes, critic_scores, drinking_window, classification,
-                   image_url, stock_quantity, slug
-            FROM wines
-            WHERE LOWER(name) LIKE %s AND is_active = true
-            LIMIT 1
-        """, [f"%{wine_name.lower()}%"])
-
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+        rows = await load_catalog(*details_request(wine_name))
+        row = rows[0] if rows else None
 
         if not row:
             return {"error": f"Wine '{wine_name}' not found"}
@@ -521,7 +803,79 @@ async def get_wine_details(
         return {"error": str(e)}
 
 
+SIMILAR_WINES = db.query("similar_wines", """
+    SELECT w.id, w.name, w.winery, w.region, w.country, w.grape_variety, w.vintage,
+           w.wine_type, w.price_retail, w.image_url, n.similarity
+    FROM wine_neighbours
+    CROSS JOIN LATERAL unnest(neighbour_ids, similarity) WITH ORDINALITY AS n(id, similarity, rank)
+    JOIN wines w ON w.id = n.id
+    WHERE wine_neighbours.wine_id = %s AND w.is_active = true
+    ORDER BY n.rank
+    LIMIT %s
+""")
+
+
+@agent.tool
+@track_tool
+async def get_similar_wines(
+    ctx: RunContext[StateDeps[AppState]],
+    wine_name: Optional[str] = None,
+    wine_id: Optional[int] = None,
+    limit: int = 5,
+) -> dict:
+    """Find wines most like a given wine (same type; close in grape, region, style, vintage, price and scores)."""
+    if not DATABASE_URL:
+        return {"wines": [], "error": "Database not configured"}
+
+    try:
+        if wine_id is None:
+            if not wine_name:
+                return {"wines": [], "error": "Give a wine name or id"}
+            wine_name = apply_phonetic_corrections(wine_name)
+            rows = await load_catalog(*details_request(wine_name))
+            if not rows:
+                return {"wines": [], "error": f"Wine '{wine_name}' not found"}
+            wine_id, wine_name = rows[0][0], rows[0][1]
+
+        limit = max(1, min(limit, neighbours.NEIGHBOURS_K))
+        # Scoped to the wine and its neighbours: a new list for it, or a change to one of them, drops it
+        rows = await load_catalog(
+            SIMILAR_WINES, [wine_id, limit], ids=lambda rows: [wine_id, *(row[0] for row in rows)],
+        )
+        wines = [
+            {
+                "id": row[0],
+                "name": row[1],
+                "winery": row[2],
+                "region": row[3],
+                "country": row[4],
+                "grape_variety": row[5],
+                "vintage": row[6],
+                "wine_type": row[7],
+                "price_retail": float(row[8]) if row[8] else None,
+                "image_url": row[9],
+                "similarity": row[10] / 1000,
+            }
+            for row in rows
+        ]
+        return {"wines": wines, "title": f"Wines like {wine_name}" if wine_name else "Similar Wines", "wine_id": wine_id}
+
+    except Exception as e:
+        return {"wines": [], "error": str(e)}
+
+
+WINES_BY_REGION = db.query("wines_by_region", """
+    SELECT region, COUNT(*) as count
+    FROM wines
+    WHERE is_active = true AND region IS NOT NULL
+    GROUP BY region
+    ORDER BY count DESC
+    LIMIT %s
+""")
+
+
 @agent.tool
+@track_tool
 async def show_wine_regions(
     ctx: RunContext[StateDeps[AppState]],
     limit: int = 10,
@@ -531,21 +885,7 @@ async def show_wine_regions(
         return {"chartData": [], "title": "Regions"}
 
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-
-        cur.execute("""
-            SELECT region, COUNT(*) as count
-            FROM wines
-            WHERE is_active = true AND region IS NOT NULL
-            GROUP BY region
-            ORDER BY count DESC
-            LIMIT %s
-        """, [limit])
-
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        rows = await load_catalog(WINES_BY_REGION, [limit])
 
         chart_data = [{"name": row[0], "wines": row[1]} for row in rows]
 
@@ -559,7 +899,17 @@ async def show_wine_regions(
         return {"chartData": [], "error": str(e)}
 
 
+WINES_BY_TYPE = db.query("wines_by_type", """
+    SELECT wine_type, COUNT(*) as count
+    FROM wines
+    WHERE is_active = true AND wine_type IS NOT NULL
+    GROUP BY wine_type
+    ORDER BY count DESC
+""")
+
+
 @agent.tool
+@track_tool
 async def show_wine_types(
     ctx: RunContext[StateDeps[AppState]],
 ) -> dict:
@@ -568,20 +918,7 @@ async def show_wine_types(
         return {"chartData": [], "title": "Wine Types"}
 
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-
-        cur.execute("""
-            SELECT wine_type, COUNT(*) as count
-            FROM wines
-            WHERE is_active = true AND wine_type IS NOT NULL
-            GROUP BY wine_type
-            ORDER BY count DESC
-        """)
-
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        rows = await load_catalog(WINES_BY_TYPE)
 
         chart_data = [{"name": row[0], "count": row[1]} for row in rows]
 
@@ -595,7 +932,31 @@ async def show_wine_types(
         return {"chartData": [], "error": str(e)}
 
 
+INVESTMENT_WINES = """
+    SELECT id, name, region, vintage, price_retail, investment_score,
+           five_year_return, storage_type, liv_ex_score
+    FROM wines
+    WHERE is_investment_grade = true
+      AND investment_score >= %s
+      {region_filter}
+    ORDER BY investment_score DESC
+    LIMIT %s
+"""
+TOP_INVESTMENT_WINES = db.query("investment_wines", INVESTMENT_WINES.format(region_filter=""))
+TOP_INVESTMENT_WINES_IN_REGION = db.query(
+    "investment_wines_region", INVESTMENT_WINES.format(region_filter="AND LOWER(region) LIKE %s")
+)
+
+
+def investment_request(limit: int = 10, min_score: float = 7.0,
+                       region: Optional[str] = None) -> tuple[db.Query, list, Optional[list]]:
+    if region:
+        return TOP_INVESTMENT_WINES_IN_REGION, [min_score, f"%{region.lower()}%", limit], [region.lower()]
+    return TOP_INVESTMENT_WINES, [min_score, limit], None
+
+
 @agent.tool
+@track_tool
 async def get_investment_wines(
     ctx: RunContext[StateDeps[AppState]],
     limit: int = 10,
@@ -613,29 +974,11 @@ async def get_investment_wines(
         return {"wines": [], "error": "Database not configured"}
 
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-
-        query = """
-            SELECT id, name, region, vintage, price_retail, investment_score,
-                   five_year_return, storage_type, liv_ex_score
-            FROM wines
-            WHERE is_investment_grade = true
-              AND investment_score >= %s
-        """
-        params = [min_score]
-
+        q, params, terms = investment_request(limit, min_score, region)
+        rows = await load_catalog(q, params, terms=terms)
         if region:
-            query += " AND LOWER(region) LIKE %s"
-            params.append(f"%{region.lower()}%")
             ctx.deps.state.scene = AmbientScene(region=region.lower())
 
-        query += " ORDER BY investment_score DESC LIMIT %s"
-        params.append(limit)
-
-        cur.execute(query, params)
-        rows = cur.fetchall()
-
         wines = []
         for row in rows:
             wines.append({
@@ -650,20 +993,44 @@ async def get_investment_wines(
                 "livExScore": row[8],
             })
 
-        cur.close()
-        conn.close()
-
         return {
             "wines": wines,
             "count": len(wines),
             "title": f"Top Investment Wines" + (f" from {region.title()}" if region else ""),
         }
     except Exception as e:
-        print(f"[Investment] Error: {e}", file=sys.stderr)
+        log.error("[Investment] Error: %s", e)
         return {"wines": [], "error": str(e)}
 
 
+CHART_BY_ID = db.query("chart_by_id", """
+    SELECT name, region, price_history, investment_score, five_year_return
+    FROM wines WHERE id = %s
+""")
+CHART_BY_NAME = db.query("chart_by_name", """
+    SELECT name, region, price_history, investment_score, five_year_return
+    FROM wines WHERE LOWER(name) LIKE %s
+    LIMIT 1
+""")
+CHART_REGION_AVERAGE = db.query("chart_region_average", """
+    SELECT 'Region Average' as name, %s::text as region,
+           (SELECT price_history FROM wines
+            WHERE is_investment_grade = true
+            AND LOWER(region) LIKE %s
+            ORDER BY investment_score DESC LIMIT 1),
+           AVG(investment_score), AVG(five_year_return)
+    FROM wines
+    WHERE is_investment_grade = true AND LOWER(region) LIKE %s
+""")
+CHART_TOP_INVESTMENT = db.query("chart_top_investment", """
+    SELECT name, region, price_history, investment_score, five_year_return
+    FROM wines WHERE is_investment_grade = true
+    ORDER BY investment_score DESC LIMIT 1
+""")
+
+
 @agent.tool
+@track_tool
 async def show_investment_chart(
     ctx: RunContext[StateDeps[AppState]],
     wine_id: Optional[int] = None,
@@ -681,53 +1048,31 @@ async def show_investment_chart(
         return {"chartData": [], "error": "Database not configured"}
 
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-
         if wine_id:
-            cur.execute("""
-                SELECT name, region, price_history, investment_score, five_year_return
-                FROM wines WHERE id = %s
-            """, [wine_id])
+            rows = await load_catalog(CHART_BY_ID, [wine_id], ids=[wine_id])
         elif wine_name:
-            cur.execute("""
-                SELECT name, region, price_history, investment_score, five_year_return
-                FROM wines WHERE LOWER(name) LIKE %s
-                LIMIT 1
-            """, [f"%{wine_name.lower()}%"])
+            rows = await load_catalog(CHART_BY_NAME, [f"%{wine_name.lower()}%"])
         elif region:
             # Get average for region
-            cur.execute("""
-                SELECT 'Region Average' as name, %s as region,
-                       (SELECT price_history FROM wines
-                        WHERE is_investment_grade = true
-                        AND LOWER(region) LIKE %s
-                        ORDER BY investment_score DESC LIMIT 1),
-                       AVG(investment_score), AVG(five_year_return)
-                FROM wines
-                WHERE is_investment_grade = true AND LOWER(region) LIKE %s
-            """, [region.title(), f"%{region.lower()}%", f"%{region.lower()}%"])
+            rows = await load_catalog(
+                CHART_REGION_AVERAGE, [region.title(), f"%{region.lower()}%", f"%{region.lower()}%"],
+                terms=[region.lower()],
+            )
             ctx.deps.state.scene = AmbientScene(region=region.lower())
         else:
             # Get top investment wine
-            cur.execute("""
-                SELECT name, region, price_history, investment_score, five_year_return
-                FROM wines WHERE is_investment_grade = true
-                ORDER BY investment_score DESC LIMIT 1
-            """)
-
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+            rows = await load_catalog(CHART_TOP_INVESTMENT)
+        row = rows[0] if rows else None
 
         if not row:
             return {"chartData": [], "error": "Wine not found"}
 
         name, wine_region, price_history, inv_score, five_yr = row
 
-        # Parse price history JSON
-        import json
-        chart_data = json.loads(price_history) if price_history else []
+        # psycopg2 decodes JSONB itself; older rows may hold the JSON as text
+        if isinstance(price_history, str):
+            price_history = json.loads(price_history)
+        chart_data = price_history or []
 
         if wine_region:
             ctx.deps.state.scene = AmbientScene(region=wine_region.lower().split()[0])
@@ -742,11 +1087,22 @@ async def show_investment_chart(
             "fiveYearReturn": float(five_yr) if five_yr else None,
         }
     except Exception as e:
-        print(f"[Investment Chart] Error: {e}", file=sys.stderr)
+        log.error("[Investment Chart] Error: %s", e)
         return {"chartData": [], "error": str(e)}
 
 
+ROI_BY_ID = db.query("roi_by_id", """
+    SELECT name, price_retail, investment_score, five_year_return, region
+    FROM wines WHERE id = %s
+""")
+ROI_BY_NAME = db.query("roi_by_name", """
+    SELECT name, price_retail, investment_score, five_year_return, region
+    FROM wines WHERE LOWER(name) LIKE %s LIMIT 1
+""")
+
+
 @agent.tool
+@track_tool
 async def calculate_wine_roi(
     ctx: RunContext[StateDeps[AppState]],
     wine_id: Optional[int] = None,
@@ -768,23 +1124,11 @@ async def calculate_wine_roi(
         return {"error": "Database not configured"}
 
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-
         if wine_id:
-            cur.execute("""
-                SELECT name, price_retail, investment_score, five_year_return, region
-                FROM wines WHERE id = %s
-            """, [wine_id])
+            rows = await load_catalog(ROI_BY_ID, [wine_id], ids=[wine_id])
         else:
-            cur.execute("""
-                SELECT name, price_retail, investment_score, five_year_return, region
-                FROM wines WHERE LOWER(name) LIKE %s LIMIT 1
-            """, [f"%{wine_name.lower()}%"])
-
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
+            rows = await load_catalog(ROI_BY_NAME, [f"%{wine_name.lower()}%"])
+        row = rows[0] if rows else None
 
         if not row:
             return {"error": "Wine not found"}
@@ -843,11 +1187,28 @@ async def calculate_wine_roi(
             "annualizedReturn": round(annual_return, 1),
         }
     except Exception as e:
-        print(f"[ROI Calculator] Error: {e}", file=sys.stderr)
+        log.error("[ROI Calculator] Error: %s", e)
         return {"error": str(e)}
 
 
+PORTFOLIO_CANDIDATES = """
+    SELECT id, name, region, vintage, price_retail, investment_score, five_year_return
+    FROM wines
+    WHERE is_investment_grade = true
+      AND investment_score >= %s
+      AND price_retail <= %s
+      AND vintage >= %s
+      {region_filter}
+    ORDER BY investment_score DESC LIMIT 20
+"""
+PORTFOLIO_ANY_REGION = db.query("portfolio_candidates", PORTFOLIO_CANDIDATES.format(region_filter=""))
+PORTFOLIO_IN_REGIONS = db.query(
+    "portfolio_candidates_regions", PORTFOLIO_CANDIDATES.format(region_filter="AND LOWER(region) LIKE ANY(%s)")
+)
+
+
 @agent.tool
+@track_tool
 async def build_portfolio(
     ctx: RunContext[StateDeps[AppState]],
     budget: float = 10000,
@@ -863,9 +1224,6 @@ async def build_portfolio(
         return {"error": "Database not configured"}
 
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-
         # Risk profiles
         profiles = {
             "low": {"min_score": 8.5, "regions": ["bordeaux", "burgundy"], "vintage_min": 2000},
@@ -875,27 +1233,14 @@ async def build_portfolio(
 
         profile = profiles.get(risk_level, profiles["medium"])
 
-        query = """
-            SELECT id, name, region, vintage, price_retail, investment_score, five_year_return
-            FROM wines
-            WHERE is_investment_grade = true
-              AND investment_score >= %s
-              AND price_retail <= %s
-              AND vintage >= %s
-        """
         params = [profile["min_score"], budget * 0.4, profile["vintage_min"]]
 
         if profile["regions"]:
-            region_conditions = " OR ".join(["LOWER(region) LIKE %s" for _ in profile["regions"]])
-            query += f" AND ({region_conditions})"
-            params.extend([f"%{r}%" for r in profile["regions"]])
-
-        query += " ORDER BY investment_score DESC LIMIT 20"
-
-        cur.execute(query, params)
-        candidates = cur.fetchall()
-        cur.close()
-        conn.close()
+            candidates = await load_catalog(
+                PORTFOLIO_IN_REGIONS, params + [[f"%{r}%" for r in profile["regions"]]], terms=profile["regions"]
+            )
+        else:
+            candidates = await load_catalog(PORTFOLIO_ANY_REGION, params)
 
         # Diversify selection
         portfolio = []
@@ -950,37 +1295,38 @@ async def build_portfolio(
             "title": f"Wine Portfolio (£{budget:,.0f} - {risk_level.title()} Risk)",
         }
     except Exception as e:
-        print(f"[Portfolio Builder] Error: {e}", file=sys.stderr)
+        log.error("[Portfolio Builder] Error: %s", e)
         return {"error": str(e)}
 
 
+FOOD_PAIRINGS = {
+    "red": ["Beef steak", "Lamb chops", "Hard aged cheeses", "Mushroom risotto", "Dark chocolate"],
+    "white": ["Grilled fish", "Chicken", "Soft cheeses", "Seafood pasta", "Caesar salad"],
+    "rosé": ["Mediterranean dishes", "Light salads", "Grilled vegetables", "Sushi", "Fruit desserts"],
+    "sparkling": ["Oysters", "Caviar", "Fried appetizers", "Soft cheese", "Celebration cake"],
+    "dessert": ["Foie gras", "Blue cheese", "Fruit tarts", "Crème brûlée", "Dark chocolate"],
+}
+
+SERVING_TIPS = {
+    "red": "Serve at 16-18°C. Decant bold reds for 30-60 minutes.",
+    "white": "Serve chilled at 8-12°C. Fuller whites can be served slightly warmer.",
+    "rosé": "Serve well chilled at 6-10°C. Perfect for warm weather.",
+    "sparkling": "Serve very cold at 6-8°C. Use flute glasses to preserve bubbles.",
+    "dessert": "Serve chilled. The wine should be sweeter than the dessert.",
+}
+
+
 @agent.tool
+@track_tool
 async def get_food_pairings(
     ctx: RunContext[StateDeps[AppState]],
     wine_type: Optional[str] = None,
     wine_name: Optional[str] = None,
 ) -> dict:
     """Get food pairing suggestions for a wine type or specific wine."""
-
-    pairings_db = {
-        "red": ["Beef steak", "Lamb chops", "Hard aged cheeses", "Mushroom risotto", "Dark chocolate"],
-        "white": ["Grilled fish", "Chicken", "Soft cheeses", "Seafood pasta", "Caesar salad"],
-        "rosé": ["Mediterranean dishes", "Light salads", "Grilled vegetables", "Sushi", "Fruit desserts"],
-        "sparkling": ["Oysters", "Caviar", "Fried appetizers", "Soft cheese", "Celebration cake"],
-        "dessert": ["Foie gras", "Blue cheese", "Fruit tarts", "Crème brûlée", "Dark chocolate"],
-    }
-
-    tips_db = {
-        "red": "Serve at 16-18°C. Decant bold reds for 30-60 minutes.",
-        "white": "Serve chilled at 8-12°C. Fuller whites can be served slightly warmer.",
-        "rosé": "Serve well chilled at 6-10°C. Perfect for warm weather.",
-        "sparkling": "Serve very cold at 6-8°C. Use flute glasses to preserve bubbles.",
-        "dessert": "Serve chilled. The wine should be sweeter than the dessert.",
-    }
-
     wine_type_lower = (wine_type or "red").lower()
-    pairings = pairings_db.get(wine_type_lower, pairings_db["red"])
-    tips = tips_db.get(wine_type_lower, "")
+    pairings = FOOD_PAIRINGS.get(wine_type_lower, FOOD_PAIRINGS["red"])
+    tips = SERVING_TIPS.get(wine_type_lower, "")
 
     return {
         "pairings": pairings,
@@ -990,6 +1336,7 @@ async def get_food_pairings(
 
 
 @agent.tool
+@track_tool
 async def save_wine_preference(
     ctx: RunContext[StateDeps[AppState]],
     preference_type: str,
@@ -1014,12 +1361,30 @@ async def save_wine_preference(
                     }]
                 })
         except Exception as e:
-            print(f"[Zep] Error saving preference: {e}", file=sys.stderr)
+            log.warning("[Zep] Error saving preference: %s", e)
 
+    preference_profiles.add(user_id, f"User prefers {preference_type}: {value}")
     return {"saved": True, "preference_type": preference_type, "value": value}
 
 
+# Kept separate so each is answered from its own partial index
+MARKET_WINE_COUNT = db.query("market_wine_count", "SELECT COUNT(*) FROM wines WHERE is_active = true")
+MARKET_REGION_COUNT = db.query("market_region_count", "SELECT COUNT(DISTINCT region) FROM wines WHERE is_active = true")
+MARKET_AVG_PRICE = db.query(
+    "market_avg_price", "SELECT AVG(price_retail) FROM wines WHERE is_active = true AND price_retail > 0"
+)
+MARKET_TOP_VINTAGE = db.query("market_top_vintage", """
+    SELECT vintage, COUNT(*) as count
+    FROM wines
+    WHERE is_active = true AND vintage IS NOT NULL
+    GROUP BY vintage
+    ORDER BY count DESC
+    LIMIT 1
+""")
+
+
 @agent.tool
+@track_tool
 async def show_wine_market(
     ctx: RunContext[StateDeps[AppState]],
 ) -> dict:
@@ -1028,43 +1393,19 @@ async def show_wine_market(
         return {"error": "Database not configured"}
 
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-
         # Get metrics
-        cur.execute("SELECT COUNT(*) FROM wines WHERE is_active = true")
-        total_wines = cur.fetchone()[0]
-
-        cur.execute("SELECT COUNT(DISTINCT region) FROM wines WHERE is_active = true")
-        total_regions = cur.fetchone()[0]
-
-        cur.execute("SELECT AVG(price_retail) FROM wines WHERE is_active = true AND price_retail > 0")
-        avg_price = cur.fetchone()[0] or 0
-
-        cur.execute("""
-            SELECT vintage, COUNT(*) as count
-            FROM wines
-            WHERE is_active = true AND vintage IS NOT NULL
-            GROUP BY vintage
-            ORDER BY count DESC
-            LIMIT 1
-        """)
-        top_vintage_row = cur.fetchone()
-        top_vintage = str(top_vintage_row[0]) if top_vintage_row else "N/A"
-
-        # Top regions
-        cur.execute("""
-            SELECT region, COUNT(*) as count
-            FROM wines
-            WHERE is_active = true AND region IS NOT NULL
-            GROUP BY region
-            ORDER BY count DESC
-            LIMIT 5
-        """)
-        top_regions = [{"name": row[0], "count": row[1]} for row in cur.fetchall()]
+        total_wines = (await load_catalog(MARKET_WINE_COUNT))[0][0]
+        total_regions = (await load_catalog(MARKET_REGION_COUNT))[0][0]
+        avg_price = (await load_catalog(MARKET_AVG_PRICE))[0][0] or 0
 
-        cur.close()
-        conn.close()
+        top_vintage_rows = await load_catalog(MARKET_TOP_VINTAGE)
+        top_vintage = str(top_vintage_rows[0][0]) if top_vintage_rows else "N/A"
+
+        # Top regions, unless the run is nearly out of time
+        partial = deadline.low()
+        top_regions = [] if partial else [
+            {"name": row[0], "count": row[1]} for row in await load_catalog(WINES_BY_REGION, [5])
+        ]
 
         return {
             "metrics": {
@@ -1076,25 +1417,176 @@ async def show_wine_market(
             "topRegions": top_regions,
             "title": "Wine Market Overview",
             "lastUpdated": "Live data",
+            **({"partial": True} if partial else {}),
         }
 
     except Exception as e:
         return {"error": str(e)}
 
 
+# Catalog tools the voice agent may call; the rest only make sense on screen
+hume_tools = [
+    search_wines,
+    get_wine_details,
+    get_similar_wines,
+    get_investment_wines,
+    calculate_wine_roi,
+    build_portfolio,
+    get_food_pairings,
+    show_wine_market,
+]
+
+
+# =====
+# Speculative Prefetch
+# =====
+catalog_prefetcher = prefetch.Prefetcher({
+    "search_wines": search_request,
+    "get_wine_details": details_request,
+    "get_investment_wines": investment_request,
+}, fetch_catalog)
+
+
+def prefetch_catalog(prompt: str) -> None:
+    """Warm the catalog cache for the lookups this turn's tools are likely to make."""
+    if DATABASE_URL and catalog_cache.max_entries:
+        catalog_prefetcher.warm(apply_phonetic_corrections(prompt), bool(INVESTMENT_TOPICS.search(prompt.lower())))
+
+
+# =====
+# Voice Fast Path
+# =====
+VOICE_SUBJECT = """
+    LOWER(name) LIKE %s OR LOWER(region) LIKE %s OR LOWER(country) LIKE %s OR LOWER(grape_variety) LIKE %s
+"""
+# The type is matched whole: as a substring, "red" would match Alfred and Redwood Valley too
+VOICE_TYPED_SUBJECT = f"LOWER(wine_type) = %s AND ({VOICE_SUBJECT})"
+VOICE_PRICE_EXTREME = """
+    SELECT name, region, vintage, price_retail
+    FROM wines
+    WHERE is_active = true AND price_retail > 0 AND ({subject})
+    ORDER BY price_retail {direction}
+    LIMIT 1
+"""
+VOICE_COUNT = "SELECT COUNT(*) FROM wines WHERE is_active = true AND ({subject})"
+
+
+def voice_queries(name: str, sql: str, **fields) -> dict[bool, db.Query]:
+    """`sql` for a question without (False) and with (True) a wine type."""
+    return {
+        False: db.query(name, sql.format(subject=VOICE_SUBJECT, **fields)),
+        True: db.query(f"{name}_typed", sql.format(subject=VOICE_TYPED_SUBJECT, **fields)),
+    }
+
+
+VOICE_QUERIES = {
+    "cheapest": voice_queries("voice_cheapest", VOICE_PRICE_EXTREME, direction="ASC"),
+    "most_expensive": voice_queries("voice_most_expensive", VOICE_PRICE_EXTREME, direction="DESC"),
+    "count": voice_queries("voice_count", VOICE_COUNT),
+}
+
+
+def spoken_wine(name: str, vintage: Optional[int]) -> str:
+    return f"{vintage} {name}" if vintage and str(vintage) not in name else name
+
+
+def spoken_price(price) -> str:
+    return f"£{float(price):,.2f}".replace(".00", "")
+
+
+def answer_voice_intent(intent: intents.Intent) -> Optional[str]:
+    """A templated spoken answer, or None when the LLM should answer instead."""
+    if intent.name == "pairing":
+        foods = [food.lower() for food in FOOD_PAIRINGS[intent.wine_type]]
+        return (
+            f"{intent.wine_type.capitalize()} wines are lovely with {', '.join(foods[:-1])} or {foods[-1]}. "
+            f"{SERVING_TIPS[intent.wine_type]}"
+        )
+    if not DATABASE_URL:
+        return None
+
+    subject = f"{intent.wine_type} {intent.term}".strip().title()
+    like = f"%{intent.term}%"
+    params = ([intent.wine_type] if intent.wine_type else []) + [like] * 4
+    if intent.name in ("cheapest", "most_expensive"):
+        rows = fetch_catalog(VOICE_QUERIES[intent.name][bool(intent.wine_type)], params)
+        if not rows:
+            return None
+        name, region, vintage, price = rows[0]
+        which = "cheapest" if intent.name == "cheapest" else "most expensive"
+        where = f" from {region}" if region else ""
+        return f"Our {which} {subject + ' ' if subject else ''}wine is the {spoken_wine(name, vintage)}{where}, at {spoken_price(price)} a bottle."
+    if intent.name == "count":
+        count = fetch_catalog(VOICE_QUERIES["count"][bool(intent.wine_type)], params)[0][0]
+        if not count:
+            return None
+        return f"We have {count:,} {subject + ' ' if subject else ''}{'wine' if count == 1 else 'wines'} in the cellar right now."
+    if intent.name == "price":
+        rows = fetch_catalog(WINE_DETAILS, [like])
+        if not rows or not rows[0][10]:
+            return None
+        row = rows[0]
+        return f"The {spoken_wine(row[1], row[6])} is {spoken_price(row[10])} a bottle."
+    return None
+
+
+def voice_fast_path(utterance: str) -> Optional[str]:
+    """Answer simple catalog, price and pairing questions without a model call."""
+    intent = intents.classify(utterance)
+    answer = None
+    if intent:
+        try:
+            answer = answer_voice_intent(intent)
+        except Exception as e:
+            log.warning("🎤 Voice fast path failed, asking the LLM", extra={"intent": intent.name, "error": str(e)})
+    metrics.voice_intents.inc(intent.name if answer else "llm")
+    return answer
+
+
+# Answers to voice questions asked without a name or Zep user, reused for
+# anyone who asks the same thing until the catalog changes
+voice_answers = answer_cache.AnswerCache()
+
+
+def tools_failed(messages: list) -> bool:
+    """Whether any tool call in the turn returned an error; such answers are not reused."""
+    return any(
+        isinstance(part, ToolReturnPart) and isinstance(part.content, dict) and "error" in part.content
+        for message in messages if isinstance(message, ModelRequest)
+        for part in message.parts
+    )
+
+
+def fast_path_messages(user_message: str, answer: str) -> list:
+    """The turn as model messages, so recordings of fast-path answers look like any other."""
+    return [
+        ModelRequest(parts=[UserPromptPart(content=user_message)]),
+        ModelResponse(parts=[TextPart(content=answer)], model_name="voice-fast-path"),
+    ]
+
+
 # =====
 # FastAPI App with AG-UI + OpenAI-compatible endpoint for Hume CLM
 # =====
 from fastapi import FastAPI, Request
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Route
 from pydantic_ai.models.groq import GroqModel
 import json
 import asyncio
+import hashlib
+import math
 import uuid
 import time
 
-main_app = FastAPI(title="DIONYSUS Wine Agent")
+main_app = FastAPI(title="DIONYSUS Wine Agent", on_startup=[start_migrations, start_catalog_feed],
+                   on_shutdown=[stop_migrations, stop_catalog_feed, db.close_pools, logs.shutdown],
+                   default_response_class=serialization.JSONResponse)
+
+# Large JSON (search results, charts, the catalog graph) goes out as brotli or gzip; streams do not
+main_app.add_middleware(serialization.CompressionMiddleware)
 
 main_app.add_middleware(
     CORSMiddleware,
@@ -1104,9 +1596,21 @@ main_app.add_middleware(
     allow_headers=["*"],
 )
 
+# No-op unless LOGFIRE_TOKEN or an OTLP collector endpoint is configured
+tracing.configure(main_app)
+
 # Middleware to extract user from CopilotKit/AG-UI instructions
 @main_app.middleware("http")
 async def extract_user_middleware(request: Request, call_next):
+    # Per-request debug logging, e.g. `X-Debug-Log: 1`
+    debug = logs.start_request(request.headers.get(logs.LOG_DEBUG_HEADER) == "1")
+    try:
+        return await _extract_user(request, call_next)
+    finally:
+        logs.request_debug.reset(debug)
+
+
+async def _extract_user(request: Request, call_next):
     if request.method == "POST":
         try:
             body_bytes = await request.body()
@@ -1115,13 +1619,15 @@ async def extract_user_middleware(request: Request, call_next):
 
                 # DEBUG: Log request structure for AG-UI endpoints
                 path = str(request.url.path)
-                if "/agui" in path:
-                    print(f"🔍 AG-UI request to {path}:", file=sys.stderr)
-                    print(f"   Keys: {list(body.keys())}", file=sys.stderr)
-                    if body.get("state"):
-                        print(f"   State keys: {list(body.get('state', {}).keys()) if isinstance(body.get('state'), dict) else type(body.get('state'))}", file=sys.stderr)
-                    if body.get("context"):
-                        print(f"   Context: {body.get('context')[:200] if isinstance(body.get('context'), str) else len(body.get('context'))} items", file=sys.stderr)
+                if "/agui" in path and logs.debug_enabled():
+                    state = body.get("state")
+                    context = body.get("context")
+                    log.debug("🔍 AG-UI request", extra={
+                        "path": path,
+                        "keys": list(body.keys()),
+                        "state_keys": list(state.keys()) if isinstance(state, dict) else type(state).__name__,
+                        "context_items": len(context) if isinstance(context, list) else None,
+                    })
 
                 # Check OpenAI format (messages array)
                 messages = body.get("messages", [])
@@ -1152,24 +1658,124 @@ async def extract_user_middleware(request: Request, call_next):
                             "name": user_data.get("firstName") or user_data.get("name"),
                             "email": user_data.get("email"),
                         }
-                        print(f"🍷 User from AG-UI state: {_cached_user_context.get('name')}", file=sys.stderr)
+                        log.info("🍷 User from AG-UI state", extra={"user": _cached_user_context.get("name")})
 
                 async def receive():
                     return {"type": "http.request", "body": body_bytes}
                 request = Request(request.scope, receive)
         except Exception as e:
-            print(f"[Middleware] Error: {e}", file=sys.stderr)
+            log.warning("[Middleware] Error: %s", e)
 
     return await call_next(request)
 
+def overloaded_response(priority: str, retry_after: float) -> Response:
+    """429 for a turn whose model call would not be admitted in time."""
+    return Response(
+        content=serialization.dumps({"error": {
+            "message": "DIONYSUS is busy, please try again shortly",
+            "type": "rate_limit_exceeded",
+            "code": 429,
+        }}),
+        media_type="application/json",
+        status_code=429,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
 # AG-UI endpoint (CopilotKit expects /agui/)
-ag_ui_app = agent.to_ag_ui(deps=StateDeps(AppState()))
+async def run_ag_ui(request: Request):
+    """Run the agent with deps private to this request's AG-UI thread."""
+    deadline.start(deadline.AGUI_DEADLINE_SECONDS)
+    try:
+        adapter = await AGUIAdapter.from_request(request, agent=agent)
+    except ValidationError as e:
+        return Response(content=e.json(), media_type="application/json", status_code=422)
+    thread_id = adapter.run_input.thread_id
+
+    # Frontends that omit state resume the thread's last committed state
+    if not adapter.run_input.state:
+        stored = session_states.snapshot(thread_id)
+        if stored:
+            adapter.run_input = adapter.run_input.model_copy(update={"state": stored})
+
+    deps = session_states.new_deps(thread_id)
+    run_recording = recording.start("agui", adapter.run_input.model_dump(mode="json", by_alias=True))
+    prompt = next((m.content for m in reversed(adapter.run_input.messages) if m.role == "user"), "")
+    turn_model = route_model(prompt if isinstance(prompt, str) else "")
+    # Shed the turn up front rather than have the stream fail part-way
+    retry_after = model_router.admission.precheck(turn_model.priority)
+    if retry_after is not None:
+        return overloaded_response(turn_model.priority, retry_after)
+    # Runs while the first model call is in flight
+    prefetch_catalog(prompt if isinstance(prompt, str) else "")
+
+    def commit_state(result):
+        session_states.commit(thread_id, deps.state)
+        if run_recording:
+            run_recording.finish(result.new_messages())
+
+    events = adapter.run_stream(
+        deps=deps,
+        model=recording.RecordingModel(turn_model) if run_recording else turn_model,
+        on_complete=commit_state,
+    )
+    if run_recording:
+        # Failed runs are the ones most worth replaying, so they are written too
+        events = recording.until_finished(run_recording, events, len(adapter.messages))
+    return adapter.streaming_response(events)
+
+
+ag_ui_app = Starlette(routes=[Route("/", run_ag_ui, methods=["POST"])])
 main_app.mount("/agui", ag_ui_app)
 
 
 # =====
 # OpenAI-compatible /chat/completions endpoint for Hume CLM
 # =====
+SUMMARY_INSTRUCTIONS = dedent("""
+    You keep the running summary of a voice conversation between a guest and DIONYSUS, a wine sommelier.
+    Fold the new turns into the summary so far. Keep the wines, regions, budgets, tastes and
+    decisions the guest mentioned, and what DIONYSUS recommended. Plain prose, at most 150 words.
+""").strip()
+
+
+async def summarize_conversation(summary: str, messages: list[dict]) -> str:
+    # A background task, so not bound by the turn that started it
+    deadline.start(deadline.AGUI_DEADLINE_SECONDS)
+    turns = "\n".join(f"{'Guest' if m['role'] == 'user' else 'DIONYSUS'}: {m['content']}" for m in messages)
+    summarizer = Agent(model_router.model("fast", priority="batch"), instructions=SUMMARY_INSTRUCTIONS)
+    result = await summarizer.run(f"Summary so far:\n{summary or '(none)'}\n\nNew turns:\n{turns}")
+    return str(result.output)
+
+
+# What the voice agent remembers of each Hume session beyond its recent turns
+voice_memory = voice_conversation.ConversationMemory(summarize_conversation)
+
+
+def voice_session_key(request: Request, conversation: list[dict], user_id: Optional[str]) -> Optional[str]:
+    """Hume's custom session id, else the user id, else the conversation's opening message."""
+    session_id = request.query_params.get("custom_session_id")
+    if session_id:
+        return f"session:{session_id}"
+    if user_id:
+        return f"user:{user_id}"
+    if conversation:
+        # Summaries are checked against the history they cover, so a shared opener cannot leak one
+        return "opening:" + hashlib.sha256(conversation[0]["content"].encode()).hexdigest()[:16]
+    return None
+
+
+def hume_history(messages: list[dict]) -> list:
+    """Hume's OpenAI-style messages as model messages."""
+    history = []
+    for m in messages:
+        if m["role"] == "assistant":
+            history.append(ModelResponse(parts=[TextPart(content=m["content"])]))
+        else:
+            history.append(ModelRequest(parts=[UserPromptPart(content=m["content"])]))
+    return history
+
+
 def extract_user_from_hume_messages(messages: list, system_prompt: str = "") -> dict:
     """Extract user info from Hume's messages and system prompt."""
     result = {"name": None, "user_id": None}
@@ -1210,7 +1816,7 @@ def extract_user_from_hume_messages(messages: list, system_prompt: str = "") ->
                         # Filter out common non-name words
                         if potential_name.lower() not in ['here', 'there', 'interested', 'looking', 'wondering', 'asking']:
                             result["name"] = potential_name
-                            print(f"🎤 Found name in user message: {potential_name}", file=sys.stderr)
+                            log.info("🎤 Found name in user message", extra={"user": potential_name})
                             break
                 if result["name"]:
                     break
@@ -1218,22 +1824,121 @@ def extract_user_from_hume_messages(messages: list, system_prompt: str = "") ->
     return result
 
 
+class Completion(NamedTuple):
+    id: str
+    created: int
+    text: str
+    prompt_tokens: int
+
+
+# Turns in progress or just answered, so duplicates get the same completion
+completions = coalesce.Coalescer()
+
+
+def completion_chunk(completion_id: str, created: int, delta: dict, finish_reason: Optional[str]) -> bytes:
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": "dionysus-1",
+        "choices": [{
+            "index": 0,
+            "delta": delta,
+            "finish_reason": finish_reason
+        }]
+    }
+    return serialization.sse(chunk)
+
+
+async def stream_completion(answer: asyncio.Future):
+    """Stream a completion in word chunks; every request sharing `answer` gets the same chunks."""
+    try:
+        completion = await asyncio.shield(answer)
+
+        words = completion.text.split()
+        for i, word in enumerate(words):
+            content = word + (" " if i < len(words) - 1 else "")
+            yield completion_chunk(completion.id, completion.created, {"content": content}, None)
+            await asyncio.sleep(0.02)  # Small delay for streaming effect
+
+        yield completion_chunk(completion.id, completion.created, {}, "stop")
+        yield b"data: [DONE]\n\n"
+
+    except Exception as e:
+        yield completion_chunk(
+            f"chatcmpl-{uuid.uuid4().hex[:8]}", int(time.time()),
+            {"content": "I apologize, I encountered an issue. Please try again."}, "stop",
+        )
+        yield b"data: [DONE]\n\n"
+        metrics.chat_errors.inc()
+        log.error("[Hume CLM Error] %s", e)
+
+
+async def completion_response(answer: asyncio.Future, stream: bool):
+    if stream:
+        return StreamingResponse(
+            stream_completion(answer),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+            }
+        )
+
+    try:
+        completion = await asyncio.shield(answer)
+    except Overloaded as e:
+        return overloaded_response(e.priority, e.retry_after)
+    completion_tokens = len(completion.text.split())
+    return {
+        "id": completion.id,
+        "object": "chat.completion",
+        "created": completion.created,
+        "model": "dionysus-1",
+        "choices": [{
+            "index": 0,
+            "message": {
+                "role": "assistant",
+                "content": completion.text
+            },
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": completion.prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": completion.prompt_tokens + completion_tokens
+        }
+    }
+
+
 @main_app.post("/chat/completions")
 async def chat_completions(request: Request):
     """OpenAI-compatible chat completions endpoint for Hume CLM integration."""
+    started = time.perf_counter()
+    metrics.chat_in_flight.inc()
+    try:
+        response = await _chat_completions(request)
+    except BaseException:
+        metrics.chat_in_flight.dec()
+        raise
+    if isinstance(response, StreamingResponse):
+        # Latency and in-flight are settled when the last chunk is sent
+        response.body_iterator = metrics.track_chat_stream(response.body_iterator, started)
+    else:
+        metrics.chat_latency.observe(time.perf_counter() - started, "false")
+        metrics.chat_in_flight.dec()
+    return response
+
+
+async def _chat_completions(request: Request):
+    turn_key, shared, owner = None, None, False
+    # Inherited by the tasks and threads that answer this turn
+    deadline.start(deadline.VOICE_DEADLINE_SECONDS)
     try:
         body = await request.json()
         messages = body.get("messages", [])
         stream = body.get("stream", True)
 
-        # DEBUG: Log what Hume sends us
-        print(f"🎤 Hume CLM request received:", file=sys.stderr)
-        print(f"   Messages count: {len(messages)}", file=sys.stderr)
-        for i, msg in enumerate(messages):
-            role = msg.get("role", "?")
-            content = msg.get("content", "")[:200]  # First 200 chars
-            print(f"   [{i}] {role}: {content}...", file=sys.stderr)
-
         # Extract conversation from messages
         conversation = []
         system_prompt = None
@@ -1242,7 +1947,7 @@ async def chat_completions(request: Request):
             content = msg.get("content", "")
             if role == "system":
                 system_prompt = content
-                print(f"🎤 Found system prompt ({len(content)} chars), contains 'Name:': {'Name:' in content}", file=sys.stderr)
+                log.debug("🎤 Found system prompt", extra={"chars": len(content), "has_name": "Name:" in content})
             else:
                 conversation.append({"role": role, "content": content})
 
@@ -1257,13 +1962,37 @@ async def chat_completions(request: Request):
         if not user_id and _cached_user_context.get("user_id"):
             user_id = _cached_user_context.get("user_id")
 
-        print(f"🎤 Hume CLM - User: {user_name or 'anonymous'}", file=sys.stderr)
+        # A retried or repeated turn shares the first request's answer; answers
+        # are personalised, so only for the same resolved user
+        idempotency_key = request.headers.get("idempotency-key")
+        turn_key = f"{idempotency_key}:{user_id or ''}" if idempotency_key else coalesce.fingerprint(
+            messages, request.query_params.get("custom_session_id"), body.get("model"), user_id,
+        )
+        shared, owner = completions.claim(turn_key)
+        if not owner:
+            return await completion_response(shared, stream)
+
+        turn_recording = recording.start("hume", body)
+
+        # DEBUG: Log what Hume sends us (only built when this request enabled debug)
+        log.info("🎤 Hume CLM request received", extra={"messages": len(messages)})
+        if logs.debug_enabled():
+            for i, msg in enumerate(messages):
+                log.debug("🎤 Hume message", extra={
+                    "index": i,
+                    "role": msg.get("role", "?"),
+                    "content": msg.get("content", "")[:200],  # First 200 chars
+                })
 
-        # Get the last user message
+        log.info("🎤 Hume CLM", extra={"user": user_name or "anonymous"})
+
+        # Get the last user message; what came before it is the history
         user_message = ""
-        for msg in reversed(conversation):
-            if msg["role"] == "user":
-                user_message = msg["content"]
+        history = []
+        for i in range(len(conversation) - 1, -1, -1):
+            if conversation[i]["role"] == "user":
+                user_message = conversation[i]["content"]
+                history = conversation[:i]
                 break
 
         if not user_message:
@@ -1272,16 +2001,31 @@ async def chat_completions(request: Request):
         # Apply phonetic corrections
         user_message = apply_phonetic_corrections(user_message)
 
+        # Simple catalog, price and pairing questions skip the model entirely,
+        # and so do repeats of questions already answered for someone else
+        fast_answer = await asyncio.to_thread(voice_fast_path, user_message)
+        answer_key, answers_version = None, voice_answers.version
+        if not fast_answer and not (user_name or user_id) and answer_cache.cacheable(user_message):
+            # The earlier turns and their summary shape the answer, so they are part of the key
+            answer_key = voice_answers.key(user_message, system_prompt or "", history)
+            fast_answer = voice_answers.get(answer_key)
+        if not fast_answer:
+            retry_after = model_router.admission.precheck("voice")
+            if retry_after is not None:
+                completions.abandon(turn_key, shared, Overloaded("voice", retry_after, "precheck"))
+                return overloaded_response("voice", retry_after)
+            prefetch_catalog(user_message)
+
         # Fetch Zep context if we have a user ID
         zep_context = ""
-        if user_id and ZEP_API_KEY:
+        if user_id and ZEP_API_KEY and not fast_answer:
             try:
                 zep_ctx, _ = await get_user_wine_preferences(user_id)
                 if zep_ctx:
                     zep_context = zep_ctx
-                    print(f"🧠 Zep context loaded for Hume", file=sys.stderr)
+                    log.info("🧠 Zep context loaded for Hume")
             except Exception as e:
-                print(f"[Hume Zep] Error: {e}", file=sys.stderr)
+                log.warning("[Hume Zep] Error: %s", e)
 
         # Build personalized system prompt - USER CONTEXT MUST BE FIRST AND EXPLICIT
         if user_name:
@@ -1304,14 +2048,29 @@ MANDATORY RULES:
 No user name provided. You may ask for their name if relevant.
 """
 
-        # Create a simple agent for Hume (without tools - just chat)
+        # Recent turns go to the model as they are, older ones as a summary kept between turns
+        summary, recent = "", []
+        if not fast_answer:
+            summary, recent = voice_memory.context(voice_session_key(request, conversation, user_id), history)
+        if summary:
+            user_section += f"""
+## EARLIER IN THIS CONVERSATION
+{summary}
+"""
+
+        # Agent for the open-ended questions the fast path leaves to the LLM
+        turn_model = route_model(user_message, voice=True)
         hume_agent = Agent(
-            model=GroqModel("llama-3.3-70b-versatile"),
-            system_prompt=dedent(f"""
+            model=recording.RecordingModel(turn_model) if turn_recording else turn_model,
+            deps_type=StateDeps[AppState],
+            tools=hume_tools,
+            # Instructions rather than a system prompt, which is dropped when there is message history
+            instructions=dedent(f"""
 {user_section}
 
 You are DIONYSUS, an expert AI wine sommelier for Aionysus.
 You have deep knowledge of wines, regions, investments, and pairings.
+Use your tools for specific wines, prices and investment figures rather than guessing.
 Keep responses concise for voice - 1-2 sentences unless asked for details.
 Be warm, knowledgeable, and approachable.
 
@@ -1319,88 +2078,26 @@ Be warm, knowledgeable, and approachable.
             """).strip(),
         )
 
-        if stream:
-            # Streaming response for Hume
-            async def generate():
-                response_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
-                created = int(time.time())
-
+        async def respond() -> str:
+            if fast_answer:
+                if turn_recording:
+                    turn_recording.finish(fast_path_messages(user_message, fast_answer))
+                return fast_answer
+            message_history = hume_history(recent)
+            with capture_run_messages() as run_messages:
                 try:
-                    # Run the agent
-                    result = await hume_agent.run(user_message)
-                    # Extract the actual text from AgentRunResult
-                    if hasattr(result, 'output'):
-                        response_text = str(result.output)
-                    elif hasattr(result, 'data'):
-                        response_text = str(result.data)
-                    else:
-                        response_text = str(result)
-                    # Clean up any AgentRunResult wrapper if it slipped through
-                    if response_text.startswith("AgentRunResult("):
-                        import re
-                        match = re.search(r'output=["\'](.+?)["\']', response_text)
-                        if match:
-                            response_text = match.group(1)
-
-                    # Stream the response in chunks
-                    words = response_text.split()
-                    for i, word in enumerate(words):
-                        chunk = {
-                            "id": response_id,
-                            "object": "chat.completion.chunk",
-                            "created": created,
-                            "model": "dionysus-1",
-                            "choices": [{
-                                "index": 0,
-                                "delta": {"content": word + (" " if i < len(words) - 1 else "")},
-                                "finish_reason": None
-                            }]
-                        }
-                        yield f"data: {json.dumps(chunk)}\n\n"
-                        await asyncio.sleep(0.02)  # Small delay for streaming effect
-
-                    # Send finish
-                    finish_chunk = {
-                        "id": response_id,
-                        "object": "chat.completion.chunk",
-                        "created": created,
-                        "model": "dionysus-1",
-                        "choices": [{
-                            "index": 0,
-                            "delta": {},
-                            "finish_reason": "stop"
-                        }]
-                    }
-                    yield f"data: {json.dumps(finish_chunk)}\n\n"
-                    yield "data: [DONE]\n\n"
-
-                except Exception as e:
-                    error_chunk = {
-                        "id": response_id,
-                        "object": "chat.completion.chunk",
-                        "created": created,
-                        "model": "dionysus-1",
-                        "choices": [{
-                            "index": 0,
-                            "delta": {"content": f"I apologize, I encountered an issue. Please try again."},
-                            "finish_reason": "stop"
-                        }]
-                    }
-                    yield f"data: {json.dumps(error_chunk)}\n\n"
-                    yield "data: [DONE]\n\n"
-                    print(f"[Hume CLM Error] {e}", file=sys.stderr)
-
-            return StreamingResponse(
-                generate(),
-                media_type="text/event-stream",
-                headers={
-                    "Cache-Control": "no-cache",
-                    "Connection": "keep-alive",
-                }
-            )
-        else:
-            # Non-streaming response
-            result = await hume_agent.run(user_message)
+                    result = await hume_agent.run(
+                        user_message, message_history=message_history,
+                        deps=StateDeps(AppState(user=UserProfile(id=user_id, name=user_name) if user_id else None)),
+                    )
+                except BaseException as e:
+                    # Failed turns are the ones most worth replaying: record the messages up to the error
+                    if turn_recording:
+                        turn_recording.finish(run_messages[len(message_history):], error=recording.describe(e))
+                    raise
+            new_messages = result.new_messages()
+            if turn_recording:
+                turn_recording.finish(new_messages)
             # Extract the actual text from AgentRunResult
             if hasattr(result, 'output'):
                 response_text = str(result.output)
@@ -1410,33 +2107,24 @@ Be warm, knowledgeable, and approachable.
                 response_text = str(result)
             # Clean up any AgentRunResult wrapper if it slipped through
             if response_text.startswith("AgentRunResult("):
-                import re
                 match = re.search(r'output=["\'](.+?)["\']', response_text)
                 if match:
                     response_text = match.group(1)
+            if answer_key and not tools_failed(new_messages):
+                voice_answers.put(answer_key, response_text, answers_version)
+            return response_text
+
+        async def complete() -> Completion:
+            response_text = await respond()
+            return Completion(
+                f"chatcmpl-{uuid.uuid4().hex[:8]}", int(time.time()), response_text, len(user_message.split()),
+            )
 
-            return {
-                "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
-                "object": "chat.completion",
-                "created": int(time.time()),
-                "model": "dionysus-1",
-                "choices": [{
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": response_text
-                    },
-                    "finish_reason": "stop"
-                }],
-                "usage": {
-                    "prompt_tokens": len(user_message.split()),
-                    "completion_tokens": len(response_text.split()),
-                    "total_tokens": len(user_message.split()) + len(response_text.split())
-                }
-            }
+        return await completion_response(completions.run(turn_key, shared, complete()), stream)
 
     except Exception as e:
-        print(f"[Hume CLM Error] {e}", file=sys.stderr)
+        metrics.chat_errors.inc()
+        log.error("[Hume CLM Error] %s", e)
         return {
             "error": {
                 "message": str(e),
@@ -1444,11 +2132,75 @@ Be warm, knowledgeable, and approachable.
                 "code": 500
             }
         }
+    finally:
+        # No-op once the turn is running; otherwise duplicates stop waiting for it
+        if owner:
+            completions.abandon(turn_key, shared)
+
+
+# Prometheus scrape endpoint
+@main_app.get("/metrics")
+async def metrics_endpoint():
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+# =====
+# Catalog Graph
+# =====
+GRAPH_WINES = db.query("graph_wines", """
+    SELECT id, name, winery, region, country, grape_variety
+    FROM wines
+    WHERE is_active = true
+""")
+
+
+def load_graph_rows() -> list:
+    return read_rows(GRAPH_WINES)
+
+
+catalog_graphs = catalog_graph.GraphCache(load_graph_rows)
+
+
+@main_app.get("/graph")
+async def graph_endpoint(request: Request, node: Optional[str] = None, depth: int = 1,
+                         wines: Optional[bool] = None, format: str = "compact"):
+    """Catalog graph around `node` (the graph without wines when omitted) for the 3D graph UI."""
+    if not DATABASE_URL:
+        return serialization.JSONResponse({"error": "Database not configured"}, status_code=503)
+    depth = max(0, min(depth, catalog_graph.GRAPH_MAX_DEPTH))
+    try:
+        body, etag = await catalog_graphs.response(
+            node.lower() if node else None, depth, node is not None if wines is None else wines, format == "full",
+        )
+    except KeyError:
+        return serialization.JSONResponse({"error": f"Unknown node '{node}'"}, status_code=404)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    matches = request.headers.get("if-none-match", "")
+    if matches.strip() == "*" or etag in (m.strip().removeprefix("W/") for m in matches.split(",")):
+        metrics.graph_responses.inc("not_modified")
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 # Health check
 @main_app.get("/health")
 async def health():
-    return {"status": "healthy", "agent": "DIONYSUS"}
+    return {
+        "status": "healthy",
+        "agent": "DIONYSUS",
+        "sessions": session_states.stats(),
+        "database": db_router().stats() if DATABASE_URL else None,
+        "migrations": migration_status(),
+        "catalog_cache": catalog_cache.stats(),
+        "neighbours": neighbour_refresher.stats() if neighbour_refresher else None,
+        "voice_answers": voice_answers.stats(),
+        "voice_memory": voice_memory.stats(),
+        "preference_profiles": preference_profiles.stats(),
+        "catalog_graph": catalog_graphs.stats(),
+        "completions": completions.stats(),
+        "models": model_router.stats(),
+        "admission": model_router.admission.stats(),
+        "zep": zep_guard.stats() if ZEP_API_KEY else None,
+    }
 
 app = main_app
@@ -0,0 +1,159 @@
+"""
+Voice answer cache for DIONYSUS
+Answers to voice questions that were not personalised, keyed on the
+normalised, phonetically corrected utterance with filler words removed, and
+on the Hume system prompt and earlier turns they were answered under (so an
+answer shaped by one caller's conversation only reaches the same conversation). With
+ANSWER_CACHE_SIMILARITY below 1, a question worded close enough to a cached
+one (cosine similarity of character trigram vectors, computed locally) gets
+that answer too. Entries expire after ANSWER_CACHE_TTL_SECONDS, and every
+catalog change empties the cache, since an answer may quote any wine or price.
+"""
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import NamedTuple, Optional, Sequence
+
+import catalog_cache
+import intents
+import logs
+import metrics
+
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+# 1 reuses answers only for the same words; ~0.9 also catches rewordings
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "1"))
+
+# Dropped before comparing questions; none of them change what is asked
+_FILLERS = {
+    "a", "an", "the", "um", "uh", "er", "erm", "hmm", "oh", "so", "well", "okay", "ok", "hey", "hi", "hello",
+    "please", "dionysus", "just", "actually", "really", "now", "could", "can", "would", "you", "me", "us",
+}
+# Questions that lean on earlier turns; their answer depends on more than the words
+_REFERENCES = {
+    "it", "its", "it's", "that", "this", "them", "those", "these", "they", "their", "one", "ones",
+    "more", "another", "else", "other", "again", "instead", "cheaper", "pricier", "similar", "same",
+    "my", "i", "i'm", "i've", "we", "our",
+}
+
+log = logs.get_logger("answers")
+
+
+class AnswerKey(NamedTuple):
+    # Digest of the system prompt and the conversation before the question
+    prompt: str
+    question: str
+
+
+def canonical(utterance: str) -> str:
+    return " ".join(w for w in intents.normalize(utterance).split() if w not in _FILLERS)
+
+
+def cacheable(utterance: str) -> bool:
+    """Whether the question stands on its own, so another caller's answer fits it."""
+    words = intents.normalize(utterance).split()
+    return bool(words) and not _REFERENCES.intersection(words)
+
+
+def _vector(question: str) -> Counter:
+    padded = f" {question} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[gram] for gram, count in a.items() if gram in b)
+    if not dot:
+        return 0.0
+    return dot / (math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values())))
+
+
+class _Entry:
+    __slots__ = ("answer", "vector", "stored")
+
+    def __init__(self, answer: str, vector: Counter):
+        self.answer = answer
+        self.vector = vector
+        self.stored = time.monotonic()
+
+
+class AnswerCache:
+    """LRU of voice answers, emptied whenever the catalog changes."""
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_MAX_ENTRIES, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 similarity: float = ANSWER_CACHE_SIMILARITY):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.version = 0
+        self._entries: OrderedDict[AnswerKey, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        catalog_cache.subscribe(self.clear)
+
+    def key(self, utterance: str, system_prompt: str = "", history: Sequence[dict] = ()) -> AnswerKey:
+        context = hashlib.sha256(system_prompt.encode())
+        for m in history:
+            context.update(f"\0{m.get('role')}\0{' '.join(str(m.get('content') or '').split())}".encode())
+        return AnswerKey(context.hexdigest()[:16], canonical(utterance))
+
+    def get(self, key: AnswerKey) -> Optional[str]:
+        if not self.max_entries:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.stored < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                metrics.answer_cache_requests.inc("hit")
+                return entry.answer
+            if entry is not None:
+                del self._entries[key]
+            if self.similarity < 1:
+                found = self._nearest(key, now)
+                if found is not None:
+                    metrics.answer_cache_requests.inc("similar")
+                    return found
+        metrics.answer_cache_requests.inc("miss")
+        return None
+
+    def _nearest(self, key: AnswerKey, now: float) -> Optional[str]:
+        vector = _vector(key.question)
+        best, best_score = None, self.similarity
+        for other, entry in self._entries.items():
+            if other.prompt != key.prompt or now - entry.stored >= self.ttl_seconds:
+                continue
+            score = _cosine(vector, entry.vector)
+            if score >= best_score:
+                best, best_score = entry, score
+        if best is None:
+            return None
+        log.debug("🎤 Reusing answer to a similar question", extra={"similarity": round(best_score, 3)})
+        return best.answer
+
+    def put(self, key: AnswerKey, answer: str, version: int) -> None:
+        """Store `answer` if the catalog has not changed since `version` (read before answering)."""
+        if not self.max_entries or not answer.strip():
+            return
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = _Entry(answer, _vector(key.question))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, change=None) -> None:
+        # Rewritten similar-wine lists are not a catalog change
+        if change is not None and change.op == catalog_cache.NEIGHBOURS_OP:
+            return
+        with self._lock:
+            self.version += 1
+            dropped = len(self._entries)
+            self._entries.clear()
+        if dropped:
+            metrics.answer_cache_invalidated.inc(amount=dropped)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "version": self.version, "similarity": self.similarity}
@@ -0,0 +1,279 @@
+"""
+Catalog cache for DIONYSUS
+Results of read-only catalog queries, kept until Postgres reports that the
+wines they depend on changed. Triggers on `wines` (migration 4) send the
+changed ids, regions and countries on the `catalog_changed` channel; the
+change feed LISTENs for them on the primary, or polls table statistics where
+LISTEN is unavailable (e.g. behind a transaction-mode pooler).
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+import logs
+import metrics
+
+CATALOG_CHANNEL = "catalog_changed"
+# Op of the notification neighbours.py sends after rewriting similar-wine lists; no wine changed
+NEIGHBOURS_OP = "NEIGHBOURS"
+# listen | poll | off
+CATALOG_CHANGES = os.getenv("CATALOG_CHANGES", "listen").lower()
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", "30"))
+CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", "2000"))
+# Safety net for a missed notification
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "3600"))
+
+log = logs.get_logger("catalog")
+
+
+class CatalogChange:
+    """Wines that changed; None for ids or places means "unknown, assume everything"."""
+
+    def __init__(self, ids: Optional[Iterable[int]] = None, places: Optional[Iterable[str]] = None, source: str = "",
+                 op: str = ""):
+        self.ids = set(ids) if ids is not None else None
+        self.places = {p.lower() for p in places if p} if places is not None else None
+        self.source = source
+        # INSERT / UPDATE / DELETE from the wines trigger, NEIGHBOURS from neighbours.py
+        self.op = op
+
+    @classmethod
+    def from_payload(cls, payload: str) -> "CatalogChange":
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return cls(source="notify")
+        return cls(data.get("ids"), data.get("places"), source="notify", op=data.get("op") or "")
+
+    @property
+    def everything(self) -> bool:
+        return self.ids is None and self.places is None
+
+
+_subscribers: list[Callable[[CatalogChange], None]] = []
+
+
+def subscribe(callback: Callable[[CatalogChange], None]) -> None:
+    """Call `callback` with every catalog change this process hears about."""
+    _subscribers.append(callback)
+
+
+def publish(change: CatalogChange) -> None:
+    metrics.catalog_changes.inc(change.source or "local")
+    for callback in _subscribers:
+        try:
+            callback(change)
+        except Exception:
+            log.exception("❌ Catalog change subscriber failed")
+
+
+# =====
+# Query result cache
+# =====
+class _Entry:
+    __slots__ = ("value", "stored", "ids", "terms", "prefetched")
+
+    def __init__(self, value, ids: Optional[frozenset], terms: Optional[frozenset], prefetched: bool = False):
+        self.value = value
+        self.stored = time.monotonic()
+        self.ids = ids
+        self.terms = terms
+        # Loaded speculatively and not read by a tool yet
+        self.prefetched = prefetched
+
+    def affected_by(self, change: CatalogChange) -> bool:
+        if change.op == NEIGHBOURS_OP:
+            # Only results scoped to the wines whose lists were rewritten (similar wines) read them
+            return self.ids is not None and (change.ids is None or bool(self.ids & change.ids))
+        # Entries that declared no scope depend on the whole catalog
+        if change.everything or (self.ids is None and self.terms is None):
+            return True
+        if self.ids is not None and change.ids is not None and self.ids & change.ids:
+            return True
+        if self.terms is not None:
+            # Terms are LIKE '%term%' filters, so a changed "Burgundy" row affects "burg"
+            if change.places is None:
+                return True
+            return any(term in place for term in self.terms for place in change.places)
+        return self.ids is not None and change.ids is None
+
+
+class CatalogCache:
+    """LRU of catalog query results scoped by wine id and/or region/country search terms.
+
+    A result loaded while a change was landing is not stored, and with read
+    replicas nothing is stored until `settle_seconds` after the last change,
+    so a lagging replica cannot refill the cache with rows from before it.
+    """
+
+    def __init__(self, max_entries: int = CATALOG_CACHE_MAX_ENTRIES, ttl_seconds: float = CATALOG_CACHE_TTL_SECONDS,
+                 settle_seconds: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.settle_seconds = settle_seconds
+        self.version = 0
+        self.changed_at = float("-inf")
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+        subscribe(self.invalidate)
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry.stored < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                metrics.catalog_cache_requests.inc("hit")
+                if entry.prefetched:
+                    entry.prefetched = False
+                    metrics.catalog_prefetch.inc("used")
+                return entry.value
+            if entry is not None:
+                self._drop(key)
+        metrics.catalog_cache_requests.inc("miss")
+        return None
+
+    def contains(self, key: tuple) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry.stored < self.ttl_seconds
+
+    def put(self, key: tuple, value, version: int, ids: Optional[Iterable[int]] = None,
+            terms: Optional[Iterable[str]] = None, prefetched: bool = False) -> None:
+        """Store `value` if the catalog is still at `version` (read before loading it)."""
+        with self._lock:
+            if version != self.version or time.monotonic() - self.changed_at < self.settle_seconds:
+                return
+            self._entries[key] = _Entry(
+                value,
+                frozenset(ids) if ids is not None else None,
+                frozenset(t.lower() for t in terms) if terms is not None else None,
+                prefetched,
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: tuple) -> None:
+        if self._entries.pop(key).prefetched:
+            metrics.catalog_prefetch.inc("unused")
+
+    def invalidate(self, change: CatalogChange) -> int:
+        with self._lock:
+            self.version += 1
+            self.changed_at = time.monotonic()
+            stale = [key for key, entry in self._entries.items() if entry.affected_by(change)]
+            for key in stale:
+                self._drop(key)
+        metrics.catalog_cache_invalidated.inc(amount=len(stale))
+        return len(stale)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "version": self.version}
+
+
+# =====
+# Change feed
+# =====
+# Cheap fingerprint for polling; any write to wines moves it
+TABLE_WRITES = "SELECT n_tup_ins, n_tup_upd, n_tup_del FROM pg_stat_user_tables WHERE relname = 'wines'"
+
+
+class ChangeFeed:
+    """Publishes catalog changes from LISTEN (or polling) on the primary.
+
+    LISTEN runs on the event loop via add_reader, so subscribers are called
+    on the loop thread. After a dropped LISTEN connection everything is
+    invalidated once it is back, since notifications may have been missed.
+    """
+
+    def __init__(self, database_url: str, mode: str = CATALOG_CHANGES, poll_seconds: float = CATALOG_POLL_SECONDS):
+        self.database_url = database_url
+        self.mode = mode
+        self.poll_seconds = poll_seconds
+        self._conn: Optional[psycopg2.extensions.connection] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.mode == "listen":
+            self._task = asyncio.create_task(self._listen_forever())
+        elif self.mode == "poll":
+            self._task = asyncio.create_task(self._poll_forever())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._close()
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            try:
+                asyncio.get_running_loop().remove_reader(self._conn.fileno())
+            except (RuntimeError, ValueError, psycopg2.InterfaceError):
+                pass
+            self._conn.close()
+            self._conn = None
+
+    async def _listen_forever(self) -> None:
+        loop = asyncio.get_running_loop()
+        backoff, first = 1.0, True
+        while True:
+            try:
+                self._conn = await asyncio.to_thread(psycopg2.connect, self.database_url)
+                self._conn.autocommit = True
+                self._conn.cursor().execute(f"LISTEN {CATALOG_CHANNEL}")
+                lost = asyncio.Event()
+                loop.add_reader(self._conn.fileno(), self._drain, lost)
+                log.info("🔔 Listening for catalog changes")
+                if not first:
+                    publish(CatalogChange(source="reconnect"))
+                first, backoff = False, 1.0
+                await lost.wait()
+            except psycopg2.Error as e:
+                log.warning("⚠️ Catalog change feed unavailable, retrying", extra={"error": str(e), "retry_in": backoff})
+            self._close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
+
+    def _drain(self, lost: asyncio.Event) -> None:
+        try:
+            self._conn.poll()
+        except psycopg2.Error:
+            lost.set()
+            return
+        while self._conn.notifies:
+            notify = self._conn.notifies.pop(0)
+            publish(CatalogChange.from_payload(notify.payload))
+
+    async def _poll_forever(self) -> None:
+        last = None
+        while True:
+            try:
+                current = await asyncio.to_thread(self._table_writes)
+                if last is not None and current != last:
+                    publish(CatalogChange(source="poll"))
+                last = current
+            except psycopg2.Error as e:
+                log.warning("⚠️ Catalog poll failed", extra={"error": str(e)})
+                self._close()
+            await asyncio.sleep(self.poll_seconds)
+
+    def _table_writes(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = psycopg2.connect(self.database_url)
+            self._conn.autocommit = True
+        cur = self._conn.cursor()
+        cur.execute(TABLE_WRITES)
+        row = cur.fetchone()
+        cur.close()
+        return row
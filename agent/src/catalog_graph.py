@@ -0,0 +1,215 @@
+"""
+Catalog knowledge graph for DIONYSUS
+Countries, regions, grapes, wineries and wines as one graph for the 3D graph
+UI. It is built from the catalog once per catalog version, in a worker
+thread, and kept as compressed adjacency arrays. Requests take the subgraph
+within `depth` hops of a node (or the graph without wines), capped at
+GRAPH_MAX_NODES. Each distinct response is serialized once and served with a
+content ETag, so an unchanged graph costs the client a 304.
+
+Compact format: parallel node arrays, and edges as flat [source, target,
+type] index triples. The full format has the ForceGraph3D shape ({nodes:
+[{id, type, label}], edges: [{source, target, type}]}).
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+
+import logs
+import metrics
+import serialization
+from catalog_cache import NEIGHBOURS_OP, CatalogChange, subscribe
+
+GRAPH_MAX_NODES = int(os.getenv("GRAPH_MAX_NODES", "2000"))
+GRAPH_MAX_DEPTH = int(os.getenv("GRAPH_MAX_DEPTH", "3"))
+
+# Neighbours are visited in this order, so a capped subgraph keeps structure before individual wines
+NODE_TYPES = ("country", "region", "grape", "winery", "wine")
+# region in country, winery in region, wine from region, wine made_by winery, wine of grape
+EDGE_TYPES = ("in", "from", "made_by", "grape")
+WINE = NODE_TYPES.index("wine")
+
+log = logs.get_logger("catalog_graph")
+
+# (id, name, winery, region, country, grape_variety) of each active wine
+Row = tuple[int, Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]
+
+
+class Graph:
+    """Nodes in type order and undirected adjacency in CSR form (neighbours in type order)."""
+
+    def __init__(self, rows: list[Row]):
+        nodes: dict[str, tuple[int, str]] = {}
+        edges: set[tuple[str, str, int]] = set()
+
+        def node(kind: int, key, label: str) -> str:
+            node_id = f"{NODE_TYPES[kind]}:{key}"
+            nodes.setdefault(node_id, (kind, label))
+            return node_id
+
+        for wine_id, name, winery, region, country, grape in rows:
+            wine = node(WINE, wine_id, name or f"Wine {wine_id}")
+            country_id = node(0, country.strip().lower(), country.strip()) if country and country.strip() else None
+            region_id = node(1, region.strip().lower(), region.strip()) if region and region.strip() else None
+            if region_id:
+                edges.add((wine, region_id, 1))
+                if country_id:
+                    edges.add((region_id, country_id, 0))
+            if grape and grape.strip():
+                edges.add((wine, node(2, grape.strip().lower(), grape.strip()), 3))
+            if winery and winery.strip():
+                winery_id = node(3, winery.strip().lower(), winery.strip())
+                edges.add((wine, winery_id, 2))
+                if region_id:
+                    edges.add((winery_id, region_id, 0))
+
+        order = sorted(nodes, key=lambda n: (nodes[n][0], nodes[n][1].lower()))
+        self.ids = order
+        self.index = {node_id: i for i, node_id in enumerate(order)}
+        self.types = np.array([nodes[n][0] for n in order], dtype=np.int8)
+        self.labels = [nodes[n][1] for n in order]
+        edge_list = sorted(edges)
+        self.source = np.array([self.index[s] for s, _, _ in edge_list], dtype=np.int32)
+        self.target = np.array([self.index[t] for _, t, _ in edge_list], dtype=np.int32)
+        self.kind = np.array([k for _, _, k in edge_list], dtype=np.int8)
+
+        # Both directions; node indices are in type order, so sorting by neighbour sorts by type too
+        frm = np.concatenate([self.source, self.target])
+        to = np.concatenate([self.target, self.source])
+        order = np.lexsort((to, frm))
+        self.adjacent = to[order]
+        self.indptr = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(frm, minlength=len(self.ids)), out=self.indptr[1:])
+
+    def neighbourhood(self, node: Optional[str], depth: int, wines: bool,
+                      max_nodes: int = GRAPH_MAX_NODES) -> tuple[np.ndarray, bool]:
+        """Indices of the nodes within `depth` hops of `node` (every node when None) and whether the cap cut it short."""
+        allowed = np.ones(len(self.ids), dtype=bool) if wines else self.types != WINE
+        if node is None:
+            chosen = np.flatnonzero(allowed)
+            return chosen[:max_nodes], len(chosen) > max_nodes
+        start = self.index[node]
+        seen = {start}
+        frontier = [start]
+        for _ in range(depth):
+            following = []
+            for i in frontier:
+                for j in self.adjacent[self.indptr[i]:self.indptr[i + 1]].tolist():
+                    if j in seen or not allowed[j]:
+                        continue
+                    if len(seen) >= max_nodes:
+                        return np.array(sorted(seen)), True
+                    seen.add(j)
+                    following.append(j)
+            frontier = following
+        return np.array(sorted(seen)), False
+
+    def payload(self, chosen: np.ndarray, full: bool) -> dict:
+        member = np.zeros(len(self.ids), dtype=bool)
+        member[chosen] = True
+        kept = np.flatnonzero(member[self.source] & member[self.target])
+        if full:
+            return {
+                "nodes": [{"id": self.ids[i], "type": NODE_TYPES[self.types[i]], "label": self.labels[i]}
+                          for i in chosen.tolist()],
+                "edges": [{"source": self.ids[s], "target": self.ids[t], "type": EDGE_TYPES[k]}
+                          for s, t, k in zip(self.source[kept].tolist(), self.target[kept].tolist(),
+                                             self.kind[kept].tolist())],
+            }
+        position = np.full(len(self.ids), -1, dtype=np.int64)
+        position[chosen] = np.arange(len(chosen))
+        triples = np.stack([position[self.source[kept]], position[self.target[kept]], self.kind[kept]], axis=1)
+        return {
+            "node_types": NODE_TYPES,
+            "edge_types": EDGE_TYPES,
+            "nodes": {
+                "id": [self.ids[i] for i in chosen.tolist()],
+                "type": self.types[chosen].tolist(),
+                "label": [self.labels[i] for i in chosen.tolist()],
+            },
+            "edges": triples.ravel().tolist(),
+        }
+
+    def stats(self) -> dict:
+        return {"nodes": len(self.ids), "edges": len(self.source)}
+
+
+class GraphCache:
+    """The graph for the current catalog version, rebuilt on first use after a change.
+
+    `load` returns the catalog rows and runs in a worker thread; concurrent
+    requests after a change share one rebuild.
+    """
+
+    def __init__(self, load: Callable[[], list[Row]], max_responses: int = 256):
+        self.load = load
+        self.max_responses = max_responses
+        self.version = 0
+        self._graph: Optional[Graph] = None
+        self._graph_version = -1
+        self._lock = asyncio.Lock()
+        self._responses: OrderedDict[tuple, tuple[bytes, str]] = OrderedDict()
+        subscribe(self.invalidate)
+
+    def invalidate(self, change: CatalogChange) -> None:
+        # Neighbour lists are not part of the graph
+        if change.op != NEIGHBOURS_OP:
+            self.version += 1
+
+    async def graph(self) -> Graph:
+        if self._graph is not None and self._graph_version == self.version:
+            return self._graph
+        async with self._lock:
+            if self._graph is None or self._graph_version != self.version:
+                version = self.version
+                started = time.perf_counter()
+                graph = await asyncio.to_thread(lambda: Graph(self.load()))
+                self._graph, self._graph_version = graph, version
+                self._responses.clear()
+                metrics.graph_builds.inc()
+                log.info("🕸️ Catalog graph built", extra={
+                    **graph.stats(), "duration_ms": round((time.perf_counter() - started) * 1000),
+                })
+        return self._graph
+
+    async def response(self, node: Optional[str], depth: int, wines: bool, full: bool) -> tuple[bytes, str]:
+        """Serialized subgraph and its ETag; KeyError for an unknown node."""
+        graph = await self.graph()
+        version = self._graph_version
+        key = (node, depth, wines, full)
+        cached = self._responses.get(key)
+        if cached is not None:
+            self._responses.move_to_end(key)
+            metrics.graph_responses.inc("cached")
+            return cached
+        # Off the event loop: the whole catalog without a root is a large document
+        body = await asyncio.to_thread(self._serialize, graph, node, depth, wines, full)
+        cached = body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        metrics.graph_responses.inc("built")
+        if self._graph_version != version:
+            # Rebuilt meanwhile; this body is from the old graph, so serve it once but do not keep it
+            return cached
+        self._responses[key] = cached
+        while len(self._responses) > self.max_responses:
+            self._responses.popitem(last=False)
+        return cached
+
+    @staticmethod
+    def _serialize(graph: Graph, node: Optional[str], depth: int, wines: bool, full: bool) -> bytes:
+        chosen, truncated = graph.neighbourhood(node, depth, wines)
+        return serialization.dumps(
+            {**graph.payload(chosen, full), "root": node, "depth": depth, "truncated": truncated},
+        )
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "current": self._graph is not None and self._graph_version == self.version,
+            **(self._graph.stats() if self._graph is not None else {}),
+            "responses": len(self._responses),
+        }
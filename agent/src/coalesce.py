@@ -0,0 +1,121 @@
+"""
+Duplicate request suppression for DIONYSUS
+Hume retries and reconnects can send the same turn more than once. Requests
+are fingerprinted, the first one for a fingerprint does the work, and any
+duplicate that arrives while it runs waits for the same result. Results are
+kept for COMPLETION_REUSE_SECONDS afterwards so a late retry costs nothing.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Coroutine, Optional
+
+import logs
+import metrics
+
+COMPLETION_REUSE_SECONDS = float(os.getenv("COMPLETION_REUSE_SECONDS", "30"))
+
+log = logs.get_logger("coalesce")
+
+
+class Abandoned(Exception):
+    """The first request for a fingerprint ended without producing a result."""
+
+
+def fingerprint(messages: list[dict], *scope: Optional[str]) -> str:
+    """Stable hash of a message list (roles and trimmed text) and anything else that scopes it."""
+    normalized = [
+        [m.get("role", "user"), " ".join(str(m.get("content") or "").split())]
+        for m in messages
+    ]
+    return hashlib.sha256(json.dumps([normalized, scope], ensure_ascii=False).encode()).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("future", "started", "finished")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.started = False
+        self.finished: Optional[float] = None
+
+
+class Coalescer:
+    """In-flight and recently finished results by fingerprint.
+
+    `claim` hands out the shared future and says whether the caller owns it.
+    The owner either `run`s the work, which settles the future even if the
+    owner's own client goes away, or `abandon`s it; waiters should await the
+    future through asyncio.shield so their disconnects do not cancel it.
+    """
+
+    def __init__(self, ttl_seconds: float = COMPLETION_REUSE_SECONDS, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._tasks: set[asyncio.Task] = set()
+
+    def claim(self, key: str) -> tuple[asyncio.Future, bool]:
+        entry = self._entries.get(key)
+        if entry is not None and entry.finished is not None and time.monotonic() - entry.finished > self.ttl_seconds:
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            metrics.chat_duplicates.inc("completed" if entry.finished is not None else "in_flight")
+            log.info("🔁 Duplicate request joined", extra={"finished": entry.finished is not None})
+            return entry.future, False
+        entry = _Entry(asyncio.get_running_loop().create_future())
+        self._entries[key] = entry
+        self._evict()
+        return entry.future, True
+
+    def run(self, key: str, future: asyncio.Future, work: Coroutine[Any, Any, Any]) -> asyncio.Future:
+        """Produce the owner's result in a task of its own and share it through `future`."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.future is future:
+            entry.started = True
+        task = asyncio.create_task(work)
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._settle(key, future, t))
+        return future
+
+    def abandon(self, key: str, future: asyncio.Future, error: Optional[BaseException] = None) -> None:
+        """Release a claim the owner will not run; waiters get `error` (Abandoned by default)."""
+        entry = self._entries.get(key)
+        if entry is None or entry.future is not future or entry.started:
+            return
+        del self._entries[key]
+        if not future.done():
+            future.set_exception(error or Abandoned(key))
+            future.exception()  # nobody may be waiting; do not log it as unretrieved
+
+    def _settle(self, key: str, future: asyncio.Future, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        error = None if task.cancelled() else task.exception()
+        if task.cancelled() or error is not None:
+            # Failures are not kept: the next retry starts afresh
+            if self._entries.get(key) is not None and self._entries[key].future is future:
+                del self._entries[key]
+            if not future.done():
+                future.set_exception(error or Abandoned(key))
+                future.exception()
+            return
+        if not future.done():
+            future.set_result(task.result())
+        entry = self._entries.get(key)
+        if entry is not None and entry.future is future:
+            entry.finished = time.monotonic()
+
+    def _evict(self) -> None:
+        # Only finished entries go; in-flight ones always complete
+        if len(self._entries) <= self.max_entries:
+            return
+        for key in [k for k, e in self._entries.items() if e.finished is not None][:len(self._entries) - self.max_entries]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        finished = sum(1 for e in self._entries.values() if e.finished is not None)
+        return {"in_flight": len(self._entries) - finished, "completed": finished}
@@ -0,0 +1,125 @@
+"""
+Voice conversation memory for DIONYSUS
+Hume sends the whole conversation on every turn. The model sees only the
+most recent messages plus a summary of everything before them, so the prompt
+stays the same size however long the call runs. Messages that scroll out of
+the window are folded into the session's summary in the background, a batch
+at a time, and the summary is kept between turns instead of being rebuilt.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import logs
+
+# Raw messages the model always sees
+VOICE_CONTEXT_MESSAGES = int(os.getenv("VOICE_CONTEXT_MESSAGES", "8"))
+# Messages past the window that wait for the next summary; the prompt holds at most window + batch
+VOICE_SUMMARY_BATCH = int(os.getenv("VOICE_SUMMARY_BATCH", "6"))
+VOICE_SUMMARY_MAX_CHARS = int(os.getenv("VOICE_SUMMARY_MAX_CHARS", "1200"))
+
+log = logs.get_logger("conversation")
+
+# (summary so far, messages to fold in) -> new summary
+Summarizer = Callable[[str, list[dict]], Awaitable[str]]
+
+
+def _digest(messages: list[dict]) -> str:
+    h = hashlib.sha256()
+    for m in messages:
+        h.update(f"{m.get('role')}\0{m.get('content')}\0".encode())
+    return h.hexdigest()
+
+
+class _Session:
+    __slots__ = ("summary", "count", "digest", "touched", "task")
+
+    def __init__(self):
+        self.summary = ""
+        # Leading messages the summary covers, and their digest
+        self.count = 0
+        self.digest = _digest([])
+        self.touched = time.monotonic()
+        self.task: Optional[asyncio.Task] = None
+
+
+class ConversationMemory:
+    """Rolling window plus incremental summary per voice session.
+
+    A session's summary is only used while the history still starts with the
+    messages it covers, so a reused or mistaken session key gets a fresh
+    summary rather than someone else's. Sessions expire after `ttl_seconds`
+    and the least recently used are dropped beyond `max_sessions`.
+    """
+
+    def __init__(self, summarize: Summarizer, window: int = VOICE_CONTEXT_MESSAGES, batch: int = VOICE_SUMMARY_BATCH,
+                 max_chars: int = VOICE_SUMMARY_MAX_CHARS, ttl_seconds: float = 1800, max_sessions: int = 1000):
+        self.summarize = summarize
+        self.window = window
+        self.batch = batch
+        self.max_chars = max_chars
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, _Session] = OrderedDict()
+
+    def _session(self, key: str, history: list[dict]) -> _Session:
+        session = self._sessions.get(key)
+        now = time.monotonic()
+        if session is not None and (
+            now - session.touched > self.ttl_seconds
+            or session.count > len(history)
+            or _digest(history[:session.count]) != session.digest
+        ):
+            if session.task is not None:
+                session.task.cancel()
+            session = None
+        if session is None:
+            session = _Session()
+            self._sessions[key] = session
+        session.touched = now
+        self._sessions.move_to_end(key)
+        while len(self._sessions) > self.max_sessions:
+            _, dropped = self._sessions.popitem(last=False)
+            if dropped.task is not None:
+                dropped.task.cancel()
+        return session
+
+    def context(self, key: Optional[str], history: list[dict]) -> tuple[str, list[dict]]:
+        """The summary and recent messages to send with a turn; `history` excludes the new message."""
+        limit = self.window + self.batch
+        if not key:
+            return "", history[-limit:]
+        session = self._session(key, history)
+        unsummarized = history[session.count:]
+        if len(unsummarized) > limit and session.task is None:
+            session.task = asyncio.create_task(self._fold(key, session, history[:len(history) - self.window]))
+        return session.summary, unsummarized[-limit:]
+
+    async def _fold(self, key: str, session: _Session, covered: list[dict]) -> None:
+        started = time.perf_counter()
+        try:
+            summary = await self.summarize(session.summary, covered[session.count:])
+        except Exception as e:
+            log.warning("⚠️ Conversation summary failed, keeping the previous one", extra={"error": str(e)})
+            return
+        finally:
+            session.task = None
+        if self._sessions.get(key) is not session:
+            return
+        session.summary = summary.strip()[:self.max_chars]
+        session.count = len(covered)
+        session.digest = _digest(covered)
+        log.info("🧠 Conversation summary updated", extra={
+            "messages": session.count, "chars": len(session.summary),
+            "duration_ms": round((time.perf_counter() - started) * 1000),
+        })
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "summarizing": sum(1 for s in self._sessions.values() if s.task is not None),
+            "window": self.window,
+        }
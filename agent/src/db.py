@@ -0,0 +1,348 @@
+"""
+Database access for DIONYSUS
+Pooled psycopg2 connections, read-replica routing, and a registry of named
+queries. Each query is declared once, PREPAREd the first time it runs on a
+connection and EXECUTEd by name after that, so repeat tool calls skip
+Postgres' parse and plan work.
+"""
+import itertools
+import os
+import re
+import threading
+import time
+import weakref
+from textwrap import dedent
+from typing import Callable, Optional, Sequence, TypeVar
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+import deadline
+import logs
+import metrics
+
+DB_POOL_MAX_IDLE = int(os.getenv("DB_POOL_MAX_IDLE", "10"))
+# Neon suspends idle computes and drops their connections after ~5 minutes
+DB_POOL_IDLE_SECONDS = float(os.getenv("DB_POOL_IDLE_SECONDS", "240"))
+# Set to false behind a transaction-mode pooler that does not keep session state
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "true").lower() != "false"
+# Replicas further behind than this serve nothing until they catch up
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "30"))
+DB_REPLICA_LAG_CHECK_SECONDS = float(os.getenv("DB_REPLICA_LAG_CHECK_SECONDS", "5"))
+# How long a replica that refused a connection is skipped
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+
+log = logs.get_logger("db")
+
+T = TypeVar("T")
+
+
+# =====
+# Connection pool
+# =====
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection that goes back to its pool on close()."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool: Optional["ConnectionPool"] = None
+        self.idle_since = 0.0
+
+    def close(self):
+        if self.pool is None or not self.pool.put(self):
+            super().close()
+
+    def discard(self):
+        super().close()
+
+
+class ConnectionPool:
+    """Keeps up to `max_idle` autocommit connections open between tool calls.
+
+    There is no cap on connections checked out; a connection that is never
+    closed (a tool that raised) is simply dropped with its cursor.
+    """
+
+    def __init__(self, dsn: str, cursor_factory=None, max_idle: int = DB_POOL_MAX_IDLE,
+                 idle_seconds: float = DB_POOL_IDLE_SECONDS, name: str = "primary"):
+        self.dsn = dsn
+        self.cursor_factory = cursor_factory
+        self.max_idle = max_idle
+        self.idle_seconds = idle_seconds
+        self.name = name
+        self._idle: list[PooledConnection] = []
+        self._lock = threading.Lock()
+
+    def get(self) -> PooledConnection:
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed and now - conn.idle_since < self.idle_seconds:
+                    metrics.db_pool_idle.set(self.name, value=len(self._idle))
+                    return conn
+                conn.discard()
+        conn = psycopg2.connect(self.dsn, connection_factory=PooledConnection, cursor_factory=self.cursor_factory)
+        conn.autocommit = True
+        conn.pool = self
+        metrics.db_pool_connects.inc(self.name)
+        return conn
+
+    def put(self, conn: PooledConnection) -> bool:
+        """Take a connection back; False if it should be closed instead."""
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                return False
+        with self._lock:
+            if len(self._idle) >= self.max_idle:
+                return False
+            conn.idle_since = time.monotonic()
+            self._idle.append(conn)
+            metrics.db_pool_idle.set(self.name, value=len(self._idle))
+        return True
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.discard()
+        metrics.db_pool_idle.set(self.name, value=0)
+
+    def stats(self) -> dict:
+        return {"idle": len(self._idle), "max_idle": self.max_idle}
+
+
+_pools: dict[str, ConnectionPool] = {}
+
+
+def pool(dsn: str, cursor_factory=None, name: str = "primary") -> ConnectionPool:
+    """The shared pool for a database URL, created on first use."""
+    found = _pools.get(dsn)
+    if found is None:
+        found = _pools.setdefault(dsn, ConnectionPool(dsn, cursor_factory, name=name))
+    return found
+
+
+def close_pools() -> None:
+    for p in _pools.values():
+        p.close_all()
+
+
+# =====
+# Read-replica routing
+# =====
+# 0 when the replica has replayed everything it received (an idle primary
+# would otherwise look like growing lag); NULL on a server not in recovery
+REPLICA_LAG = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+
+class Replica:
+    """A replica's pool plus what the router knows about its health and lag."""
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self.down_until = 0.0
+        self.lag: Optional[float] = None
+        self.lag_checked = 0.0
+
+    def usable(self, now: float) -> bool:
+        if now < self.down_until:
+            return False
+        lag_known = now - self.lag_checked < DB_REPLICA_LAG_CHECK_SECONDS
+        return not lag_known or (self.lag or 0) <= DB_REPLICA_MAX_LAG_SECONDS
+
+    def mark_down(self, error: Exception) -> None:
+        self.down_until = time.monotonic() + DB_REPLICA_RETRY_SECONDS
+        metrics.db_replica_healthy.set(self.pool.name, value=0)
+        log.warning("⚠️ Replica unreachable, routing around it", extra={"pool": self.pool.name, "error": str(error)})
+
+    def fresh_enough(self, conn) -> bool:
+        """Re-measure lag on `conn` when the last reading is old."""
+        now = time.monotonic()
+        if now - self.lag_checked >= DB_REPLICA_LAG_CHECK_SECONDS:
+            cur = conn.cursor()
+            cur.execute(REPLICA_LAG)
+            lag = cur.fetchone()[0]
+            cur.close()
+            self.lag = float(lag) if lag is not None else 0.0
+            self.lag_checked = now
+            metrics.db_replica_lag.set(self.pool.name, value=self.lag)
+        healthy = self.lag <= DB_REPLICA_MAX_LAG_SECONDS
+        metrics.db_replica_healthy.set(self.pool.name, value=1 if healthy else 0)
+        return healthy
+
+    def stats(self) -> dict:
+        return {
+            **self.pool.stats(),
+            "up": time.monotonic() >= self.down_until,
+            "lag_seconds": self.lag,
+        }
+
+
+class Router:
+    """Sends read-only work to replicas in turn, skipping unreachable or lagging
+    ones, and everything else (or everything, when no replica will do) to the primary."""
+
+    def __init__(self, primary_url: str, replica_urls: Sequence[str] = (), cursor_factory=None):
+        self.primary = pool(primary_url, cursor_factory, name="primary")
+        self.replicas = [
+            Replica(pool(url, cursor_factory, name=f"replica-{i}")) for i, url in enumerate(replica_urls, 1)
+        ]
+        self._turn = itertools.count()
+
+    def connection(self, read_only: bool = False) -> PooledConnection:
+        if read_only and self.replicas:
+            now = time.monotonic()
+            start = next(self._turn)
+            for i in range(len(self.replicas)):
+                replica = self.replicas[(start + i) % len(self.replicas)]
+                if not replica.usable(now):
+                    continue
+                try:
+                    conn = replica.pool.get()
+                    if replica.fresh_enough(conn):
+                        metrics.db_routed.inc(replica.pool.name)
+                        return conn
+                    conn.close()
+                except psycopg2.Error as e:
+                    replica.mark_down(e)
+        metrics.db_routed.inc("primary")
+        return self.primary.get()
+
+    def read(self, work: Callable[[PooledConnection], T]) -> T:
+        """Run `work` on a read-only connection. If a replica fails under it,
+        the replica is marked down and `work` runs once more on the primary."""
+        conn = self.connection(read_only=True)
+        replica = next((r for r in self.replicas if r.pool is conn.pool), None)
+        try:
+            return work(conn)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            # A cancelled statement (the run's deadline) says nothing about the replica
+            if replica is None or isinstance(e, psycopg2.errors.QueryCanceled):
+                raise
+            replica.mark_down(e)
+        finally:
+            conn.close()
+        metrics.db_routed.inc("primary")
+        conn = self.primary.get()
+        try:
+            return work(conn)
+        finally:
+            conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "primary": self.primary.stats(),
+            "replicas": {r.pool.name: r.stats() for r in self.replicas},
+        }
+
+
+_routers: dict[tuple, Router] = {}
+
+
+def router(primary_url: str, replica_urls: Sequence[str] = (), cursor_factory=None) -> Router:
+    """The shared router for this primary and set of replicas, created on first use."""
+    key = (primary_url, tuple(replica_urls))
+    found = _routers.get(key)
+    if found is None:
+        found = _routers.setdefault(key, Router(primary_url, replica_urls, cursor_factory))
+    return found
+
+
+# =====
+# Query registry
+# =====
+_PLACEHOLDER = re.compile(r"%s")
+
+
+class Query:
+    """A named statement with psycopg2-style %s placeholders."""
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = dedent(sql).strip()
+        self.param_count = len(_PLACEHOLDER.findall(self.sql))
+        counter = iter(range(1, self.param_count + 1))
+        self.prepared_sql = _PLACEHOLDER.sub(lambda _: f"${next(counter)}", self.sql)
+
+
+QUERIES: dict[str, Query] = {}
+
+# Statements each connection has prepared; weak so closed connections drop out
+_prepared: "weakref.WeakKeyDictionary[psycopg2.extensions.connection, set[str]]" = weakref.WeakKeyDictionary()
+
+
+def query(name: str, sql: str) -> Query:
+    """Declare a query once; later declarations of the same name return the first."""
+    found = QUERIES.get(name)
+    if found is None:
+        found = QUERIES.setdefault(name, Query(name, sql))
+    return found
+
+
+def _prepare(cur, q: Query, prepared: set) -> None:
+    try:
+        cur.execute(f"PREPARE {q.name} AS {q.prepared_sql}")
+    except psycopg2.errors.DuplicatePreparedStatement:
+        # Server session already has it (e.g. handed over by a session pooler)
+        pass
+    prepared.add(q.name)
+    metrics.db_prepares.inc(q.name)
+
+
+def _statement_timeout() -> str:
+    """SET LOCAL prefix that ends the statement with the current run, sent in the same round trip."""
+    left = deadline.remaining()
+    if left is None:
+        return ""
+    if left <= 0:
+        metrics.deadline_exceeded.inc("db")
+        raise deadline.Exceeded("run deadline passed before the query")
+    # Autocommit runs a multi-statement string as one implicit transaction, which LOCAL lasts for
+    return f"SET LOCAL statement_timeout = {max(1, int(left * 1000))}; "
+
+
+def execute(cur, q: Query, params: Sequence = ()) -> None:
+    """Run a registered query on `cur`, preparing it on this connection first if needed.
+
+    Inside a run with a deadline, the query is cancelled by Postgres when the run's time is up.
+    """
+    if len(params) != q.param_count:
+        raise ValueError(f"{q.name} takes {q.param_count} parameters, got {len(params)}")
+    prefix = _statement_timeout()
+    try:
+        _execute(cur, q, params, prefix)
+    except psycopg2.errors.QueryCanceled:
+        if prefix:
+            metrics.deadline_exceeded.inc("db")
+        raise
+
+
+def _execute(cur, q: Query, params: Sequence, prefix: str) -> None:
+    if not DB_PREPARED_STATEMENTS:
+        cur.execute(prefix + q.sql, params)
+        return
+
+    prepared = _prepared.setdefault(cur.connection, set())
+    if q.name in prepared:
+        metrics.db_plan_reuse.inc(q.name)
+    else:
+        _prepare(cur, q, prepared)
+
+    statement = prefix + (f"EXECUTE {q.name} ({', '.join(['%s'] * len(params))})" if params else f"EXECUTE {q.name}")
+    try:
+        cur.execute(statement, params)
+    except psycopg2.errors.InvalidSqlStatementName:
+        # The server session lost it (reconnect behind a pooler, DISCARD ALL)
+        log.warning("⚠️ Prepared statement missing, preparing again", extra={"query": q.name})
+        prepared.discard(q.name)
+        _prepare(cur, q, prepared)
+        cur.execute(statement, params)
@@ -0,0 +1,49 @@
+"""
+Per-run deadlines for DIONYSUS
+An AG-UI run or voice turn is given a time budget where it arrives. Work done
+on its behalf (tools, catalog queries, Zep calls, model requests) reads what
+is left from a context variable, so it is bounded without the budget being
+passed through every signature. Tasks and worker threads started from the
+run inherit it.
+"""
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+AGUI_DEADLINE_SECONDS = float(os.getenv("AGUI_DEADLINE_SECONDS", "90"))
+VOICE_DEADLINE_SECONDS = float(os.getenv("VOICE_DEADLINE_SECONDS", "12"))
+# Longest any one tool call may take, whatever the run has left
+TOOL_TIMEOUT_SECONDS = float(os.getenv("TOOL_TIMEOUT_SECONDS", "15"))
+# With less than this left, tools return what they have instead of starting more work
+DEADLINE_RESERVE_SECONDS = float(os.getenv("DEADLINE_RESERVE_SECONDS", "2"))
+
+# Monotonic time the current run must finish by; None outside a run
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+def start(seconds: float) -> None:
+    """Give the current run `seconds` from now (the context of the calling task)."""
+    _deadline.set(time.monotonic() + seconds)
+
+
+def remaining() -> Optional[float]:
+    """Seconds the current run has left, or None when there is no deadline."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def low() -> bool:
+    """Whether the run is close enough to its deadline that optional work should be skipped."""
+    left = remaining()
+    return left is not None and left < DEADLINE_RESERVE_SECONDS
+
+
+def limit(seconds: float) -> float:
+    """`seconds`, or less if the run ends sooner (never negative)."""
+    left = remaining()
+    return seconds if left is None else max(0.0, min(seconds, left))
+
+
+class Exceeded(TimeoutError):
+    """The run's deadline cut this work short."""
@@ -0,0 +1,291 @@
+"""
+Bulk catalog ingest for DIONYSUS
+Streams the source catalog with keyset reads, computes the investment fields
+in the same pass, COPYs each batch into a staging table and merges it into
+`wines` with one set-based upsert. Replaces scripts/migrate-wines.mjs and
+scripts/add-investment-data.mjs for full reloads.
+
+    uv run python src/ingest.py --source $SOMMELIER_DATABASE_URL
+    uv run python src/ingest.py --source $SOMMELIER_DATABASE_URL --deactivate-missing
+
+The target defaults to DATABASE_URL. Unchanged rows are left untouched; the
+triggers on `wines` tell running agents which cached results to drop.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import struct
+import sys
+import time
+from typing import Callable, Iterator, Optional
+
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from migrations import migrate
+
+SOURCE_COLUMNS = (
+    "id", "name", "winery", "region", "country", "grape_variety", "vintage", "wine_type", "style",
+    "color", "price_retail", "price_trade", "bottle_size", "tasting_notes", "critic_scores",
+    "drinking_window", "classification", "image_url", "stock_quantity", "case_size", "is_active", "slug",
+)
+INVESTMENT_COLUMNS = (
+    "price_history", "investment_score", "is_investment_grade", "storage_type", "five_year_return", "liv_ex_score",
+)
+COLUMNS = SOURCE_COLUMNS + INVESTMENT_COLUMNS
+
+INVESTMENT_REGIONS = ["bordeaux", "burgundy", "champagne", "tuscany", "piedmont", "rhone", "napa"]
+INVESTMENT_CLASSIFICATIONS = ["first growth", "grand cru", "premier cru", "super tuscan", "cult wine"]
+
+
+# =====
+# Investment fields (same rules as scripts/add-investment-data.mjs)
+# =====
+def is_investment_wine(wine: dict) -> bool:
+    region = (wine.get("region") or "").lower()
+    classification = (wine.get("classification") or "").lower()
+    price = float(wine.get("price_retail") or 0)
+
+    is_investment_region = any(r in region for r in INVESTMENT_REGIONS)
+    has_investment_classification = any(c in classification for c in INVESTMENT_CLASSIFICATIONS)
+    return (is_investment_region and price >= 100) or has_investment_classification or price >= 500
+
+
+def wine_draws(wine_id: int) -> Callable[[], float]:
+    """Uniform [0, 1) draws seeded by wine id, so re-ingesting is stable.
+
+    One blake2b digest per wine; seeding a random.Random per row cost more
+    than everything else in the pass.
+    """
+    digest = hashlib.blake2b(wine_id.to_bytes(8, "little", signed=True), digest_size=64).digest()
+    return iter([v / 65536 for v in struct.unpack("<32H", digest)]).__next__
+
+
+def price_history(wine: dict, rand: Callable[[], float], is_investment: bool) -> list[dict]:
+    base_price = float(wine.get("price_retail") or 0) or 50 + int(rand() * 200)
+    annual_growth = 0.08 + rand() * 0.12 if is_investment else 0.02 + rand() * 0.05
+    volatility = 0.05 if is_investment else 0.08
+
+    history, price = [], base_price
+    for year in range(2018, 2025):
+        price *= 1 + annual_growth + (rand() - 0.5) * volatility
+        history.append({
+            "year": str(year),
+            "price": round(price),
+            "trend": round(base_price * (1 + annual_growth) ** (year - 2018)),
+            "volume": 100 + int(rand() * 1000),
+        })
+    return history
+
+
+def investment_score(wine: dict, history: list[dict]) -> float:
+    score = 5.0
+    first, last = history[0]["price"], history[-1]["price"]
+    appreciation = (last - first) / first if first else 0
+    if appreciation > 0.5:
+        score += 2
+    elif appreciation > 0.3:
+        score += 1.5
+    elif appreciation > 0.15:
+        score += 1
+    elif appreciation < 0:
+        score -= 1
+
+    region = (wine.get("region") or "").lower()
+    if "bordeaux" in region or "burgundy" in region:
+        score += 1.5
+    elif "champagne" in region or "tuscany" in region:
+        score += 1
+    elif any(r in region for r in INVESTMENT_REGIONS):
+        score += 0.5
+
+    classification = (wine.get("classification") or "").lower()
+    if "first growth" in classification or "grand cru" in classification:
+        score += 1.5
+    elif "premier cru" in classification or "super tuscan" in classification:
+        score += 1
+
+    age = 2024 - (wine.get("vintage") or 2020)
+    if age >= 10:
+        score += 1
+    elif age >= 5:
+        score += 0.5
+
+    return min(10.0, max(1.0, round(score * 10) / 10))
+
+
+def five_year_return(history: list[dict]) -> Optional[float]:
+    if len(history) < 5:
+        return None
+    five_years_ago = history[-5]["price"] or history[0]["price"]
+    if not five_years_ago:
+        return None
+    return round((history[-1]["price"] - five_years_ago) / five_years_ago * 100, 1)
+
+
+def storage_type(wine: dict, rand: Callable[[], float], is_investment: bool) -> str:
+    price = float(wine.get("price_retail") or 0)
+    if price >= 500 or is_investment:
+        return "bonded" if rand() > 0.3 else "private_cellar"
+    if price >= 100:
+        return "bonded" if rand() > 0.5 else "private_cellar"
+    return "private_cellar" if rand() > 0.7 else "retail"
+
+
+def with_investment_fields(wine: dict) -> dict:
+    """Add the investment columns to a wine dict."""
+    rand = wine_draws(wine["id"])
+    is_investment = is_investment_wine(wine)
+    history = price_history(wine, rand, is_investment)
+    wine["price_history"] = history
+    wine["investment_score"] = investment_score(wine, history)
+    wine["is_investment_grade"] = is_investment
+    wine["storage_type"] = storage_type(wine, rand, is_investment)
+    wine["five_year_return"] = five_year_return(history)
+    wine["liv_ex_score"] = 70 + int(rand() * 30) if is_investment else None
+    return wine
+
+
+# =====
+# Source reads, COPY and merge
+# =====
+_FIELD = {column: i for i, column in enumerate(SOURCE_COLUMNS)}
+_NULL = "\\N"
+
+
+def read_source(conn, batch_size: int) -> Iterator[list[list[str]]]:
+    """Yield batches of source rows in id order as COPY text fields, using keyset pagination."""
+    last_id = 0
+    cur = conn.cursor()
+    while True:
+        buffer = io.StringIO()
+        query = cur.mogrify(
+            f"SELECT {', '.join(SOURCE_COLUMNS)} FROM wines WHERE id > %s ORDER BY id LIMIT %s",
+            [last_id, batch_size],
+        ).decode()
+        cur.copy_expert(f"COPY ({query}) TO STDOUT", buffer)
+        # COPY escapes only \n, \r and \t; splitlines() would also break rows on \x1c-\x1e, \x85, \u2028...
+        lines = buffer.getvalue().split("\n")[:-1]
+        if not lines:
+            break
+        rows = [line.split("\t") for line in lines]
+        yield rows
+        last_id = int(rows[-1][_FIELD["id"]])
+    cur.close()
+
+
+def _text(value) -> str:
+    if value is None:
+        return _NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return str(value)
+
+
+def staged_line(fields: list[str]) -> str:
+    """A source row with its investment columns appended, ready for COPY.
+
+    Source fields stay in COPY text form; only the ones the investment rules
+    read are decoded.
+    """
+    price, vintage = fields[_FIELD["price_retail"]], fields[_FIELD["vintage"]]
+    wine = with_investment_fields({
+        "id": int(fields[_FIELD["id"]]),
+        "region": fields[_FIELD["region"]] if fields[_FIELD["region"]] != _NULL else None,
+        "classification": fields[_FIELD["classification"]] if fields[_FIELD["classification"]] != _NULL else None,
+        "price_retail": float(price) if price != _NULL else None,
+        "vintage": int(vintage) if vintage != _NULL else None,
+    })
+    # json.dumps never emits raw tabs or newlines; only backslashes need escaping
+    history = json.dumps(wine["price_history"], separators=(",", ":")).replace("\\", "\\\\")
+    computed = [history] + [_text(wine[c]) for c in INVESTMENT_COLUMNS[1:]]
+    return "\t".join(fields + computed)
+
+
+def copy_batch(cur, rows: list[list[str]]) -> None:
+    buffer = io.StringIO("\n".join(staged_line(fields) for fields in rows) + "\n")
+    cur.copy_expert(f"COPY wines_staging ({', '.join(COLUMNS)}) FROM STDIN", buffer)
+
+
+MERGE = f"""
+    WITH merged AS (
+        INSERT INTO wines ({', '.join(COLUMNS)})
+        SELECT {', '.join(COLUMNS)} FROM wines_staging
+        ON CONFLICT (id) DO UPDATE SET
+            {', '.join(f'{c} = EXCLUDED.{c}' for c in COLUMNS if c != 'id')},
+            updated_at = NOW()
+        WHERE ({', '.join(f'wines.{c}' for c in COLUMNS if c != 'id')})
+              IS DISTINCT FROM ({', '.join(f'EXCLUDED.{c}' for c in COLUMNS if c != 'id')})
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM merged
+"""
+
+DEACTIVATE_MISSING = """
+    UPDATE wines SET is_active = false, updated_at = NOW()
+    WHERE is_active AND NOT EXISTS (SELECT 1 FROM wines_staging s WHERE s.id = wines.id)
+"""
+
+
+def ingest(source_url: str, target_url: str, batch_size: int = 5000, deactivate_missing: bool = False) -> dict:
+    """Load the full source catalog into the target in one transaction."""
+    start = time.perf_counter()
+    migrate(target_url)
+    source = psycopg2.connect(source_url)
+    source.set_session(readonly=True)
+    target = psycopg2.connect(target_url)
+    try:
+        cur = target.cursor()
+        cur.execute("""
+            CREATE TEMP TABLE wines_staging (LIKE wines INCLUDING DEFAULTS) ON COMMIT DROP
+        """)
+
+        read = 0
+        for rows in read_source(source, batch_size):
+            copy_batch(cur, rows)
+            read += len(rows)
+
+        cur.execute("ANALYZE wines_staging")
+        cur.execute(MERGE)
+        inserted, updated = cur.fetchone()
+
+        deactivated = 0
+        if deactivate_missing and read:
+            cur.execute(DEACTIVATE_MISSING)
+            deactivated = cur.rowcount
+
+        cur.execute("SELECT setval(pg_get_serial_sequence('wines', 'id'), GREATEST((SELECT MAX(id) FROM wines), 1))")
+        summary = {"read": read, "inserted": inserted, "updated": updated, "deactivated": deactivated}
+        target.commit()
+        cur.close()
+    except Exception:
+        target.rollback()
+        raise
+    finally:
+        source.close()
+        target.close()
+
+    summary["seconds"] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-load the wine catalog into the agent database")
+    parser.add_argument("--source", required=True, help="source catalog database URL")
+    parser.add_argument("--target", default=os.getenv("DATABASE_URL"), help="defaults to DATABASE_URL")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--deactivate-missing", action="store_true",
+                        help="mark wines that are no longer in the source as inactive")
+    args = parser.parse_args()
+    if not args.target:
+        parser.error("no --target and DATABASE_URL is not set")
+
+    result = ingest(args.source, args.target, args.batch_size, args.deactivate_missing)
+    print(f"🍷 Ingested {result['read']} wines in {result['seconds']}s: "
+          f"{result['inserted']} new, {result['updated']} updated, {result['deactivated']} deactivated",
+          file=sys.stderr)
@@ -0,0 +1,136 @@
+"""
+Voice intents for DIONYSUS
+Rule-based classification of a (phonetically corrected) voice utterance into
+the few catalog questions that can be answered from indexed data without a
+model call. Anything that does not match a rule cleanly is left to the LLM.
+"""
+import re
+from typing import NamedTuple, Optional
+
+
+class Intent(NamedTuple):
+    name: str
+    # Wine, region or grape the question is about; "" for the whole catalog
+    term: str = ""
+    # Catalog wine_type the question is limited to (lower case), e.g. "red"; "" for any
+    wine_type: str = ""
+
+
+# Longer subjects are rarely a single wine, region or grape
+MAX_TERM_WORDS = 4
+
+PAIRING_TYPES = {
+    "red": "red", "reds": "red",
+    "white": "white", "whites": "white",
+    "rose": "rosé", "rosé": "rosé",
+    "sparkling": "sparkling", "champagne": "sparkling", "prosecco": "sparkling", "cava": "sparkling",
+    "dessert": "dessert", "sweet": "dessert", "sauternes": "dessert", "port": "dessert",
+}
+# Words that name a catalog wine_type outright; "champagne" or "port" may be a region or a wine
+WINE_TYPES = {
+    "red": "red", "reds": "red",
+    "white": "white", "whites": "white",
+    "rose": "rosé", "rosé": "rosé", "roses": "rosé", "rosés": "rosé",
+    "sparkling": "sparkling",
+    "dessert": "dessert",
+}
+
+_LEADING = {"a", "an", "the", "your", "bottle", "bottles", "of", "in", "from", "wine", "wines"}
+_TRAILING = [
+    phrase.split() for phrase in (
+        "wine", "wines", "bottle", "bottles", "please", "you have", "do you have", "you've got", "have you got",
+        "you have got", "you stock", "do you stock", "you carry", "do you carry", "available", "in stock",
+        "on your list", "on the list", "right now", "today", "cost", "costs", "sell for", "go for",
+    )
+]
+# Subjects with a second clause ("pinot noir from oregon under 30") go to the LLM
+_CONNECTIVES = {"from", "in", "under", "over", "below", "above", "with", "for", "and", "or", "between", "that"}
+# Answering these needs the conversation, not a rule
+_PRONOUNS = {"it", "that", "this", "them", "those", "these", "one", "that one", "this one"}
+_REFERRING = {"it", "this", "them", "those", "these", "they"}
+# About the cellar rather than a wine, region or grape in it ("how many regions do you have")
+_STOP_TERMS = {
+    "cellar", "list", "catalog", "catalogue", "selection", "collection", "stock", "range", "thing", "things",
+    "region", "regions", "country", "countries", "grape", "grapes", "type", "types", "kind", "kinds",
+    "bottle", "bottles", "wine", "wines",
+}
+
+_RULES = [
+    ("cheapest", re.compile(
+        r"\b(?:cheapest|least expensive|most affordable|lowest[ -]priced|best value)\b(?P<term>.*)$"
+    )),
+    ("most_expensive", re.compile(
+        r"\b(?:most expensive|priciest|dearest|highest[ -]priced)\b(?P<term>.*)$"
+    )),
+    ("count", re.compile(
+        r"^how many\b(?P<term>.*?)(?:\s+(?:do you have|are there|have you got|do you stock|do you carry|"
+        r"are in (?:the|your) (?:cellar|catalog(?:ue)?)))$"
+    )),
+    ("price", re.compile(
+        r"^(?:how much (?:is|are|does|do|for)|what(?:'s| is) the price (?:of|for)|price (?:of|for))\b(?P<term>.*)$"
+    )),
+    ("pairing", re.compile(
+        r"^(?:what|which)(?: kind of)? (?:food|foods|dish|dishes|meal|meals) (?:goes|go|pairs|pair|works|work)"
+        r"(?: well| best)? with\b(?P<term>.*)$"
+        r"|^what (?:should|can|do) i (?:eat|serve|cook|have) with\b(?P<term2>.*)$"
+    )),
+]
+
+
+def normalize(text: str) -> str:
+    text = text.lower().replace("’", "'")
+    text = re.sub(r"[^\w' -]+", " ", text)
+    return " ".join(text.split())
+
+
+def _term(raw: str) -> Optional[str]:
+    words = raw.split()
+    trimmed = True
+    while trimmed:
+        trimmed = False
+        for phrase in _TRAILING:
+            if len(words) >= len(phrase) and words[-len(phrase):] == phrase:
+                del words[-len(phrase):]
+                trimmed = True
+    while words and words[0] in _LEADING:
+        words.pop(0)
+    term = " ".join(words).strip(" '-")
+    if term in _PRONOUNS or len(words) > MAX_TERM_WORDS or _CONNECTIVES.intersection(words):
+        return None
+    if _REFERRING.intersection(words) or (words and _STOP_TERMS.issuperset(words)):
+        return None
+    return term
+
+
+def _split_type(term: str) -> Optional[tuple[str, str]]:
+    """(term, wine_type) with a wine type word taken out of `term`; None for more than one type."""
+    words = term.split()
+    types = {WINE_TYPES[w] for w in words if w in WINE_TYPES}
+    if len(types) > 1:
+        return None
+    rest = " ".join(w for w in words if w not in WINE_TYPES)
+    return rest, types.pop() if types else ""
+
+
+def classify(utterance: str) -> Optional[Intent]:
+    """The intent of a simple catalog question, or None to let the LLM answer."""
+    text = normalize(utterance)
+    for name, pattern in _RULES:
+        match = pattern.search(text)
+        if not match:
+            continue
+        raw = match.group("term") or match.groupdict().get("term2") or ""
+        # "How many do you have?" or "Which is the cheapest?" is about something said earlier
+        if not raw.strip():
+            return None
+        term = _term(raw)
+        if term is None:
+            return None
+        if name == "pairing":
+            wine_type = next((PAIRING_TYPES[w] for w in term.split() if w in PAIRING_TYPES), None)
+            return Intent(name, wine_type=wine_type) if wine_type else None
+        if name == "price":
+            return Intent(name, term) if term else None
+        split = _split_type(term)
+        return Intent(name, *split) if split else None
+    return None
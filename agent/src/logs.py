@@ -0,0 +1,159 @@
+"""
+Logging for DIONYSUS
+Structured, non-blocking logs with sampling, per-request debug and PII redaction.
+
+Call sites only enqueue a record; formatting, redaction and the write to
+stderr happen on a background QueueListener thread.
+
+    LOG_LEVEL=INFO                 minimum level for normal requests
+    LOG_FORMAT=json|text           one JSON object per line, or key=value text
+    LOG_DEBUG_SAMPLE_RATE=1.0      fraction of debug requests that get DEBUG output (all of it or none)
+    LOG_DEBUG_HEADER=X-Debug-Log   request header ("1") that enables DEBUG for that request
+    LOG_REDACT_PII=true            mask names and emails
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+from contextvars import ContextVar, Token
+
+LOG_LEVEL = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+LOG_DEBUG_HEADER = os.getenv("LOG_DEBUG_HEADER", "X-Debug-Log")
+LOG_REDACT_PII = os.getenv("LOG_REDACT_PII", "true").lower() != "false"
+
+# Set for the duration of a request that asked for debug output and was sampled in
+request_debug: ContextVar[bool] = ContextVar("request_debug", default=False)
+
+# Record attributes that are part of LogRecord itself, not our structured fields
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+_PII_FIELDS = {"user", "user_name", "email"}
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# Names introduced the way Hume prompts and users introduce them ("Name: Dan", "my name is Dan")
+_NAME_PHRASE = re.compile(r"((?i:user name:|name:|name is|call me|i'm|i am|this is)\s+)([A-Za-z][\w'-]*(?: [A-Z][\w'-]*)?)")
+
+
+def start_request(debug: bool) -> Token:
+    """Decide once whether this request logs DEBUG; reset request_debug with the token when it ends."""
+    sampled = debug and (LOG_DEBUG_SAMPLE_RATE >= 1.0 or random.random() < LOG_DEBUG_SAMPLE_RATE)
+    return request_debug.set(sampled)
+
+
+def debug_enabled() -> bool:
+    """Cheap guard for debug lines that are expensive to build."""
+    return LOG_LEVEL <= logging.DEBUG or request_debug.get()
+
+
+def mask(value) -> str:
+    """Keep the first character of a name or email's local part."""
+    text = str(value)
+    if not text:
+        return text
+    if "@" in text:
+        local, _, domain = text.partition("@")
+        return f"{local[:1]}***@{domain}"
+    return f"{text[:1]}***"
+
+
+def redact(text: str) -> str:
+    text = _EMAIL.sub(lambda m: mask(m.group(0)), text)
+    return _NAME_PHRASE.sub(lambda m: m.group(1) + mask(m.group(2)), text)
+
+
+class _LevelFilter(logging.Filter):
+    """Drop records below LOG_LEVEL unless this request enabled (and sampled in) debug."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno >= LOG_LEVEL or request_debug.get()
+
+
+class StructuredFormatter(logging.Formatter):
+    """Render a record and its `extra` fields as JSON or key=value text, redacting PII."""
+
+    def __init__(self, fmt: str = "json", redact_pii: bool = True):
+        super().__init__()
+        self.fmt = fmt
+        self.redact_pii = redact_pii
+
+    def _fields(self, record: logging.LogRecord) -> dict:
+        fields = {}
+        for key, value in record.__dict__.items():
+            if key in _RESERVED or key.startswith("_"):
+                continue
+            if self.redact_pii and value is not None:
+                if key in _PII_FIELDS:
+                    value = mask(value)
+                elif isinstance(value, str):
+                    value = redact(value)
+            fields[key] = value
+        return fields
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if self.redact_pii:
+            message = redact(message)
+        fields = self._fields(record)
+        if record.exc_info:
+            fields["exc"] = self.formatException(record.exc_info)
+
+        if self.fmt == "text":
+            extras = " ".join(f"{k}={v}" for k, v in fields.items())
+            return f"{record.levelname:<7} {record.name}: {message}" + (f" {extras}" if extras else "")
+
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": message,
+        }
+        entry.update(fields)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Enqueue the record untouched; the listener thread does all the formatting."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+_listener = None
+
+
+def setup() -> logging.Logger:
+    """Attach the queue handler to the `dionysus` logger (idempotent)."""
+    global _listener
+    logger = logging.getLogger("dionysus")
+    if _listener is not None:
+        return logger
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(StructuredFormatter(LOG_FORMAT, LOG_REDACT_PII))
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=False)
+    _listener.start()
+
+    handler = _QueueHandler(records)
+    handler.addFilter(_LevelFilter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    return logger
+
+
+def shutdown() -> None:
+    """Drain queued records and stop the listener thread; call on app shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logger(name: str = "") -> logging.Logger:
+    setup()
+    return logging.getLogger(f"dionysus.{name}" if name else "dionysus")
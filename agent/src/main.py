@@ -2,14 +2,12 @@ import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from agent import AppState, agent
-from pydantic_ai.ag_ui import StateDeps
+from agent import ag_ui_app, session_states
 
-# Create deps with logging
-deps = StateDeps(AppState())
-print(f"🚀 Agent starting with initial state: {deps.state}")
+# Each run gets its own copy of the default state
+print(f"🚀 Agent starting with initial state: {session_states.new_state()}")
 
-app = agent.to_ag_ui(deps=deps)
+app = ag_ui_app
 
 if __name__ == "__main__":
     # run the app
@@ -0,0 +1,333 @@
+"""
+Metrics for DIONYSUS
+In-process counters, gauges and histograms rendered in the Prometheus text format.
+"""
+import asyncio
+import functools
+import re
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+import httpx
+import psycopg2.extensions
+
+import deadline
+
+# Seconds; covers a sub-millisecond cache hit up to a stuck 70B completion
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Tool currently running in this task, so DB metrics can be attributed to it
+current_tool: ContextVar[str] = ContextVar("current_tool", default="none")
+
+# (stage, label, seconds) timings for the run being recorded; None when not recording
+stage_log: ContextVar[Optional[list]] = ContextVar("stage_log", default=None)
+
+
+def note_stage(stage: str, label: str, seconds: float) -> None:
+    timings = stage_log.get()
+    if timings is not None:
+        timings.append((stage, label, round(seconds, 6)))
+
+
+def _label_str(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        return self.header() + [
+            f"{self.name}{_label_str(self.labels, k)} {v}" for k, v in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float) -> None:
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels) -> int:
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def quantile(self, q: float, *labels) -> Optional[float]:
+        """Upper bucket bound containing the q-th observation (None if empty)."""
+        series = self._values.get(labels)
+        if not series:
+            return None
+        total = sum(series[:-1])
+        if not total:
+            return None
+        target, running = q * total, 0
+        for bound, n in zip(self.buckets, series):
+            running += n
+            if running >= target:
+                return bound
+        return self.buckets[-1]
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for labels, series in self._values.items():
+            running = 0
+            for bound, n in zip(self.buckets, series):
+                running += n
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_label_str(self.labels, labels, le)} {running}")
+            running += series[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_str(self.labels, labels, le)} {running}")
+            lines.append(f"{self.name}_sum{_label_str(self.labels, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_label_str(self.labels, labels)} {running}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+tool_latency = REGISTRY.histogram("dionysus_tool_duration_seconds", "Agent tool call latency", ("tool",))
+tool_errors = REGISTRY.counter("dionysus_tool_errors_total", "Agent tool calls that raised or returned an error", ("tool",))
+tool_in_flight = REGISTRY.gauge("dionysus_tool_in_flight", "Agent tool calls currently running", ("tool",))
+
+db_latency = REGISTRY.histogram("dionysus_db_query_duration_seconds", "SQL statement latency", ("tool",))
+db_errors = REGISTRY.counter("dionysus_db_errors_total", "SQL statements that raised", ("tool",))
+db_prepares = REGISTRY.counter("dionysus_db_prepares_total", "Named queries PREPAREd on a connection", ("query",))
+db_plan_reuse = REGISTRY.counter("dionysus_db_plan_reuse_total", "Named query executions that reused a prepared statement", ("query",))
+db_pool_connects = REGISTRY.counter("dionysus_db_pool_connects_total", "New database connections opened by a pool", ("pool",))
+db_pool_idle = REGISTRY.gauge("dionysus_db_pool_idle", "Idle pooled database connections", ("pool",))
+db_routed = REGISTRY.counter("dionysus_db_routed_total", "Connections handed out, by the pool that served them", ("pool",))
+db_replica_lag = REGISTRY.gauge("dionysus_db_replica_lag_seconds", "Last measured replication lag", ("pool",))
+db_replica_healthy = REGISTRY.gauge("dionysus_db_replica_healthy", "1 if the replica is reachable and within the lag limit", ("pool",))
+
+catalog_cache_requests = REGISTRY.counter("dionysus_catalog_cache_requests_total", "Catalog cache lookups", ("result",))
+catalog_cache_invalidated = REGISTRY.counter("dionysus_catalog_cache_invalidated_total", "Catalog cache entries dropped by a change")
+catalog_prefetch = REGISTRY.counter("dionysus_catalog_prefetch_total", "Speculative catalog lookups: warmed, cached (already there), used by a tool, or unused when dropped", ("result",))
+catalog_changes = REGISTRY.counter("dionysus_catalog_changes_total", "Catalog changes received", ("source",))
+
+http_latency = REGISTRY.histogram("dionysus_http_client_duration_seconds", "Outbound HTTP latency to headers", ("service", "route"))
+http_errors = REGISTRY.counter("dionysus_http_client_errors_total", "Outbound HTTP failures and 5xx responses", ("service", "route"))
+http_in_flight = REGISTRY.gauge("dionysus_http_client_in_flight", "Outbound HTTP requests in flight", ("service",))
+resilience_rejected = REGISTRY.counter("dionysus_resilience_rejected_total", "Outbound calls skipped by a circuit breaker or bulkhead", ("service", "reason"))
+resilience_timeouts = REGISTRY.counter("dionysus_resilience_timeouts_total", "Outbound calls cut off by their adaptive timeout", ("service",))
+resilience_circuit_open = REGISTRY.gauge("dionysus_resilience_circuit_open", "1 while the service's circuit breaker is open", ("service",))
+resilience_probes = REGISTRY.counter("dionysus_resilience_probes_total", "Background health probes of a service with an open circuit", ("service", "result"))
+
+model_latency = REGISTRY.histogram("dionysus_model_request_duration_seconds", "LLM request latency by model", ("model",))
+model_errors = REGISTRY.counter("dionysus_model_errors_total", "LLM requests that timed out, were rate-limited or hit a server error", ("model",))
+model_failovers = REGISTRY.counter("dionysus_model_failovers_total", "LLM requests retried on another model, by the model that failed", ("model",))
+model_hedges = REGISTRY.counter("dionysus_model_hedges_total", "Hedged LLM requests: sent, first_won, backup_won, over_budget, no_capacity", ("model", "result"))
+model_hedged_latency = REGISTRY.histogram("dionysus_model_hedged_duration_seconds", "Latency of requests that sent a hedge, by which request answered", ("winner",))
+
+admission_active = REGISTRY.gauge("dionysus_admission_active", "Model calls holding an admission slot")
+admission_queued = REGISTRY.gauge("dionysus_admission_queued", "Model calls waiting for an admission slot", ("priority",))
+admission_wait = REGISTRY.histogram("dionysus_admission_wait_seconds", "Time model calls waited for admission", ("priority",))
+admission_rejected = REGISTRY.counter("dionysus_admission_rejected_total", "Model calls turned away by admission control", ("priority", "reason"))
+
+chat_latency = REGISTRY.histogram("dionysus_chat_completion_duration_seconds", "/chat/completions latency to last byte", ("stream",))
+chat_ttft = REGISTRY.histogram("dionysus_chat_completion_ttft_seconds", "/chat/completions time to first streamed token")
+chat_errors = REGISTRY.counter("dionysus_chat_completion_errors_total", "/chat/completions turns that failed")
+chat_in_flight = REGISTRY.gauge("dionysus_chat_completion_in_flight", "/chat/completions turns in progress")
+chat_duplicates = REGISTRY.counter("dionysus_chat_completion_duplicates_total", "Duplicate /chat/completions turns served from another request, by whether it was in_flight or completed", ("result",))
+voice_intents = REGISTRY.counter("dionysus_voice_intents_total", "Voice turns by fast-path intent, or llm when the model answered", ("intent",))
+answer_cache_requests = REGISTRY.counter("dionysus_answer_cache_requests_total", "Voice answer cache lookups: hit, similar or miss", ("result",))
+answer_cache_invalidated = REGISTRY.counter("dionysus_answer_cache_invalidated_total", "Cached voice answers dropped by a catalog change")
+response_bytes = REGISTRY.counter("dionysus_response_bytes_total", "Bytes of compressed responses before (identity) and after encoding, by encoding", ("encoding",))
+graph_builds = REGISTRY.counter("dionysus_graph_builds_total", "Catalog knowledge graph rebuilds")
+graph_responses = REGISTRY.counter("dionysus_graph_responses_total", "Catalog graph responses: built, cached or not_modified", ("result",))
+ranking_profiles = REGISTRY.counter("dionysus_ranking_profiles_total", "Preference profile lookups for personalized search: hit or miss", ("result",))
+ranking_reranked = REGISTRY.counter("dionysus_ranking_reranked_total", "Searches re-ordered by the user's preferences")
+deadline_exceeded = REGISTRY.counter("dionysus_deadline_exceeded_total", "Work cut short or skipped because its run's deadline was near, by stage", ("stage",))
+
+
+def track_tool(func):
+    """Record latency, errors and concurrency for an agent tool, and bound its time.
+
+    Place it under `@agent.tool`; `functools.wraps` keeps the signature and
+    docstring that Pydantic AI builds the tool schema from. A tool gets at most
+    TOOL_TIMEOUT_SECONDS or what its run has left, and is not started when the
+    run is about to run out; either way the model gets an error result back.
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if deadline.low():
+            deadline_exceeded.inc("tool")
+            return {"error": "Out of time for this turn", "timed_out": True}
+        token = current_tool.set(name)
+        tool_in_flight.inc(name)
+        start = time.perf_counter()
+        try:
+            async with asyncio.timeout(deadline.limit(deadline.TOOL_TIMEOUT_SECONDS)):
+                result = await func(*args, **kwargs)
+        except TimeoutError:
+            deadline_exceeded.inc("tool")
+            result = {"error": f"{name} took too long", "timed_out": True}
+        except Exception:
+            tool_errors.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            tool_latency.observe(elapsed, name)
+            note_stage("tool", name, elapsed)
+            tool_in_flight.dec(name)
+            current_tool.reset(token)
+        if isinstance(result, dict) and result.get("error"):
+            tool_errors.inc(name)
+        return result
+
+    return wrapper
+
+
+class MeteredCursor(psycopg2.extensions.cursor):
+    """psycopg2 cursor that times every statement against the running tool."""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            db_errors.inc(current_tool.get())
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            db_latency.observe(elapsed, current_tool.get())
+            note_stage("db", current_tool.get(), elapsed)
+
+
+def _template(route: str) -> re.Pattern:
+    """Regex for a route template such as "/api/v2/threads/{thread_id}/messages"."""
+    parts = re.split(r"(\{[^/{}]+\})", route)
+    return re.compile("".join("[^/]+" if part.startswith("{") else re.escape(part) for part in parts))
+
+
+class MeteredTransport(httpx.AsyncBaseTransport):
+    """httpx transport that records latency per service and route template.
+
+    `routes` are the templates this client calls, with `{name}` for path
+    parameters; any other path is labelled "other" so ids never become labels.
+    """
+
+    def __init__(self, service: str, transport: Optional[httpx.AsyncBaseTransport] = None, routes: tuple = ()):
+        self.service = service
+        self._transport = transport or httpx.AsyncHTTPTransport()
+        self._routes = [(route, _template(route)) for route in routes]
+
+    def _route(self, path: str) -> str:
+        for route, pattern in self._routes:
+            if pattern.fullmatch(path):
+                return route
+        return "other"
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        route = self._route(request.url.path)
+        http_in_flight.inc(self.service)
+        start = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception:
+            http_errors.inc(self.service, route)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            http_latency.observe(elapsed, self.service, route)
+            note_stage(self.service, route, elapsed)
+            http_in_flight.dec(self.service)
+        if response.status_code >= 500 or response.status_code == 429:
+            http_errors.inc(self.service, route)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+async def track_chat_stream(chunks, started: float):
+    """Pass a streamed /chat/completions body through, timing first and last chunk."""
+    first = True
+    try:
+        async for chunk in chunks:
+            if first:
+                chat_ttft.observe(time.perf_counter() - started)
+                first = False
+            yield chunk
+    finally:
+        chat_latency.observe(time.perf_counter() - started, "true")
+        chat_in_flight.dec()
+
+
+def render() -> str:
+    return REGISTRY.render()
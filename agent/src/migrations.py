@@ -0,0 +1,295 @@
+"""
+Versioned schema migrations for the DIONYSUS catalog
+Each migration runs once, in its own transaction, and is recorded in
+`schema_migrations`. Indexes on existing tables are the exception: they are
+built with CREATE INDEX CONCURRENTLY outside the transaction, so the catalog
+stays writable while they build. A Postgres advisory lock keeps concurrent
+workers from applying the same version twice.
+
+    uv run python src/migrations.py            # apply pending migrations
+    uv run python src/migrations.py --status   # list applied / pending
+
+The agent also applies pending migrations on startup unless DB_AUTO_MIGRATE=false.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Callable, Optional, Union
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logs
+
+log = logs.get_logger("migrations")
+
+# Arbitrary constant shared by every process that migrates this database
+ADVISORY_LOCK_ID = 0x77696E65
+
+
+
+class Concurrently:
+    """Step that builds an index with CREATE INDEX CONCURRENTLY, outside the migration's transaction."""
+
+    def __init__(self, name: str, definition: str):
+        self.name = name
+        self.sql = f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"
+
+    def run(self, conn, cur) -> None:
+        conn.autocommit = True
+        try:
+            # A build that failed part way leaves an invalid index, which IF NOT EXISTS would keep
+            cur.execute("""
+                SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s AND NOT i.indisvalid
+            """, [self.name])
+            if cur.fetchone():
+                cur.execute(f"DROP INDEX CONCURRENTLY {self.name}")
+            cur.execute(self.sql)
+        finally:
+            conn.autocommit = False
+
+
+# A step is SQL, a callable that gets the cursor and returns False to stay
+# pending (e.g. an extension that this server does not offer yet), or an
+# index to build concurrently
+Step = Union[str, Callable, Concurrently]
+
+
+def _require_extension(name: str) -> Callable:
+    def step(cur) -> bool:
+        cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = %s", [name])
+        if not cur.fetchone():
+            log.warning("⚠️ Extension not available, migration left pending", extra={"extension": name})
+            return False
+        cur.execute(f"CREATE EXTENSION IF NOT EXISTS {name}")
+        return True
+    return step
+
+
+MIGRATIONS: list[tuple[int, str, list[Step]]] = [
+    (1, "catalog baseline", [
+        """
+        CREATE TABLE IF NOT EXISTS wines (
+            id SERIAL PRIMARY KEY,
+            name TEXT,
+            winery TEXT,
+            region TEXT,
+            country TEXT,
+            grape_variety TEXT,
+            vintage INTEGER,
+            wine_type TEXT,
+            style TEXT,
+            color TEXT,
+            price_retail NUMERIC(10,2),
+            price_trade NUMERIC(10,2),
+            bottle_size TEXT,
+            tasting_notes TEXT,
+            critic_scores JSONB,
+            drinking_window TEXT,
+            classification TEXT,
+            image_url TEXT,
+            stock_quantity INTEGER,
+            case_size INTEGER,
+            is_active BOOLEAN DEFAULT true,
+            slug TEXT,
+            created_at TIMESTAMPTZ DEFAULT NOW(),
+            updated_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+        "ALTER TABLE wines ADD COLUMN IF NOT EXISTS price_history JSONB DEFAULT '[]'",
+        "ALTER TABLE wines ADD COLUMN IF NOT EXISTS investment_score DECIMAL(3,1)",
+        "ALTER TABLE wines ADD COLUMN IF NOT EXISTS is_investment_grade BOOLEAN DEFAULT false",
+        "ALTER TABLE wines ADD COLUMN IF NOT EXISTS storage_type VARCHAR(20)",
+        "ALTER TABLE wines ADD COLUMN IF NOT EXISTS five_year_return DECIMAL(5,1)",
+        "ALTER TABLE wines ADD COLUMN IF NOT EXISTS liv_ex_score INTEGER",
+    ]),
+    (2, "sort and aggregate indexes", [
+        # search_wines: ORDER BY price_retail DESC LIMIT n over active wines
+        Concurrently("wines_active_price_idx", "wines (price_retail DESC) WHERE is_active"),
+        # get_investment_wines / build_portfolio / price history: ranked by score,
+        # with the portfolio's price cap checked from the index
+        Concurrently("wines_investment_rank_idx", "wines (investment_score DESC, price_retail) WHERE is_investment_grade"),
+        # show_wine_regions / show_wine_types / show_wine_market group-bys
+        Concurrently("wines_active_region_idx", "wines (region) WHERE is_active"),
+        Concurrently("wines_active_type_idx", "wines (wine_type) WHERE is_active"),
+        Concurrently("wines_active_vintage_idx", "wines (vintage) WHERE is_active"),
+    ]),
+    (3, "trigram search indexes", [
+        _require_extension("pg_trgm"),
+        # Expression indexes match the tools' LOWER(col) LIKE '%x%' filters as written
+        Concurrently("wines_name_trgm_idx", "wines USING gin (LOWER(name) gin_trgm_ops)"),
+        Concurrently("wines_region_trgm_idx", "wines USING gin (LOWER(region) gin_trgm_ops)"),
+        Concurrently("wines_country_trgm_idx", "wines USING gin (LOWER(country) gin_trgm_ops)"),
+        Concurrently("wines_grape_trgm_idx", "wines USING gin (LOWER(grape_variety) gin_trgm_ops)"),
+        Concurrently("wines_type_trgm_idx", "wines USING gin (LOWER(wine_type) gin_trgm_ops)"),
+    ]),
+    (4, "catalog change notifications", [
+        # One notification per statement with the changed ids and places, or
+        # null for either when there are too many to fit a NOTIFY payload
+        """
+        CREATE OR REPLACE FUNCTION notify_catalog_changed() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            ids INTEGER[];
+            places TEXT[];
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT array_agg(id), array_agg(DISTINCT LOWER(region)) || array_agg(DISTINCT LOWER(country))
+                INTO ids, places FROM new_rows;
+            ELSIF TG_OP = 'UPDATE' THEN
+                SELECT array_agg(DISTINCT id), array_agg(DISTINCT LOWER(region)) || array_agg(DISTINCT LOWER(country))
+                INTO ids, places FROM (SELECT * FROM old_rows UNION ALL SELECT * FROM new_rows) changed;
+            ELSE
+                SELECT array_agg(id), array_agg(DISTINCT LOWER(region)) || array_agg(DISTINCT LOWER(country))
+                INTO ids, places FROM old_rows;
+            END IF;
+            IF ids IS NOT NULL THEN
+                places := array_remove(places, NULL);
+                PERFORM pg_notify('catalog_changed', json_build_object(
+                    'op', TG_OP,
+                    'ids', CASE WHEN cardinality(ids) <= 500 THEN ids END,
+                    'places', CASE WHEN cardinality(places) <= 100 THEN places END
+                )::text);
+            END IF;
+            RETURN NULL;
+        END
+        $$
+        """,
+        "DROP TRIGGER IF EXISTS wines_notify_insert ON wines",
+        "DROP TRIGGER IF EXISTS wines_notify_update ON wines",
+        "DROP TRIGGER IF EXISTS wines_notify_delete ON wines",
+        """
+        CREATE TRIGGER wines_notify_insert AFTER INSERT ON wines
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed()
+        """,
+        """
+        CREATE TRIGGER wines_notify_update AFTER UPDATE ON wines
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed()
+        """,
+        """
+        CREATE TRIGGER wines_notify_delete AFTER DELETE ON wines
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_catalog_changed()
+        """,
+    ]),
+    (5, "similar wine neighbours", [
+        # Filled by neighbours.py; similarity is scaled by 1000 and lists are most similar first
+        """
+        CREATE TABLE IF NOT EXISTS wine_neighbours (
+            wine_id INTEGER PRIMARY KEY REFERENCES wines(id) ON DELETE CASCADE,
+            neighbour_ids INTEGER[] NOT NULL,
+            similarity SMALLINT[] NOT NULL,
+            computed_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS wine_neighbours_ids_idx ON wine_neighbours USING gin (neighbour_ids)",
+    ]),
+]
+
+
+def _ensure_table(cur) -> None:
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ DEFAULT NOW()
+        )
+    """)
+
+
+def applied_versions(cur) -> set[int]:
+    _ensure_table(cur)
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate(database_url: str, target: Optional[int] = None) -> list[int]:
+    """Apply pending migrations up to `target` (default: all); returns the versions applied."""
+    conn = psycopg2.connect(database_url)
+    applied = []
+    try:
+        cur = conn.cursor()
+        # Wait for the lock between statements: a worker blocked inside one holds a
+        # snapshot, which our CREATE INDEX CONCURRENTLY would wait on in turn
+        conn.autocommit = True
+        cur.execute("SELECT pg_try_advisory_lock(%s)", [ADVISORY_LOCK_ID])
+        while not cur.fetchone()[0]:
+            time.sleep(1)
+            cur.execute("SELECT pg_try_advisory_lock(%s)", [ADVISORY_LOCK_ID])
+        conn.autocommit = False
+        done = applied_versions(cur)
+        conn.commit()
+
+        for version, name, steps in MIGRATIONS:
+            if version in done or (target is not None and version > target):
+                continue
+            try:
+                complete = True
+                for step in steps:
+                    if isinstance(step, Concurrently):
+                        # Keeps the steps before it; they are all idempotent, so a rerun is safe
+                        conn.commit()
+                        step.run(conn, cur)
+                    elif callable(step):
+                        complete = step(cur) is not False
+                        if not complete:
+                            break
+                    else:
+                        cur.execute(step)
+                if not complete:
+                    conn.rollback()
+                    continue
+                cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", [version, name])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                log.exception("❌ Migration failed", extra={"version": version, "migration": name})
+                raise
+            applied.append(version)
+            log.info("🗄️ Applied migration", extra={"version": version, "migration": name})
+
+        if applied:
+            cur.execute("ANALYZE wines")
+            conn.commit()
+        cur.execute("SELECT pg_advisory_unlock(%s)", [ADVISORY_LOCK_ID])
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return applied
+
+
+def status(database_url: str) -> list[tuple[int, str, bool]]:
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        done = applied_versions(cur)
+        conn.commit()
+        return [(version, name, version in done) for version, name, _ in MIGRATIONS]
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Apply DIONYSUS catalog migrations")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="defaults to DATABASE_URL")
+    parser.add_argument("--target", type=int, help="stop after this version")
+    parser.add_argument("--status", action="store_true", help="list migrations instead of applying them")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("no --database-url and DATABASE_URL is not set")
+
+    if args.status:
+        for version, name, done in status(args.database_url):
+            print(f"{'✅' if done else '⏳'} {version:>3} {name}")
+    else:
+        applied = migrate(args.database_url, args.target)
+        print(f"🗄️ Applied {len(applied)} migration(s){': ' + ', '.join(map(str, applied)) if applied else ''}")
+    logs.shutdown()
@@ -0,0 +1,327 @@
+"""
+Model routing for DIONYSUS
+Picks a Groq model per request from a preferred tier, keeping rolling
+latency and error figures for every model. A model that is rate-limited,
+failing or slow is tried after the others, and a request that fails or
+times out on one model is retried on the next. Every request is admitted
+by the router's AdmissionController first.
+"""
+import asyncio
+import os
+import statistics
+import time
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from pydantic_ai.exceptions import FallbackExceptionGroup, ModelAPIError, ModelHTTPError
+from pydantic_ai.models import Model, ModelRequestParameters, StreamedResponse
+
+import deadline
+import logs
+import metrics
+from admission import AdmissionController
+
+# Per attempt, to the full response (or the start of a stream)
+MODEL_TIMEOUT_SECONDS = float(os.getenv("MODEL_TIMEOUT_SECONDS", "30"))
+# A model whose median latency is above this is tried after faster ones
+MODEL_SLOW_SECONDS = float(os.getenv("MODEL_SLOW_SECONDS", "8"))
+# Requests per model that the latency and error figures cover
+MODEL_HEALTH_WINDOW = int(os.getenv("MODEL_HEALTH_WINDOW", "50"))
+# Error rate over the window that takes a model out of rotation
+MODEL_MAX_ERROR_RATE = float(os.getenv("MODEL_MAX_ERROR_RATE", "0.5"))
+# How long a rate-limited or failing model is tried last
+MODEL_COOLDOWN_SECONDS = float(os.getenv("MODEL_COOLDOWN_SECONDS", "30"))
+# Hedged requests: a backup goes out once the first has taken longer than this
+# quantile of the model's recent latency (or the fixed delay until there are
+# enough samples), and hedges may add at most this fraction of extra requests
+MODEL_HEDGE_QUANTILE = float(os.getenv("MODEL_HEDGE_QUANTILE", "0.9"))
+MODEL_HEDGE_DELAY_SECONDS = float(os.getenv("MODEL_HEDGE_DELAY_SECONDS", "1.5"))
+MODEL_HEDGE_BUDGET = float(os.getenv("MODEL_HEDGE_BUDGET", "0.1"))
+# Hedges that can be spent in a burst after a quiet period
+MODEL_HEDGE_BURST = 10
+
+log = logs.get_logger("models")
+
+
+class ModelHealth:
+    """Rolling latency and outcomes of the last requests to one model."""
+
+    def __init__(self, name: str, window: int = MODEL_HEALTH_WINDOW):
+        self.name = name
+        self._outcomes: deque[tuple[float, bool]] = deque(maxlen=window)
+        # Full-response seconds of successful non-streamed requests, which are what hedging waits on;
+        # a stream's sample is only its time to the first event
+        self._complete: deque[float] = deque(maxlen=window)
+        self.cooldown_until = 0.0
+
+    def record(self, seconds: float, ok: bool, stream: bool = False) -> None:
+        self._outcomes.append((seconds, ok))
+        if ok and not stream:
+            self._complete.append(seconds)
+        metrics.model_latency.observe(seconds, self.name)
+        if not ok:
+            metrics.model_errors.inc(self.name)
+            if len(self._outcomes) >= 4 and self.error_rate > MODEL_MAX_ERROR_RATE:
+                self.cool_down("error rate")
+
+    def cool_down(self, reason: str) -> None:
+        self.cooldown_until = time.monotonic() + MODEL_COOLDOWN_SECONDS
+        log.warning("⚠️ Model cooling down", extra={"model": self.name, "reason": reason})
+
+    @property
+    def latency(self) -> Optional[float]:
+        """Median seconds of recent successful requests."""
+        ok = [seconds for seconds, success in self._outcomes if success]
+        return statistics.median(ok) if ok else None
+
+    def hedge_delay(self) -> float:
+        ok = sorted(self._complete)
+        if len(ok) < 10:
+            return MODEL_HEDGE_DELAY_SECONDS
+        return ok[min(len(ok) - 1, int(len(ok) * MODEL_HEDGE_QUANTILE))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def rank(self, now: float) -> int:
+        """0 healthy, 1 slow, 2 cooling down."""
+        if now < self.cooldown_until:
+            return 2
+        latency = self.latency
+        return 1 if latency is not None and latency > MODEL_SLOW_SECONDS else 0
+
+    def stats(self) -> dict:
+        latency = self.latency
+        return {
+            "latency_seconds": round(latency, 3) if latency is not None else None,
+            "error_rate": round(self.error_rate, 3),
+            "requests": len(self._outcomes),
+            "cooling_down": time.monotonic() < self.cooldown_until,
+        }
+
+
+def _counts_against(error: Exception) -> bool:
+    """Rate limits, server errors and timeouts say something about the model; bad requests do not."""
+    if isinstance(error, ModelHTTPError):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
+
+class RoutedModel(Model):
+    """Tries the router's models in tier preference order, healthiest first.
+
+    With `hedge`, a non-streamed request that is slower than usual is sent a
+    second time to the same model and the first response wins; streams are
+    never hedged. `priority` is the admission class of its requests; a hedge
+    takes a second admission slot, and each failover another request token.
+    """
+
+    def __init__(self, router: "ModelRouter", preference: list[str], hedge: bool = False,
+                 priority: str = "interactive"):
+        super().__init__()
+        self.router = router
+        self.preference = preference
+        self.hedge = hedge
+        self.priority = priority
+
+    @property
+    def model_name(self) -> str:
+        return f"routed:{','.join(self.router.models[name].model_name for name in self.preference)}"
+
+    @property
+    def system(self) -> str:
+        return self.router.models[self.preference[0]].system
+
+    @property
+    def base_url(self) -> Optional[str]:
+        return self.router.models[self.preference[0]].base_url
+
+    @property
+    def profile(self):
+        return self.router.models[self.preference[0]].profile
+
+    def prepare_request(self, model_settings, model_request_parameters: ModelRequestParameters):
+        return model_settings, model_request_parameters
+
+    def customize_request_parameters(self, model_request_parameters: ModelRequestParameters) -> ModelRequestParameters:
+        return model_request_parameters
+
+    def _failed(self, name: str, started: float, error: Exception) -> None:
+        health = self.router.health[name]
+        if _counts_against(error):
+            health.record(time.perf_counter() - started, ok=False)
+            if isinstance(error, ModelHTTPError) and error.status_code == 429:
+                health.cool_down("rate limited")
+
+    def _failing_over(self, name: str, error: Exception, remaining: int) -> None:
+        if remaining:
+            metrics.model_failovers.inc(name)
+            log.warning("⚠️ Model request failed, trying the next model", extra={
+                "model": name, "error": type(error).__name__, "remaining": remaining,
+            })
+
+    def _timeout(self) -> float:
+        """Per attempt, or what the run has left; raises deadline.Exceeded when that is nothing."""
+        timeout = deadline.limit(MODEL_TIMEOUT_SECONDS)
+        if timeout <= 0:
+            metrics.deadline_exceeded.inc("model")
+            raise deadline.Exceeded("run deadline passed before the model request")
+        return timeout
+
+    def _cut_short(self, timeout: float) -> deadline.Exceeded:
+        metrics.deadline_exceeded.inc("model")
+        return deadline.Exceeded(f"run deadline cut the model request off after {timeout:.1f}s")
+
+    async def _request_once(self, name: str, *args):
+        started = time.perf_counter()
+        timeout = self._timeout()
+        try:
+            async with asyncio.timeout(timeout):
+                response = await self.router.models[name].request(*args)
+        except TimeoutError:
+            # Only a model that used its full allowance is counted as slow
+            if timeout < MODEL_TIMEOUT_SECONDS:
+                raise self._cut_short(timeout)
+            self._failed(name, started, TimeoutError())
+            raise
+        except ModelAPIError as e:
+            self._failed(name, started, e)
+            raise
+        self.router.health[name].record(time.perf_counter() - started, ok=True)
+        return response
+
+    async def _request_hedged(self, name: str, *args):
+        started = time.perf_counter()
+        self.router.earn_hedge()
+        first = asyncio.create_task(self._request_once(name, *args))
+        try:
+            done, _ = await asyncio.wait({first}, timeout=self.router.health[name].hedge_delay())
+        except BaseException:
+            # Cancelled while waiting: wait() leaves the request running, so stop it here
+            first.cancel()
+            raise
+        if done or not self.router.spend_hedge():
+            return await first
+        # The backup is a real request of its own, so it needs its own slot and request token
+        if not self.router.admission.start_hedge():
+            metrics.model_hedges.inc(name, "no_capacity")
+            return await first
+
+        metrics.model_hedges.inc(name, "sent")
+        backup = asyncio.create_task(self._request_once(name, *args))
+        pending, error = {first, backup}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = "backup" if task is backup else "first"
+                        metrics.model_hedges.inc(name, f"{winner}_won")
+                        metrics.model_hedged_latency.observe(time.perf_counter() - started, winner)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The loser is cancelled, which closes its connection to the API
+            for task in pending:
+                task.cancel()
+            self.router.admission.end_hedge()
+
+    async def request(self, messages, model_settings, model_request_parameters):
+        async with self.router.admission.slot(self.priority):
+            errors = []
+            order = self.router.order(self.preference)
+            attempt = self._request_hedged if self.hedge else self._request_once
+            for i, name in enumerate(order):
+                if i:
+                    # The slot covers one request at a time, but each failover is another against the quota
+                    self.router.admission.retry(self.priority)
+                try:
+                    response = await attempt(name, messages, model_settings, model_request_parameters)
+                except deadline.Exceeded:
+                    raise
+                except (ModelAPIError, TimeoutError) as e:
+                    errors.append(e)
+                    self._failing_over(name, e, len(order) - i - 1)
+                    continue
+                self.router.admission.used_tokens(response.usage.total_tokens)
+                return response
+            raise FallbackExceptionGroup("All routed models failed", errors)
+
+    @asynccontextmanager
+    async def request_stream(self, messages, model_settings, model_request_parameters,
+                             run_context=None) -> AsyncIterator[StreamedResponse]:
+        # The slot is held until the stream has been read to the end
+        async with self.router.admission.slot(self.priority):
+            errors = []
+            order = self.router.order(self.preference)
+            for i, name in enumerate(order):
+                if i:
+                    self.router.admission.retry(self.priority)
+                model = self.router.models[name]
+                started = time.perf_counter()
+                timeout = self._timeout()
+                async with AsyncExitStack() as stack:
+                    try:
+                        # Only the start of the stream can fail over; once text flows it is this model's
+                        async with asyncio.timeout(timeout):
+                            response = await stack.enter_async_context(
+                                model.request_stream(messages, model_settings, model_request_parameters, run_context)
+                            )
+                    except (ModelAPIError, TimeoutError) as e:
+                        if isinstance(e, TimeoutError) and timeout < MODEL_TIMEOUT_SECONDS:
+                            raise self._cut_short(timeout)
+                        errors.append(e)
+                        self._failed(name, started, e)
+                        self._failing_over(name, e, len(order) - i - 1)
+                        continue
+                    self.router.health[name].record(time.perf_counter() - started, ok=True, stream=True)
+                    try:
+                        yield response
+                    finally:
+                        self.router.admission.used_tokens(response.usage().total_tokens)
+                    return
+            raise FallbackExceptionGroup("All routed models failed", errors)
+
+
+class ModelRouter:
+    """Named models (e.g. "fast", "large") and what is known about each one's health."""
+
+    def __init__(self, models: dict[str, Model], admission: Optional[AdmissionController] = None):
+        self.models = models
+        self.admission = admission or AdmissionController()
+        self.health = {name: ModelHealth(model.model_name) for name, model in models.items()}
+        self._routed: dict[tuple, RoutedModel] = {}
+        self._hedge_tokens = float(MODEL_HEDGE_BURST)
+
+    def order(self, preference: list[str]) -> list[str]:
+        """Healthy models first, then slow ones, then ones cooling down, each in preference order."""
+        now = time.monotonic()
+        return sorted(preference, key=lambda name: self.health[name].rank(now))
+
+    def model(self, tier: str, hedge: bool = False, priority: str = "interactive") -> RoutedModel:
+        """A model that prefers `tier` and fails over to the others."""
+        key = (tier, hedge, priority)
+        found = self._routed.get(key)
+        if found is None:
+            preference = [tier] + [name for name in self.models if name != tier]
+            found = self._routed.setdefault(key, RoutedModel(self, preference, hedge, priority))
+        return found
+
+    def earn_hedge(self) -> None:
+        """Every hedgeable request adds MODEL_HEDGE_BUDGET of a hedge to the budget."""
+        self._hedge_tokens = min(MODEL_HEDGE_BURST, self._hedge_tokens + MODEL_HEDGE_BUDGET)
+
+    def spend_hedge(self) -> bool:
+        if self._hedge_tokens < 1:
+            metrics.model_hedges.inc("any", "over_budget")
+            return False
+        self._hedge_tokens -= 1
+        return True
+
+    def stats(self) -> dict:
+        return {name: {"model": self.models[name].model_name, **health.stats()} for name, health in self.health.items()}
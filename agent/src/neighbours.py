@@ -0,0 +1,357 @@
+"""
+Similar-wine neighbour lists for DIONYSUS
+For every active wine, the NEIGHBOURS_K most similar active wines of the same
+type (wines with no type count as one type), by a weighted distance over grape, region, country, style, vintage,
+price and average critic score. Distances are computed with numpy a chunk of
+wines against a whole type at a time, and the lists are stored one row per
+wine in `wine_neighbours` (migration 5), so get_similar_wines is a primary key
+lookup.
+
+    uv run python src/neighbours.py                  # rebuild every list
+    uv run python src/neighbours.py --wine-ids 1,2   # refresh after these wines changed
+
+Running agents refresh incrementally from the catalog change feed: a changed
+wine gets a new list, and so does every wine whose list it joins or leaves.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+import time
+from typing import Iterable, Optional
+
+import numpy as np
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logs
+from catalog_cache import CATALOG_CHANNEL, NEIGHBOURS_OP, CatalogChange, subscribe
+
+NEIGHBOURS_K = int(os.getenv("NEIGHBOURS_K", "10"))
+# How often a running agent folds changed wines into the lists
+NEIGHBOURS_REFRESH_SECONDS = float(os.getenv("NEIGHBOURS_REFRESH_SECONDS", "10"))
+# Distance matrix cells per chunk (float32), which bounds memory
+CHUNK_CELLS = 4_000_000
+# Only one process rewrites the lists at a time
+ADVISORY_LOCK_ID = 0x6E656967
+# Wine ids per change notification
+NOTIFY_BATCH = 500
+
+# Distance weights; they sum to 1, so similarity = 1 - distance
+WEIGHTS = {
+    "grape": 0.30, "region": 0.25, "country": 0.05, "style": 0.10,
+    "vintage": 0.10, "price": 0.15, "score": 0.05,
+}
+# Differences at which the numeric features count as completely different
+VINTAGE_SPAN = 20.0
+PRICE_SPAN = float(np.log(4.0))
+SCORE_SPAN = 10.0
+# Least distance between wines that differ in grape or region
+GROUP_BOUND = min(WEIGHTS["grape"], WEIGHTS["region"])
+
+log = logs.get_logger("neighbours")
+
+FEATURES = r"""
+    SELECT id, LOWER(wine_type), LOWER(grape_variety), LOWER(region), LOWER(country), LOWER(style),
+           vintage, price_retail::float8,
+           CASE WHEN jsonb_typeof(critic_scores) = 'object' THEN (
+               SELECT AVG(value::numeric)::float8 FROM jsonb_each_text(critic_scores)
+               WHERE value ~ '^\d+(\.\d+)?$'
+           ) END
+    FROM wines WHERE is_active
+    ORDER BY id
+"""
+
+
+def _codes(values: list) -> np.ndarray:
+    """Integer codes for a categorical column; each missing value gets a code of its own."""
+    _, codes = np.unique(np.array([v or "" for v in values], dtype=object), return_inverse=True)
+    codes = codes.astype(np.int64)
+    missing = np.array([not v for v in values])
+    codes[missing] = -1 - np.flatnonzero(missing)
+    return codes
+
+
+class Catalog:
+    """Features of the active wines, as parallel arrays in id order."""
+
+    def __init__(self, rows: list[tuple]):
+        columns = list(zip(*rows)) if rows else [[] for _ in range(9)]
+        self.ids = np.array(columns[0], dtype=np.int64)
+        # Wines without a type share one "unknown" type rather than each being alone
+        _, kinds = np.unique(np.array([v or "" for v in columns[1]], dtype=object), return_inverse=True)
+        kinds = kinds.astype(np.int64)
+        self.grape, self.region, self.country, self.style = (_codes(list(c)) for c in columns[2:6])
+        self.vintage = np.array([np.nan if v is None else v for v in columns[6]], dtype=np.float32)
+        self.log_price = np.log(np.array([np.nan if p is None or p <= 0 else p for p in columns[7]], dtype=np.float32))
+        self.score = np.array([np.nan if s is None else s for s in columns[8]], dtype=np.float32)
+        # Wines are only compared with wines of the same type
+        self.block_of = kinds
+        self.blocks = {kind: np.flatnonzero(kinds == kind) for kind in np.unique(kinds)}
+        # Wines of one type, grape and region, searched first
+        _, self.group = np.unique(np.stack([kinds, self.grape, self.region], axis=1), axis=0, return_inverse=True)
+        self.group = self.group.ravel()
+        order = np.argsort(self.group, kind="stable")
+        bounds = np.flatnonzero(np.diff(self.group[order])) + 1
+        self.groups = dict(enumerate(np.split(order, bounds))) if len(order) else {}
+
+    @classmethod
+    def load(cls, cur) -> "Catalog":
+        cur.execute(FEATURES)
+        return cls(cur.fetchall())
+
+    def positions(self, wine_ids: Iterable[int]) -> np.ndarray:
+        """Positions of the active wines among `wine_ids`."""
+        wanted = np.array(sorted(set(wine_ids)), dtype=np.int64)
+        found = np.searchsorted(self.ids, wanted)
+        found = found[found < len(self.ids)]
+        return found[np.isin(self.ids[found], wanted)]
+
+    def similarity(self, rows: np.ndarray, block: np.ndarray) -> np.ndarray:
+        """len(rows) x len(block) similarities in [0, 1]."""
+        def mismatch(codes):
+            return (codes[rows, None] != codes[None, block]).astype(np.float32)
+
+        def gap(values, span):
+            diff = np.abs(values[rows, None] - values[None, block]) / span
+            return np.nan_to_num(np.minimum(diff, 1.0), nan=0.5)
+
+        distance = WEIGHTS["grape"] * mismatch(self.grape)
+        distance += WEIGHTS["region"] * mismatch(self.region)
+        distance += WEIGHTS["country"] * mismatch(self.country)
+        distance += WEIGHTS["style"] * mismatch(self.style)
+        distance += WEIGHTS["vintage"] * gap(self.vintage, VINTAGE_SPAN)
+        distance += WEIGHTS["price"] * gap(self.log_price, PRICE_SPAN)
+        distance += WEIGHTS["score"] * gap(self.score, SCORE_SPAN)
+        return 1.0 - distance
+
+    def _top(self, rows: np.ndarray, candidates: np.ndarray, n: int) -> tuple[np.ndarray, np.ndarray]:
+        """Positions and similarities of the `n` candidates most like each of `rows`, most similar first."""
+        tops, sims = [], []
+        step = max(1, CHUNK_CELLS // len(candidates))
+        for start in range(0, len(rows), step):
+            chunk = rows[start:start + step]
+            sim = self.similarity(chunk, candidates)
+            # A wine is not its own neighbour
+            sim[chunk[:, None] == candidates[None, :]] = -1.0
+            top = np.argpartition(-sim, n - 1, axis=1)[:, :n]
+            top_sim = np.take_along_axis(sim, top, axis=1)
+            order = np.argsort(-top_sim, axis=1, kind="stable")
+            tops.append(candidates[np.take_along_axis(top, order, axis=1)])
+            sims.append(np.take_along_axis(top_sim, order, axis=1))
+        return np.concatenate(tops), np.concatenate(sims)
+
+    def nearest(self, rows: np.ndarray, k: int = NEIGHBOURS_K) -> dict[int, tuple[list[int], list[int]]]:
+        """wine id -> (neighbour ids, similarities x 1000), most similar first, for the wines at `rows`."""
+        lists = {}
+
+        def record(found: np.ndarray, top: np.ndarray, sims: np.ndarray) -> None:
+            for row, neighbours, scaled in zip(found, top, np.rint(sims * 1000).astype(int)):
+                lists[int(self.ids[row])] = (self.ids[neighbours].tolist(), scaled.tolist())
+
+        for kind, block in self.blocks.items():
+            members = rows[self.block_of[rows] == kind]
+            if not len(members) or len(block) < 2:
+                continue
+            n = min(k, len(block) - 1)
+            # Wines of another grape or region are at least GROUP_BOUND away, so a wine
+            # with n closer neighbours in its own grape and region needs nothing else
+            rest = []
+            for group in np.unique(self.group[members]):
+                candidates = self.groups[group]
+                found = members[self.group[members] == group]
+                if len(candidates) <= n:
+                    rest.append(found)
+                    continue
+                top, sims = self._top(found, candidates, n)
+                exact = sims[:, -1] > 1.0 - GROUP_BOUND
+                record(found[exact], top[exact], sims[exact])
+                rest.append(found[~exact])
+            rest = np.concatenate(rest)
+            if len(rest):
+                record(rest, *self._top(rest, block, n))
+        return lists
+
+
+def _array(values: list[int]) -> str:
+    return "{" + ",".join(map(str, values)) + "}"
+
+
+def _write(cur, lists: dict[int, tuple[list[int], list[int]]], removed: Iterable[int] = (), full: bool = False) -> None:
+    cur.execute("""
+        CREATE TEMP TABLE wine_neighbours_staging (LIKE wine_neighbours INCLUDING DEFAULTS) ON COMMIT DROP
+    """)
+    buffer = io.StringIO("".join(
+        f"{wine_id}\t{_array(ids)}\t{_array(sims)}\n" for wine_id, (ids, sims) in lists.items()
+    ))
+    cur.copy_expert("COPY wine_neighbours_staging (wine_id, neighbour_ids, similarity) FROM STDIN", buffer)
+    cur.execute("""
+        INSERT INTO wine_neighbours (wine_id, neighbour_ids, similarity)
+        SELECT wine_id, neighbour_ids, similarity FROM wine_neighbours_staging
+        ON CONFLICT (wine_id) DO UPDATE SET
+            neighbour_ids = EXCLUDED.neighbour_ids, similarity = EXCLUDED.similarity, computed_at = NOW()
+        WHERE (wine_neighbours.neighbour_ids, wine_neighbours.similarity)
+              IS DISTINCT FROM (EXCLUDED.neighbour_ids, EXCLUDED.similarity)
+    """)
+    if full:
+        cur.execute("""
+            DELETE FROM wine_neighbours n
+            WHERE NOT EXISTS (SELECT 1 FROM wine_neighbours_staging s WHERE s.wine_id = n.wine_id)
+        """)
+    elif removed:
+        cur.execute("DELETE FROM wine_neighbours WHERE wine_id = ANY(%s)", [list(removed)])
+
+
+def _notify(cur, wine_ids: Optional[list[int]]) -> None:
+    """Tell every agent which wines' lists changed (None: all of them); no places, so search results stay cached."""
+    # NOTIFY payloads are capped at 8000 bytes, so long id lists go out in several
+    batches = [None] if wine_ids is None else [wine_ids[i:i + NOTIFY_BATCH] for i in range(0, len(wine_ids), NOTIFY_BATCH)]
+    for ids in batches:
+        cur.execute("SELECT pg_notify(%s, %s)", [CATALOG_CHANNEL, json.dumps({"op": NEIGHBOURS_OP, "ids": ids, "places": []})])
+
+
+def rebuild(database_url: str, k: int = NEIGHBOURS_K) -> dict:
+    """Recompute every active wine's list."""
+    start = time.perf_counter()
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", [ADVISORY_LOCK_ID])
+        catalog = Catalog.load(cur)
+        lists = catalog.nearest(np.arange(len(catalog.ids)), k)
+        _write(cur, lists, full=True)
+        _notify(cur, None)
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return {"wines": len(lists), "seconds": round(time.perf_counter() - start, 2)}
+
+
+def refresh(database_url: str, wine_ids: Iterable[int], k: int = NEIGHBOURS_K) -> Optional[dict]:
+    """Fold changes to `wine_ids` into the lists; None if another process holds the lock."""
+    start = time.perf_counter()
+    changed_ids = sorted(set(wine_ids))
+    conn = psycopg2.connect(database_url)
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_try_advisory_xact_lock(%s)", [ADVISORY_LOCK_ID])
+        if not cur.fetchone()[0]:
+            conn.rollback()
+            return None
+        catalog = Catalog.load(cur)
+        changed = catalog.positions(changed_ids)
+        removed = sorted(set(changed_ids) - set(catalog.ids[changed].tolist()))
+
+        # Lists that hold a changed wine may need it moved or dropped
+        cur.execute("SELECT wine_id FROM wine_neighbours WHERE neighbour_ids && %s::int[]", [changed_ids])
+        affected = set(catalog.positions(row[0] for row in cur.fetchall()).tolist()) | set(changed.tolist())
+
+        # Lists whose weakest neighbour a changed wine now beats
+        cur.execute("SELECT wine_id, similarity[cardinality(similarity)], cardinality(similarity) FROM wine_neighbours")
+        stored = cur.fetchall()
+        weakest = np.full(len(catalog.ids), -1001, dtype=np.int64)
+        if stored:
+            at = catalog.positions(r[0] for r in stored)
+            by_id = {r[0]: (r[1] if r[2] >= k else -1001) for r in stored}
+            weakest[at] = [by_id[int(i)] for i in catalog.ids[at]]
+        for kind, block in catalog.blocks.items():
+            members = changed[catalog.block_of[changed] == kind]
+            step = max(1, CHUNK_CELLS // len(block))
+            for s in range(0, len(members), step):
+                best = np.rint(catalog.similarity(members[s:s + step], block) * 1000).max(axis=0)
+                affected.update(block[best > weakest[block]].tolist())
+
+        lists = catalog.nearest(np.array(sorted(affected), dtype=np.int64), k)
+        _write(cur, lists, removed)
+        _notify(cur, sorted(lists) + removed)
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return {
+        "changed": len(changed_ids), "rewritten": len(lists), "removed": len(removed),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+class Refresher:
+    """Collects changed wine ids from the change feed and refreshes their lists in the background."""
+
+    def __init__(self, database_url: str, interval: float = NEIGHBOURS_REFRESH_SECONDS):
+        self.database_url = database_url
+        self.interval = interval
+        self.last: Optional[dict] = None
+        self._pending: set[int] = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        subscribe(self.note)
+
+    def note(self, change: CatalogChange) -> None:
+        # Bulk changes (no ids) need a full rebuild, which is left to the CLI
+        if change.op == NEIGHBOURS_OP or change.ids is None:
+            return
+        with self._lock:
+            self._pending |= change.ids
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            if not pending:
+                continue
+            try:
+                result = await asyncio.to_thread(refresh, self.database_url, pending)
+            except Exception:
+                log.exception("❌ Neighbour refresh failed")
+                result = None
+            if result is None:
+                # Another process is refreshing (or this one failed); try these again next time
+                with self._lock:
+                    self._pending |= pending
+                continue
+            self.last = result
+            log.info("🍇 Neighbour lists refreshed", extra=result)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "last": self.last}
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Build the similar-wine neighbour lists")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="defaults to DATABASE_URL")
+    parser.add_argument("--wine-ids", help="comma-separated ids of changed wines; omit to rebuild everything")
+    parser.add_argument("-k", type=int, default=NEIGHBOURS_K, help="neighbours per wine")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("no --database-url and DATABASE_URL is not set")
+
+    if args.wine_ids:
+        summary = refresh(args.database_url, [int(i) for i in args.wine_ids.split(",")], args.k)
+        print(f"🍇 {summary}" if summary else "🍇 Another process is updating the lists", file=sys.stderr)
+    else:
+        summary = rebuild(args.database_url, args.k)
+        print(f"🍇 Built neighbour lists for {summary['wines']} wines in {summary['seconds']}s", file=sys.stderr)
+    logs.shutdown()
@@ -0,0 +1,105 @@
+"""
+Speculative catalog prefetch for DIONYSUS
+While a turn's first model call is in flight, the catalog lookups its tools
+are most likely to make are run from the user's message, so the rows are
+already in the catalog cache when the model asks for them. Regions, grapes,
+wine names, types and budgets are picked out with the vocabulary the
+phonetic corrections map to. The catalog cache counts how many prefetched
+results a tool then used (dionysus_catalog_prefetch_total).
+"""
+import asyncio
+import os
+import re
+from typing import Callable, Optional
+
+import intents
+import logs
+
+# Speculative lookups per turn; 0 turns prefetching off
+PREFETCH_MAX_CALLS = int(os.getenv("PREFETCH_MAX_CALLS", "3"))
+
+log = logs.get_logger("prefetch")
+
+# Every target of PHONETIC_CORRECTIONS is in one of these, plus common neighbours
+REGIONS = {
+    "bordeaux", "burgundy", "beaujolais", "champagne", "chablis", "sancerre", "moselle", "barolo", "barbaresco",
+    "chianti", "brunello", "prosecco", "rioja", "tuscany", "piedmont", "rhone", "loire", "alsace", "napa",
+    "sonoma", "mosel", "douro", "mendoza", "marlborough", "barossa", "france", "italy", "spain", "portugal",
+    "germany", "austria", "australia", "new zealand", "argentina", "chile", "california", "south africa",
+}
+GRAPES = {
+    "chardonnay", "pinot noir", "pinot grigio", "cabernet", "cabernet sauvignon", "merlot", "riesling",
+    "sauvignon", "sauvignon blanc", "tannat", "malbec", "grüner", "tempranillo", "nebbiolo", "syrah", "shiraz",
+    "grenache", "sangiovese", "zinfandel", "chenin blanc", "viognier", "gamay",
+}
+WINE_NAMES = {"petrus", "romanée-conti", "opus one", "sassicaia", "tignanello", "dom perignon", "cristal"}
+
+_BUDGET = re.compile(
+    r"\b(?:under|below|less than|up to|no more than|max(?:imum)?|budget(?: of)?|around|about)\s*"
+    r"(?:£|\$|€)?\s*(\d+(?:\.\d+)?)\s*(?:pounds|quid|gbp|dollars|euros)?\b"
+)
+
+
+def find_terms(text: str, vocabulary: set[str]) -> list[str]:
+    """Terms of `vocabulary` in `text`, longest first, skipping ones inside a longer match."""
+    found = []
+    for term in sorted(vocabulary, key=len, reverse=True):
+        if re.search(rf"(?<!\w){re.escape(term)}(?!\w)", text) and not any(term in longer for longer in found):
+            found.append(term)
+    return found
+
+
+def predict(utterance: str, investment: bool = False) -> list[tuple[str, dict]]:
+    """Likely tool calls for a (phonetically corrected) message, most likely first."""
+    text = intents.normalize(utterance)
+    regions, grapes, names = find_terms(text, REGIONS), find_terms(text, GRAPES), find_terms(text, WINE_NAMES)
+    wine_type = next((intents.PAIRING_TYPES[w] for w in text.split() if w in intents.PAIRING_TYPES), None)
+    budget = _BUDGET.search(text)
+    max_price = float(budget.group(1)) if budget else None
+
+    calls = []
+    for name in names:
+        calls.append(("get_wine_details", {"wine_name": name}))
+    if investment:
+        calls.extend(("get_investment_wines", {"region": region}) for region in regions)
+        if not regions:
+            calls.append(("get_investment_wines", {}))
+    for region in regions:
+        calls.append(("search_wines", {"region": region, "max_price": max_price}))
+    for grape in grapes:
+        calls.append(("search_wines", {"grape_variety": grape, "max_price": max_price}))
+    if wine_type and not (regions or grapes):
+        calls.append(("search_wines", {"wine_type": wine_type, "max_price": max_price}))
+    return calls
+
+
+class Prefetcher:
+    """Runs predicted catalog lookups in a worker thread and leaves their rows in the catalog cache.
+
+    `requests` maps a tool name to a function that takes the tool's arguments
+    and returns its (query, params, terms); `fetch` loads and caches one.
+    """
+
+    def __init__(self, requests: dict[str, Callable[..., tuple]], fetch: Callable,
+                 max_calls: int = PREFETCH_MAX_CALLS):
+        self.requests = requests
+        self.fetch = fetch
+        self.max_calls = max_calls
+        self._tasks: set[asyncio.Task] = set()
+
+    def warm(self, utterance: str, investment: bool = False) -> Optional[asyncio.Task]:
+        calls = predict(utterance, investment)[:self.max_calls] if self.max_calls else []
+        if not calls:
+            return None
+        task = asyncio.create_task(asyncio.to_thread(self._run, calls))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _run(self, calls: list[tuple[str, dict]]) -> None:
+        for tool, args in calls:
+            try:
+                q, params, terms = self.requests[tool](**{k: v for k, v in args.items() if v is not None})
+                self.fetch(q, params, terms=terms, prefetch=True)
+            except Exception as e:
+                log.warning("⚠️ Prefetch failed", extra={"tool": tool, "error": str(e)})
@@ -0,0 +1,169 @@
+"""
+Personalized ordering of search results for DIONYSUS
+For a signed-in user, search_wines loads a wider candidate set than it
+returns and orders it by their preferences. The preference facts Zep holds
+are compiled once into a profile: a weight per region, grape, type and style
+they like (negative when they dislike it) and the price they tend to pay.
+Candidates are scored against the profile in one numpy pass. Profiles are
+cached per user, refreshed whenever their facts are fetched for a prompt, and
+a preference the user saves is folded in straight away.
+"""
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+import intents
+import metrics
+from prefetch import GRAPES, REGIONS, find_terms
+
+# Rows loaded for a personalized search, of which `limit` are returned
+RANKING_CANDIDATES = int(os.getenv("RANKING_CANDIDATES", "60"))
+RANKING_PROFILE_TTL_SECONDS = float(os.getenv("RANKING_PROFILE_TTL_SECONDS", "600"))
+
+STYLES = {
+    "crisp": "crisp", "fresh": "crisp", "light": "light", "light-bodied": "light", "light bodied": "light",
+    "medium-bodied": "medium-bodied", "medium bodied": "medium-bodied", "full-bodied": "full-bodied",
+    "full bodied": "full-bodied", "bold": "full-bodied", "rich": "rich",
+}
+
+# Which wine fields each kind of term is looked for in, and what a match is worth
+KINDS = {
+    "place": (("region", "country"), 1.0),
+    "grape": (("grape_variety",), 1.0),
+    "type": (("wine_type",), 0.6),
+    "style": (("style",), 0.5),
+}
+PRICE_WEIGHT = 0.8
+SCORE_WEIGHT = 0.3
+# Query order breaks ties, worth at most this much
+ORDER_WEIGHT = 0.05
+
+_CLAUSES = re.compile(r"[;,]|\.\s|\bbut\b|\bwhereas\b|\bexcept\b")
+_NEGATIVE = re.compile(
+    r"\b(?:dislikes?|hates?|avoids?|doesn't like|does not like|don't like|not (?:a )?fan|not keen|isn't keen|"
+    r"no longer likes?|won't drink|never drinks?)\b"
+)
+# A price needs a currency or a budget word, so vintages and scores are not read as one
+_PRICE = re.compile(
+    r"(?:\b(under|below|less than|up to|no more than|max(?:imum)?|budget(?: of| is)?|around|about|spends?)\s*)?"
+    r"(?:[£$€]\s*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*(?:pounds|quid|gbp|dollars|euros)\b)"
+)
+# Qualifiers that make a price an upper limit rather than a target
+_CAPS = ("under", "below", "less than", "up to", "no more than", "max", "budget")
+_STYLE_TERMS = set(STYLES)
+
+
+class Profile:
+    """A user's preferences as term weights per kind plus a price target."""
+
+    __slots__ = ("facts", "terms", "price", "price_cap")
+
+    def __init__(self, facts: list[str]):
+        self.facts = list(facts)
+        weights: dict[str, dict[str, float]] = {kind: {} for kind in KINDS}
+        prices, caps = [], []
+        for fact in self.facts:
+            for clause in _CLAUSES.split(fact.lower()):
+                sign = -1.0 if _NEGATIVE.search(clause) else 1.0
+                text = intents.normalize(clause)
+                found = {
+                    "place": find_terms(text, REGIONS),
+                    "grape": find_terms(text, GRAPES),
+                    "type": [intents.PAIRING_TYPES[w] for w in text.split() if w in intents.PAIRING_TYPES],
+                    "style": [STYLES[s] for s in find_terms(text, _STYLE_TERMS)],
+                }
+                for kind, terms in found.items():
+                    for term in terms:
+                        weights[kind][term] = weights[kind].get(term, 0.0) + sign
+                for m in _PRICE.finditer(clause):
+                    prices.append(float(m.group(2) or m.group(3)))
+                    caps.append((m.group(1) or "").startswith(_CAPS))
+        # Each term counts once however many facts repeat it; dislikes win ties
+        self.terms = {
+            kind: (np.array(list(w), dtype=str), np.array([np.sign(v) or -1.0 for v in w.values()], dtype=np.float32))
+            for kind, w in weights.items() if w
+        }
+        self.price = math.log(sum(prices) / len(prices)) if prices and min(prices) > 0 else None
+        self.price_cap = bool(caps) and all(caps)
+
+    @property
+    def empty(self) -> bool:
+        return not self.terms and self.price is None
+
+
+def _column(wines: list[dict], field: str) -> np.ndarray:
+    return np.array([(w.get(field) or "").lower() for w in wines], dtype=str)
+
+
+def _critic_average(scores) -> float:
+    values = [v for v in scores.values() if isinstance(v, (int, float))] if isinstance(scores, dict) else []
+    return sum(values) / len(values) if values else math.nan
+
+
+def rerank(profile: Optional[Profile], wines: list[dict], limit: int) -> list[dict]:
+    """The `limit` wines that best fit `profile`, in query order when there is nothing to go on."""
+    if profile is None or profile.empty or len(wines) <= 1:
+        return wines[:limit]
+    n = len(wines)
+    score = np.linspace(ORDER_WEIGHT, 0.0, n, dtype=np.float32)
+    for kind, (terms, weights) in profile.terms.items():
+        fields, worth = KINDS[kind]
+        hits = np.zeros((n, len(terms)), dtype=bool)
+        for field in fields:
+            hits |= np.strings.find(_column(wines, field)[:, None], terms[None, :]) >= 0
+        score += worth * (hits.astype(np.float32) @ weights)
+    if profile.price is not None:
+        prices = np.array([w.get("price_retail") or math.nan for w in wines], dtype=np.float32)
+        gap = (np.log(prices) - profile.price) / math.log(4.0)
+        if profile.price_cap:
+            gap = np.maximum(gap, 0.0)
+        score -= PRICE_WEIGHT * np.nan_to_num(np.minimum(np.abs(gap), 1.0), nan=0.5)
+    critics = np.array([_critic_average(w.get("critic_scores")) for w in wines], dtype=np.float32)
+    score += SCORE_WEIGHT * np.nan_to_num(np.clip((critics - 90.0) / 10.0, -1.0, 1.0), nan=0.0)
+    order = np.argsort(-score, kind="stable")[:limit]
+    metrics.ranking_reranked.inc()
+    return [wines[i] for i in order]
+
+
+class ProfileCache:
+    """Compiled profiles by user id, filled wherever the user's Zep facts are fetched."""
+
+    def __init__(self, ttl_seconds: float = RANKING_PROFILE_TTL_SECONDS, max_users: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._profiles: OrderedDict[str, tuple[float, Profile]] = OrderedDict()
+
+    def get(self, user_id: str) -> Optional[Profile]:
+        entry = self._profiles.get(user_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+            metrics.ranking_profiles.inc("miss")
+            return None
+        self._profiles.move_to_end(user_id)
+        metrics.ranking_profiles.inc("hit")
+        return entry[1]
+
+    def put(self, user_id: str, facts: list[str]) -> Profile:
+        entry = self._profiles.get(user_id)
+        if entry is not None and entry[1].facts == facts:
+            profile = entry[1]
+        else:
+            profile = Profile(facts)
+        self._profiles[user_id] = (time.monotonic(), profile)
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self.max_users:
+            self._profiles.popitem(last=False)
+        return profile
+
+    def add(self, user_id: str, fact: str) -> None:
+        """Fold in a preference just saved, which Zep takes a while to turn into a fact."""
+        entry = self._profiles.get(user_id)
+        if entry is not None:
+            self._profiles[user_id] = (entry[0], Profile([*entry[1].facts, fact]))
+
+    def stats(self) -> dict:
+        return {"users": len(self._profiles)}
@@ -0,0 +1,126 @@
+"""
+Run recording for DIONYSUS
+With REPLAY_RECORD_DIR set, every AG-UI run and Hume turn is written to a
+gzipped JSON file holding the request, the model responses, tool calls and
+results, and the time spent in each external stage. `replay.py` plays these
+back offline. Runs that fail are written too, with the messages up to the
+failure and the error.
+"""
+import gzip
+import json
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from ag_ui.core import RunErrorEvent
+from pydantic_ai import capture_run_messages
+from pydantic_ai.messages import ModelMessage, ModelMessagesTypeAdapter
+from pydantic_ai.models.wrapper import WrapperModel
+
+import metrics
+
+REPLAY_RECORD_DIR = os.getenv("REPLAY_RECORD_DIR", "")
+
+FORMAT_VERSION = 1
+
+
+class Recording:
+    def __init__(self, kind: str, request: dict):
+        self.kind = kind
+        self.request = request
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.stages: list = []
+        self.finished = False
+        self._token = metrics.stage_log.set(self.stages)
+
+    def finish(self, messages: list[ModelMessage], error: Optional[str] = None) -> str:
+        """Write the recording and stop collecting stage timings; returns the file path.
+
+        `error` is set for a run that failed, whose `messages` end where it did.
+        """
+        self.finished = True
+        total = time.perf_counter() - self._start
+        try:
+            metrics.stage_log.reset(self._token)
+        except ValueError:
+            # Finished from a different context than it was started in (streamed responses)
+            pass
+        entry = {
+            "version": FORMAT_VERSION,
+            "kind": self.kind,
+            "id": self.id,
+            "started": self.started,
+            "total_s": round(total, 6),
+            "request": self.request,
+            "stages": self.stages,
+            "messages": json.loads(ModelMessagesTypeAdapter.dump_json(messages)),
+        }
+        if error is not None:
+            entry["error"] = error
+        os.makedirs(REPLAY_RECORD_DIR, exist_ok=True)
+        path = os.path.join(REPLAY_RECORD_DIR, f"{self.kind}-{int(self.started)}-{self.id}.json.gz")
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        return path
+
+
+def start(kind: str, request: dict) -> Optional[Recording]:
+    """Begin recording a run, or return None when recording is off."""
+    if not REPLAY_RECORD_DIR:
+        return None
+    return Recording(kind, request)
+
+
+def describe(error: BaseException) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+async def until_finished(rec: Recording, events: AsyncIterator, history: int) -> AsyncIterator:
+    """Pass an AG-UI run's events through, and write `rec` with the error if the run ends without finishing it.
+
+    `history` is the number of messages the run started with, which are left out.
+    """
+    error = "run ended before completing"
+    with capture_run_messages() as messages:
+        try:
+            async for event in events:
+                if isinstance(event, RunErrorEvent):
+                    error = event.message
+                yield event
+        except BaseException as e:
+            error = describe(e)
+            raise
+        finally:
+            if not rec.finished:
+                rec.finish(messages[history:], error=error)
+
+
+def load(path: str) -> dict:
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        entry = json.load(f)
+    entry["messages"] = ModelMessagesTypeAdapter.validate_python(entry["messages"])
+    return entry
+
+
+class RecordingModel(WrapperModel):
+    """Model wrapper that notes each request's wall time as a `model` stage."""
+
+    async def request(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().request(*args, **kwargs)
+        finally:
+            metrics.note_stage("model", self.model_name, time.perf_counter() - start)
+
+    @asynccontextmanager
+    async def request_stream(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            async with super().request_stream(*args, **kwargs) as response:
+                yield response
+        finally:
+            metrics.note_stage("model", self.model_name, time.perf_counter() - start)
@@ -0,0 +1,242 @@
+"""
+Offline replay of recorded DIONYSUS runs
+Plays recordings made with REPLAY_RECORD_DIR back through the real FastAPI
+app with a scripted model and tools that return the recorded results, so the
+Python-side overhead of agent.py can be profiled without Groq, Neon or Zep.
+
+    uv run python src/replay.py recordings/*.json.gz --repeat 50 \\
+        --profile replay.prof --flamegraph replay.folded
+
+`--profile` writes cProfile stats (open with snakeviz, or `python -m pstats`);
+`--flamegraph` writes folded stacks for flamegraph.pl or speedscope.
+"""
+import argparse
+import asyncio
+import cProfile
+import functools
+import os
+import pstats
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# Replays never reach the network or a database, and never record themselves
+os.environ["DATABASE_URL"] = ""
+os.environ["ZEP_API_KEY"] = ""
+os.environ["REPLAY_RECORD_DIR"] = ""
+os.environ.setdefault("GROQ_API_KEY", "replay")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from pydantic_ai import Tool
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, ToolCallPart, ToolReturnPart
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+from pydantic_ai.toolsets import FunctionToolset
+
+import agent as dionysus
+import recording
+from metrics import track_tool
+
+
+def scripted_model(responses: list[ModelResponse]) -> FunctionModel:
+    """A model that returns the recorded responses in order, streamed or not."""
+    remaining = list(responses)
+
+    def next_response() -> ModelResponse:
+        if remaining:
+            return remaining.pop(0)
+        return ModelResponse(parts=[TextPart("(end of recording)")])
+
+    def respond(messages, info):
+        return next_response()
+
+    async def stream(messages, info):
+        for part in next_response().parts:
+            if isinstance(part, TextPart):
+                yield part.content
+            elif isinstance(part, ToolCallPart):
+                yield {0: DeltaToolCall(name=part.tool_name, json_args=part.args_as_json_str(),
+                                        tool_call_id=part.tool_call_id)}
+
+    return FunctionModel(respond, stream_function=stream, model_name="replay")
+
+
+def replay_tools(results: dict, stage_delays: dict) -> list[Tool]:
+    """The agent's tools with the same schemas, returning recorded results by tool call id."""
+    tools = []
+    for toolset in dionysus.agent.toolsets:
+        if not isinstance(toolset, FunctionToolset):
+            continue
+        for tool in toolset.tools.values():
+            def make(tool=tool):
+                @functools.wraps(tool.function)
+                async def replayed(ctx, *args, **kwargs):
+                    delays = stage_delays.get(tool.name)
+                    if delays:
+                        await asyncio.sleep(delays.pop(0))
+                    return results.get(ctx.tool_call_id, {"error": "not in recording"})
+                return Tool(track_tool(replayed), name=tool.name, takes_ctx=True, description=tool.description)
+            tools.append(make())
+    return tools
+
+
+def _split_messages(messages: list) -> tuple[list[ModelResponse], dict]:
+    responses, results = [], {}
+    for message in messages:
+        if isinstance(message, ModelResponse):
+            responses.append(message)
+        elif isinstance(message, ModelRequest):
+            for part in message.parts:
+                if isinstance(part, ToolReturnPart):
+                    results[part.tool_call_id] = part.content
+    return responses, results
+
+
+async def replay_once(entry: dict, client: httpx.AsyncClient, simulate_latency: bool) -> dict:
+    """Run one recording through the app; returns wall/cpu seconds and bytes streamed."""
+    responses, results = _split_messages(entry["messages"])
+    delays = defaultdict(list)
+    if simulate_latency:
+        for stage, label, seconds in entry["stages"]:
+            if stage == "tool":
+                delays[label].append(seconds)
+    model = scripted_model(responses)
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    received = 0
+    if entry["kind"] == "agui":
+        with dionysus.agent.override(model=model, tools=replay_tools(results, delays)):
+            async with client.stream("POST", "/agui/", json=entry["request"],
+                                     headers={"Accept": "text/event-stream"}) as resp:
+                async for chunk in resp.aiter_bytes():
+                    received += len(chunk)
+    else:
+        original = dionysus.route_model, dionysus.hume_tools
+        names = {tool.__name__ for tool in dionysus.hume_tools}
+        dionysus.route_model = lambda prompt, voice=False: model
+        dionysus.hume_tools = [tool for tool in replay_tools(results, delays) if tool.name in names]
+        try:
+            async with client.stream("POST", "/chat/completions", json=entry["request"]) as resp:
+                async for chunk in resp.aiter_bytes():
+                    received += len(chunk)
+        finally:
+            dionysus.route_model, dionysus.hume_tools = original
+    return {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu, "bytes": received}
+
+
+def recorded_breakdown(entry: dict) -> dict:
+    """Seconds per stage and label in the live run."""
+    stages = defaultdict(float)
+    for stage, label, seconds in entry["stages"]:
+        stages[f"{stage}:{label}"] += seconds
+    return dict(sorted(stages.items(), key=lambda kv: -kv[1]))
+
+
+class StackSampler:
+    """Samples the main thread's Python stack into folded-stack counts."""
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.counts: dict[str, int] = defaultdict(int)
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str) -> None:
+        with open(path, "w") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+
+async def replay_all(entries: list[dict], repeat: int, simulate_latency: bool) -> dict:
+    timings = defaultdict(list)
+    transport = httpx.ASGITransport(app=dionysus.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None) as client:
+        for entry in entries:
+            for _ in range(repeat):
+                timings[entry["path"]].append(await replay_once(entry, client, simulate_latency))
+    return timings
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:8.2f}ms"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded DIONYSUS runs offline")
+    parser.add_argument("recordings", nargs="+")
+    parser.add_argument("--repeat", type=int, default=10, help="replays per recording")
+    parser.add_argument("--simulate-latency", action="store_true",
+                        help="sleep for each tool's recorded duration instead of returning instantly")
+    parser.add_argument("--profile", help="write cProfile stats to this file")
+    parser.add_argument("--flamegraph", help="write folded stacks to this file")
+    parser.add_argument("--sample-interval", type=float, default=1.0, help="flamegraph sampling interval (ms)")
+    args = parser.parse_args()
+
+    entries = []
+    for path in args.recordings:
+        entry = recording.load(path)
+        entry["path"] = path
+        entries.append(entry)
+
+    profiler = cProfile.Profile() if args.profile else None
+    sampler = StackSampler(args.sample_interval / 1000) if args.flamegraph else None
+    if sampler:
+        sampler.__enter__()
+    if profiler:
+        profiler.enable()
+    try:
+        timings = asyncio.run(replay_all(entries, args.repeat, args.simulate_latency))
+    finally:
+        if profiler:
+            profiler.disable()
+        if sampler:
+            sampler.__exit__(None, None, None)
+
+    for entry in entries:
+        runs = timings[entry["path"]]
+        walls = sorted(r["wall"] for r in runs)
+        cpus = [r["cpu"] for r in runs]
+        print(f"\n🍷 {os.path.basename(entry['path'])} ({entry['kind']})")
+        print(f"   live total        {_ms(entry['total_s'])}")
+        if entry.get("error"):
+            print(f"   live error        {entry['error']}")
+        for stage, seconds in recorded_breakdown(entry).items():
+            print(f"   live {stage:<24} {_ms(seconds)}")
+        print(f"   replay wall p50   {_ms(statistics.median(walls))}  p95 {_ms(walls[int(0.95 * (len(walls) - 1))])}")
+        print(f"   replay cpu mean   {_ms(statistics.mean(cpus))}  ({runs[-1]['bytes']} bytes out)")
+
+    if profiler:
+        profiler.dump_stats(args.profile)
+        print(f"\n📈 cProfile stats written to {args.profile}; top functions by cumulative time:")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+    if sampler:
+        sampler.write(args.flamegraph)
+        print(f"🔥 Folded stacks written to {args.flamegraph}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
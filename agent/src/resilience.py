@@ -0,0 +1,191 @@
+"""
+Resilience for DIONYSUS' outbound HTTP services
+A Guard wraps calls to one service with a bulkhead (a cap on concurrent
+calls), a timeout derived from the service's recent latency, and a circuit
+breaker. Once the breaker opens, calls fail at once while a background probe
+checks the service, and it closes again when a probe gets an answer.
+GuardedTransport applies a Guard to every request on an httpx client.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+import httpx
+
+import deadline
+import logs
+import metrics
+
+log = logs.get_logger("resilience")
+
+
+class Unavailable(httpx.TransportError):
+    """Raised instead of calling a service that is failing or saturated."""
+
+
+class Guard:
+    """Bulkhead, adaptive timeout and circuit breaker for one service.
+
+    The timeout is `timeout_multiplier` times the p95 of recent successful
+    calls, kept between `min_timeout` and `max_timeout` (and `max_timeout`
+    until there are enough samples to go on).
+    """
+
+    def __init__(self, service: str, max_concurrency: int = 8, min_timeout: float = 0.5,
+                 max_timeout: float = 5.0, timeout_multiplier: float = 2.0, failure_threshold: int = 5,
+                 probe_seconds: float = 10.0, window: int = 100):
+        self.service = service
+        self.max_concurrency = max_concurrency
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.failure_threshold = failure_threshold
+        self.probe_seconds = probe_seconds
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._probe: Optional[asyncio.Task] = None
+
+    @property
+    def open(self) -> bool:
+        return self.opened_at is not None
+
+    def timeout(self) -> float:
+        if len(self._latencies) < 20:
+            return self.max_timeout
+        ordered = sorted(self._latencies)
+        p95 = ordered[int(len(ordered) * 0.95)]
+        return min(self.max_timeout, max(self.min_timeout, p95 * self.timeout_multiplier))
+
+    def admit(self) -> float:
+        """Claim a slot for one call and return its timeout, or raise Unavailable."""
+        if self.open:
+            metrics.resilience_rejected.inc(self.service, "circuit_open")
+            raise Unavailable(f"{self.service} circuit open")
+        if self.in_flight >= self.max_concurrency:
+            metrics.resilience_rejected.inc(self.service, "bulkhead_full")
+            raise Unavailable(f"{self.service} has {self.in_flight} calls in flight")
+        self.in_flight += 1
+        return self.timeout()
+
+    def release(self, seconds: float, ok: Optional[bool], probe=None) -> None:
+        """Finish a call admitted by admit(); `probe` checks the service while the breaker is open.
+
+        `ok` is None for a call that says nothing about the service (cut short by its caller's deadline or cancelled).
+        """
+        self.in_flight -= 1
+        if ok is None:
+            return
+        if ok:
+            self._latencies.append(seconds)
+            self.consecutive_failures = 0
+            return
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold and not self.open:
+            self._trip(probe)
+
+    def _trip(self, probe) -> None:
+        self.opened_at = time.monotonic()
+        metrics.resilience_circuit_open.set(self.service, value=1)
+        log.warning("⚠️ Circuit opened, skipping service", extra={
+            "service": self.service, "failures": self.consecutive_failures,
+        })
+        if probe is not None:
+            self._probe = asyncio.create_task(self._probe_until_healthy(probe))
+
+    def _close(self) -> None:
+        down_for = time.monotonic() - self.opened_at
+        self.opened_at = None
+        self.consecutive_failures = 0
+        metrics.resilience_circuit_open.set(self.service, value=0)
+        log.info("✅ Circuit closed, service answering again", extra={
+            "service": self.service, "down_seconds": round(down_for, 1),
+        })
+
+    async def _probe_until_healthy(self, probe) -> None:
+        while self.open:
+            await asyncio.sleep(self.probe_seconds)
+            try:
+                async with asyncio.timeout(self.max_timeout):
+                    healthy = await probe()
+            except (httpx.HTTPError, TimeoutError):
+                healthy = False
+            except Exception:
+                # A broken probe must not end the loop, or the breaker would stay open for good
+                log.exception("❌ Probe failed", extra={"service": self.service})
+                healthy = False
+            metrics.resilience_probes.inc(self.service, "ok" if healthy else "failed")
+            if healthy:
+                self._close()
+
+    def stats(self) -> dict:
+        return {
+            "circuit_open": self.open,
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "timeout_seconds": round(self.timeout(), 3),
+        }
+
+
+class GuardedTransport(httpx.AsyncBaseTransport):
+    """httpx transport that sends every request through a Guard.
+
+    Timeouts, transport errors, 429s and 5xx responses count as failures.
+    While the breaker is open, `probe_path` (a cheap authenticated route) is
+    requested in the background with the last request's headers, and a
+    response that would not have counted as a failure closes it. A request made for a run with a
+    deadline gets no more than the run has left.
+    """
+
+    def __init__(self, guard: Guard, transport: httpx.AsyncBaseTransport, probe_path: str = "/healthz"):
+        self.guard = guard
+        self.probe_path = probe_path
+        self._transport = transport
+        self._origin: Optional[httpx.URL] = None
+        self._headers: Optional[httpx.Headers] = None
+
+    @staticmethod
+    def healthy(response: httpx.Response) -> bool:
+        return response.status_code < 500 and response.status_code != 429
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self._origin = request.url.copy_with(path="/", query=None, fragment=None)
+        self._headers = request.headers
+        if deadline.low():
+            metrics.deadline_exceeded.inc(self.guard.service)
+            raise Unavailable(f"no time left in this run for {self.guard.service}")
+        service_timeout = self.guard.admit()
+        timeout = deadline.limit(service_timeout)
+        start = time.perf_counter()
+        ok = False
+        try:
+            async with asyncio.timeout(timeout):
+                response = await self._transport.handle_async_request(request)
+            ok = self.healthy(response)
+            return response
+        except TimeoutError:
+            if timeout < service_timeout:
+                # The run ran out, not the service
+                ok = None
+                metrics.deadline_exceeded.inc(self.guard.service)
+            else:
+                metrics.resilience_timeouts.inc(self.guard.service)
+            raise httpx.ReadTimeout(f"{self.guard.service} took longer than {timeout:.2f}s", request=request)
+        except asyncio.CancelledError:
+            # The caller gave up (client disconnect, lost hedge); that says nothing about the service
+            ok = None
+            raise
+        finally:
+            self.guard.release(time.perf_counter() - start, ok, self._probe)
+
+    async def _probe(self) -> bool:
+        headers = {k: v for k, v in (self._headers or {}).items() if k.lower() not in ("content-length", "content-type")}
+        request = httpx.Request("GET", self._origin.join(self.probe_path), headers=headers)
+        response = await self._transport.handle_async_request(request)
+        await response.aclose()
+        return self.healthy(response)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -0,0 +1,131 @@
+"""
+Per-thread AG-UI state for DIONYSUS
+Every AG-UI run gets its own state object, copied from a frozen default.
+"""
+import time
+from collections import OrderedDict
+from typing import Generic, Optional, TypeVar
+
+from pydantic import BaseModel
+from pydantic_ai.ag_ui import StateDeps
+
+S = TypeVar("S", bound=BaseModel)
+
+
+class _Session:
+    __slots__ = ("snapshot", "size", "touched")
+
+    def __init__(self, snapshot: dict, size: int, touched: float):
+        self.snapshot = snapshot
+        self.size = size
+        self.touched = touched
+
+
+class SessionStateStore(Generic[S]):
+    """Bounded store of per-thread state snapshots.
+
+    The default state is dumped once and never handed out directly: each run
+    validates a fresh instance from the snapshot (copy-on-write), and only
+    threads whose state differs from the default are kept. Entries expire
+    after `ttl_seconds` and the least recently used ones are evicted when
+    either `max_sessions` or `max_bytes` (serialized JSON size) is exceeded.
+
+    All methods are synchronous and never await, so no lock is needed under
+    the single event loop uvicorn runs us on.
+    """
+
+    def __init__(
+        self,
+        default: S,
+        ttl_seconds: float = 1800,
+        max_sessions: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self._model = type(default)
+        self._default = default.model_dump()
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def new_state(self, thread_id: Optional[str] = None) -> S:
+        """Return a private state for a run, resuming the thread if we know it."""
+        session = self._get(thread_id)
+        return self._model.model_validate(session.snapshot if session else self._default)
+
+    def new_deps(self, thread_id: Optional[str] = None) -> StateDeps[S]:
+        return StateDeps(self.new_state(thread_id))
+
+    def snapshot(self, thread_id: Optional[str]) -> Optional[dict]:
+        """Last committed state for a thread, or None if it only has the default."""
+        session = self._get(thread_id)
+        return session.snapshot if session else None
+
+    def commit(self, thread_id: Optional[str], state: S) -> None:
+        """Remember a run's final state for its thread."""
+        if not thread_id:
+            return
+        snapshot = state.model_dump()
+        self._drop(thread_id)
+        if snapshot == self._default:
+            return
+        size = len(state.model_dump_json())
+        self._sessions[thread_id] = _Session(snapshot, size, time.monotonic())
+        self._bytes += size
+        self._evict()
+
+    def discard(self, thread_id: Optional[str]) -> None:
+        if thread_id:
+            self._drop(thread_id)
+
+    def stats(self) -> dict:
+        self._expire()
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "maxSessions": self.max_sessions,
+            "maxBytes": self.max_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _get(self, thread_id: Optional[str]) -> Optional[_Session]:
+        if not thread_id:
+            return None
+        session = self._sessions.get(thread_id)
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.touched > self.ttl_seconds:
+            self._drop(thread_id)
+            self.expirations += 1
+            return None
+        session.touched = now
+        self._sessions.move_to_end(thread_id)
+        return session
+
+    def _drop(self, thread_id: str) -> None:
+        session = self._sessions.pop(thread_id, None)
+        if session is not None:
+            self._bytes -= session.size
+
+    def _expire(self) -> None:
+        cutoff = time.monotonic() - self.ttl_seconds
+        while self._sessions:
+            thread_id, session = next(iter(self._sessions.items()))
+            if session.touched >= cutoff:
+                break
+            self._drop(thread_id)
+            self.expirations += 1
+
+    def _evict(self) -> None:
+        self._expire()
+        while self._sessions and (
+            len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+        ):
+            thread_id = next(iter(self._sessions))
+            self._drop(thread_id)
+            self.evictions += 1
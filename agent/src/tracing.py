@@ -0,0 +1,95 @@
+"""
+Tracing for DIONYSUS
+Logfire/OpenTelemetry spans for AG-UI runs, voice turns, tools, SQL, Zep and Groq.
+
+Tracing is enabled when LOGFIRE_TOKEN is set (Logfire) or
+OTEL_EXPORTER_OTLP_ENDPOINT points at a collector, e.g. a local one on
+http://localhost:4318. Without either, `span()` is a free no-op.
+"""
+import os
+
+from metrics import MeteredCursor
+
+TRACING_ENABLED = bool(
+    os.getenv("LOGFIRE_TOKEN")
+    or os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+    or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT")
+)
+# Fraction of traces started (head sampling)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+# When set, unsampled traces are still kept if they error or run this long
+TRACE_SLOW_SECONDS = os.getenv("TRACE_SLOW_SECONDS")
+
+_logfire = None
+
+
+def configure(app) -> bool:
+    """Configure Logfire and instrument the FastAPI app, Pydantic AI and httpx."""
+    global _logfire
+    if not TRACING_ENABLED:
+        return False
+
+    import logfire
+
+    if TRACE_SLOW_SECONDS:
+        sampling = logfire.SamplingOptions.level_or_duration(
+            head=1.0,
+            duration_threshold=float(TRACE_SLOW_SECONDS),
+            background_rate=TRACE_SAMPLE_RATE,
+        )
+    else:
+        sampling = logfire.SamplingOptions(head=TRACE_SAMPLE_RATE)
+
+    logfire.configure(
+        service_name="dionysus-agent",
+        send_to_logfire="if-token-present",
+        console=False,
+        inspect_arguments=False,
+        sampling=sampling,
+    )
+    # Root span per AG-UI run / voice turn
+    logfire.instrument_fastapi(app, excluded_urls="/health,/metrics")
+    # Agent run, Groq completion and tool call spans
+    logfire.instrument_pydantic_ai()
+    # Zep and Groq HTTP hops
+    logfire.instrument_httpx()
+    _logfire = logfire
+    return True
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """Child span of the current trace, or a shared no-op when tracing is off."""
+    if _logfire is None:
+        return _NOOP_SPAN
+    return _logfire.span(name, **attributes)
+
+
+class TracedCursor(MeteredCursor):
+    """Metered cursor that also emits one span per statement with its row count."""
+
+    def execute(self, query, vars=None):
+        if _logfire is None:
+            return super().execute(query, vars)
+        statement = query if isinstance(query, str) else query.decode(errors="replace")
+        operation = statement.split(None, 1)[0].upper() if statement.strip() else ""
+        with _logfire.span("sql {operation}", operation=operation, **{
+            "db.system": "postgresql",
+            "db.statement": " ".join(statement.split()),
+        }) as sql_span:
+            result = super().execute(query, vars)
+            sql_span.set_attribute("db.rows", self.rowcount)
+            return result